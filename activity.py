@@ -0,0 +1,117 @@
+"""Per-channel activity features (message rate, last bot reply, recent speakers) kept current per message"""
+import math
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+ACTIVITY_HALF_LIFE = float(os.getenv('ACTIVITY_HALF_LIFE', '60'))  # Seconds for a burst's weight to halve
+PARTICIPANT_WINDOW = 300  # Seconds since a user's last message for them to count as active
+MAX_PARTICIPANTS = 32  # Distinct recent speakers tracked per channel; beyond this a channel is just "crowded"
+MAX_ACTIVITY_CHANNELS = int(os.getenv('MAX_ACTIVITY_CHANNELS', '20000'))  # Channels tracked before the least recent is dropped
+
+ActivityFeatures = namedtuple('ActivityFeatures', ['messages_per_minute', 'seconds_since_bot_reply', 'participants'])
+QUIET_CHANNEL = ActivityFeatures(0.0, math.inf, 0)
+
+
+class ChannelActivity:
+    """Decayed message rate, last bot reply and recent speakers for one channel
+
+    The rate is stored as of `updated`. Each message first decays it to the message's time and
+    then adds 1/tau, which keeps it an estimate of messages per second. Reads decay a copy and
+    leave the stored value alone.
+    """
+    __slots__ = ('message_rate', 'updated', 'last_bot_reply', 'speakers')
+
+    def __init__(self, now):
+        self.message_rate = 0.0
+        self.updated = now
+        self.last_bot_reply = None
+        self.speakers = OrderedDict()  # user_id -> time of last message, oldest first
+
+    def decay(self, now, tau):
+        if now > self.updated:
+            self.message_rate *= math.exp((self.updated - now) / tau)
+            self.updated = now
+
+    def participants(self, now):
+        """Speakers seen within PARTICIPANT_WINDOW, dropping expired ones from the front as it goes"""
+        speakers = self.speakers
+        cutoff = now - PARTICIPANT_WINDOW
+        while speakers:
+            user_id = next(iter(speakers))
+            if speakers[user_id] > cutoff:
+                break
+            del speakers[user_id]
+        return len(speakers)
+
+
+class ActivityTracker:
+    """ChannelActivity per channel in least-recently-active order; every update is O(1) amortized
+
+    A channel that has been quiet for ten half-lives reads the same as one never seen, so a
+    couple of those are dropped from the front on every update and MAX_ACTIVITY_CHANNELS caps
+    the rest.
+    """
+
+    def __init__(self, half_life=ACTIVITY_HALF_LIFE, max_channels=MAX_ACTIVITY_CHANNELS):
+        self.tau = half_life / math.log(2)
+        self.idle_after = max(PARTICIPANT_WINDOW, 10 * half_life)
+        self.max_channels = max_channels
+        self.channels = OrderedDict()  # channel_id -> ChannelActivity
+        self.evictions = 0
+
+    def _touch(self, channel_id, now):
+        self._evict_idle(now)
+        activity = self.channels.get(channel_id)
+        if activity is None:
+            activity = self.channels[channel_id] = ChannelActivity(now)
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.channels.move_to_end(channel_id)
+            activity.decay(now, self.tau)
+        return activity
+
+    def _evict_idle(self, now, limit=2):
+        channels = self.channels
+        for _ in range(limit):
+            if not channels:
+                return
+            channel_id = next(iter(channels))
+            if now - channels[channel_id].updated < self.idle_after:
+                return
+            del channels[channel_id]
+            self.evictions += 1
+
+    def record_message(self, channel_id, user_id, now=None):
+        now = time.monotonic() if now is None else now
+        activity = self._touch(channel_id, now)
+        activity.message_rate += 1 / self.tau
+        speakers = activity.speakers
+        speakers[user_id] = now
+        speakers.move_to_end(user_id)
+        if len(speakers) > MAX_PARTICIPANTS:
+            speakers.popitem(last=False)
+
+    def record_bot_reply(self, channel_id, now=None):
+        now = time.monotonic() if now is None else now
+        self._touch(channel_id, now).last_bot_reply = now
+
+    def features(self, channel_id, now=None):
+        """Current ActivityFeatures for the channel (QUIET_CHANNEL if nothing was seen there)"""
+        activity = self.channels.get(channel_id)
+        if activity is None:
+            return QUIET_CHANNEL
+        now = time.monotonic() if now is None else now
+        return ActivityFeatures(
+            activity.message_rate * math.exp(min(0.0, activity.updated - now) / self.tau) * 60,
+            math.inf if activity.last_bot_reply is None else now - activity.last_bot_reply,
+            activity.participants(now),
+        )
+
+    def stats(self):
+        return {
+            'channels': len(self.channels),
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,289 @@
+"""Inference backends: hosted HTTP API, local CPU model in a process pool, deterministic stub"""
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import local_worker
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL_NAME = os.getenv('LOCAL_MODEL_NAME', 'microsoft/DialoGPT-small')
+LOCAL_MODEL_WORKERS = int(os.getenv('LOCAL_MODEL_WORKERS', str(os.cpu_count() or 1)))
+LOCAL_MODEL_THREADS = int(os.getenv('LOCAL_MODEL_THREADS', '1'))  # Torch threads per worker process
+STUB_LATENCY = float(os.getenv('STUB_LATENCY', '0'))  # Seconds the stub pretends to think
+STUB_TOKEN_DELAY = float(os.getenv('STUB_TOKEN_DELAY', '0'))  # Seconds between streamed stub tokens
+
+
+class InferenceError(Exception):
+    """Raised when a backend fails to produce text"""
+
+    def __init__(self, status, message=None, retry_after=None, estimated_time=None):
+        super().__init__(message or f"inference backend returned {status}")
+        self.status = status
+        self.retry_after = retry_after
+        self.estimated_time = estimated_time
+
+
+class InferenceBackend:
+    """Interface: generate() takes a list of prompts and returns generated_text for each"""
+    name = 'base'
+    supports_batching = False
+    supports_streaming = False
+
+    async def start(self):
+        pass
+
+    async def generate(self, prompts, parameters):
+        raise NotImplementedError
+
+    async def stream(self, prompt, parameters):
+        """Yield the continuation of prompt piece by piece (default: all at once)"""
+        text = (await self.generate([prompt], parameters))[0]
+        yield text[len(prompt):] if text.startswith(prompt) else text
+
+    def stats(self):
+        return {}
+
+    def describe(self):
+        return self.name
+
+    async def close(self):
+        pass
+
+
+class RemoteBackend(InferenceBackend):
+    """Hugging Face hosted inference API over the shared HTTP pool"""
+    name = 'remote'
+    supports_streaming = True
+
+    def __init__(self, http_pool, api_url, token, timeout, batching=True):
+        self.http_pool = http_pool
+        self.api_url = api_url
+        self.token = token
+        self.timeout = timeout
+        self.supports_batching = batching
+        self.requests = 0
+        self.errors = 0
+
+    def describe(self):
+        return self.api_url.rsplit('/models/', 1)[-1]
+
+    async def _post(self, inputs, parameters):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        payload = {"inputs": inputs, "parameters": parameters}
+        self.requests += 1
+        async with self.http_pool.session.post(self.api_url, headers=headers, json=payload,
+                                               timeout=self.http_pool.timeout(self.timeout)) as response:
+            if response.status != 200:
+                self.errors += 1
+                raise await self._error_from(response)
+            return await response.json()
+
+    @staticmethod
+    async def _error_from(response):
+        retry_after = estimated_time = None
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            pass
+        try:
+            body = await response.json(content_type=None)
+            if isinstance(body, dict):
+                estimated_time = body.get('estimated_time')
+        except Exception:
+            pass
+        return InferenceError(response.status, retry_after=retry_after, estimated_time=estimated_time)
+
+    @staticmethod
+    def _extract_generated_text(item):
+        """Pull generated_text out of one entry of an inference API response"""
+        if isinstance(item, list):
+            item = item[0] if item else {}
+        if isinstance(item, dict):
+            return item.get('generated_text', '')
+        return ''
+
+    async def generate(self, prompts, parameters):
+        if len(prompts) > 1 and self.supports_batching:
+            try:
+                result = await self._post(list(prompts), parameters)
+                if isinstance(result, list) and len(result) == len(prompts):
+                    return [self._extract_generated_text(item) for item in result]
+                logger.warning("⚠️ Batched inference returned an unexpected shape, disabling batching")
+            except InferenceError as e:
+                if e.status not in (400, 422):
+                    raise
+                logger.warning(f"⚠️ Backend rejected batched inputs ({e.status}), disabling batching")
+            self.supports_batching = False
+
+        results = await asyncio.gather(*(self._post(prompt, parameters) for prompt in prompts))
+        return [self._extract_generated_text(result) for result in results]
+
+    async def stream(self, prompt, parameters):
+        """Server-sent token events (text-generation-inference protocol)"""
+        headers = {"Authorization": f"Bearer {self.token}", "Accept": "text/event-stream"}
+        payload = {"inputs": prompt, "parameters": parameters, "stream": True}
+        self.requests += 1
+        async with self.http_pool.session.post(self.api_url, headers=headers, json=payload,
+                                               timeout=self.http_pool.timeout(self.timeout)) as response:
+            if response.status != 200:
+                self.errors += 1
+                raise await self._error_from(response)
+
+            if response.content_type != 'text/event-stream':
+                # Endpoint ignored "stream"; hand back the whole continuation at once
+                text = self._extract_generated_text(await response.json())
+                yield text[len(prompt):] if text.startswith(prompt) else text
+                return
+
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                event = json.loads(line[5:])
+                token = event.get('token') or {}
+                if token.get('text') and not token.get('special'):
+                    yield token['text']
+                if event.get('generated_text') is not None:
+                    break
+
+    def stats(self):
+        return {'requests': self.requests, 'errors': self.errors, 'batching': self.supports_batching}
+
+
+# --- Local model (runs inside worker processes) ---
+
+class LocalBackend(InferenceBackend):
+    """In-process CPU model; generation runs in a process pool so the event loop never blocks"""
+    name = 'local'
+    supports_batching = True
+
+    def __init__(self, model_name=LOCAL_MODEL_NAME, workers=LOCAL_MODEL_WORKERS, threads=LOCAL_MODEL_THREADS):
+        self.model_name = model_name
+        self.workers = workers
+        self.threads = threads
+        self._executor = None
+        self._start_lock = asyncio.Lock()
+        self.generations = 0
+        self.new_tokens = 0
+        self.cpu_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.load_seconds = None
+
+    def describe(self):
+        return f"{self.model_name} (local, {self.workers} workers)"
+
+    async def start(self):
+        """Spawn workers and warm every one of them so the first reply doesn't pay for model load"""
+        async with self._start_lock:
+            if self._executor is not None:
+                return
+            if importlib.util.find_spec('transformers') is None or importlib.util.find_spec('torch') is None:
+                raise RuntimeError("INFERENCE_BACKEND=local needs the optional `transformers` and `torch` packages")
+            started = time.perf_counter()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=local_worker.load_model,
+                initargs=(self.model_name, self.threads),
+            )
+            loop = asyncio.get_running_loop()
+            warmup = {'max_new_tokens': 1, 'do_sample': False}
+            await asyncio.gather(*(
+                loop.run_in_executor(self._executor, local_worker.generate, ['Hello'], warmup)
+                for _ in range(self.workers)
+            ))
+            self.load_seconds = time.perf_counter() - started
+            logger.info(f"🧠 Local model {self.model_name} warm in {self.load_seconds:.1f}s")
+
+    async def generate(self, prompts, parameters):
+        if self._executor is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            texts, new_tokens, cpu_seconds = await loop.run_in_executor(
+                self._executor, local_worker.generate, list(prompts), parameters)
+        except Exception as e:
+            raise InferenceError(500, f"local generation failed: {e}") from e
+        self.generations += len(prompts)
+        self.new_tokens += new_tokens
+        self.cpu_seconds += cpu_seconds
+        self.wall_seconds += time.perf_counter() - started
+        return texts
+
+    def stats(self):
+        return {
+            'generations': self.generations,
+            'new_tokens': self.new_tokens,
+            'tokens_per_cpu_second': self.new_tokens / self.cpu_seconds if self.cpu_seconds else 0.0,
+            'load_seconds': self.load_seconds,
+        }
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class StubBackend(InferenceBackend):
+    """Deterministic canned replies for tests and benchmarks (no network, no model)"""
+    name = 'stub'
+    supports_batching = True
+    supports_streaming = True
+
+    REPLIES = [
+        "That's a really interesting thought, tell me more about it.",
+        "I think so too, it makes a lot of sense when you put it that way.",
+        "Honestly I'm not sure, but I'd love to hear what everyone else thinks.",
+        "Ha, that reminds me of something I read the other day.",
+        "Good question! It depends a lot on what you're trying to do.",
+    ]
+
+    def __init__(self, latency=STUB_LATENCY, token_delay=STUB_TOKEN_DELAY):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.generations = 0
+        self.new_tokens = 0
+
+    def reply_for(self, prompt):
+        digest = hashlib.blake2b(prompt.encode('utf-8'), digest_size=4).digest()
+        return self.REPLIES[int.from_bytes(digest, 'big') % len(self.REPLIES)]
+
+    async def generate(self, prompts, parameters):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        replies = [self.reply_for(prompt) for prompt in prompts]
+        self.generations += len(prompts)
+        self.new_tokens += sum(len(reply.split()) for reply in replies)
+        return [f"{prompt} {reply}" for prompt, reply in zip(prompts, replies)]
+
+    async def stream(self, prompt, parameters):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.generations += 1
+        for word in self.reply_for(prompt).split():
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            self.new_tokens += 1
+            yield f" {word}"
+
+    def stats(self):
+        return {'generations': self.generations, 'new_tokens': self.new_tokens}
+
+
+def create_backend(name, http_pool, api_url, token, timeout, batching=True):
+    """Build the backend selected by INFERENCE_BACKEND"""
+    if name == 'remote':
+        return RemoteBackend(http_pool, api_url, token, timeout, batching=batching)
+    if name == 'local':
+        return LocalBackend()
+    if name == 'stub':
+        return StubBackend()
+    raise ValueError(f"unknown inference backend {name!r} (expected remote, local or stub)")
@@ -0,0 +1,82 @@
+"""Measure generation throughput (tokens/sec, and per core) for an inference backend
+
+Usage: python benchmarks/bench_backend.py [--backend stub|local] [--prompts 64] [--batch 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import LocalBackend, StubBackend  # noqa: E402
+
+PROMPTS = [
+    "Human (alex): what do you think about pineapple on pizza?\nAI:",
+    "Human (sam): hey bot, any advice for learning python?\nAI:",
+    "Human (kim): why is the sky blue?\nAI:",
+    "Human (jo): tell me a fun fact about space\nAI:",
+]
+
+
+async def run(backend, prompts, batch_size, concurrency, max_new_tokens):
+    parameters = {"max_new_tokens": max_new_tokens, "temperature": 0.8, "do_sample": True,
+                  "top_p": 0.9, "repetition_penalty": 1.1}
+    batches = [
+        [PROMPTS[(i + j) % len(PROMPTS)] for j in range(batch_size)]
+        for i in range(0, prompts, batch_size)
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(batch):
+        async with semaphore:
+            await backend.generate(batch, parameters)
+
+    start_load = time.perf_counter()
+    await backend.start()
+    load_time = time.perf_counter() - start_load
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(batch) for batch in batches))
+    elapsed = time.perf_counter() - start
+    await backend.close()
+    return load_time, elapsed, time.process_time() - cpu_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['stub', 'local'], default='stub')
+    parser.add_argument('--prompts', type=int, default=64)
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='local backend processes')
+    parser.add_argument('--max-new-tokens', type=int, default=40)
+    parser.add_argument('--model', default=None, help='local model name (default LOCAL_MODEL_NAME)')
+    args = parser.parse_args()
+
+    if args.backend == 'local':
+        backend = LocalBackend(workers=args.workers, **({'model_name': args.model} if args.model else {}))
+        cores = args.workers
+    else:
+        backend = StubBackend()
+        cores = 1
+
+    load_time, elapsed, loop_cpu = asyncio.run(
+        run(backend, args.prompts, args.batch, concurrency=cores, max_new_tokens=args.max_new_tokens))
+    stats = backend.stats()
+    tokens = stats['new_tokens']
+
+    print(f"backend:            {backend.describe()}")
+    print(f"warm start:         {load_time:.2f}s")
+    print(f"prompts:            {stats['generations']} in {elapsed:.2f}s")
+    print(f"new tokens:         {tokens}")
+    print(f"tokens/sec:         {tokens / elapsed:.1f}")
+    print(f"tokens/sec/core:    {tokens / elapsed / cores:.1f}")
+    if 'tokens_per_cpu_second' in stats:
+        print(f"tokens/cpu-second:  {stats['tokens_per_cpu_second']:.1f} (measured inside workers)")
+    print(f"event loop CPU:     {loop_cpu:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
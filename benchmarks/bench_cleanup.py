@@ -0,0 +1,93 @@
+"""Compare the old full-scan conversation cleanup with the activity-ordered expiry
+
+Usage: python benchmarks/bench_cleanup.py [--sizes 10000 100000 1000000] [--expired 0.01]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversations import SmartConversationManager  # noqa: E402
+
+TIMEOUT = 600
+
+
+def build_legacy(size, expired):
+    """The original layout: string keys, dict records, datetime timestamps"""
+    now = datetime.now()
+    conversations = {}
+    for i in range(size):
+        age = TIMEOUT + 60 if i < expired else random.uniform(0, TIMEOUT - 60)
+        conversations[f"{i}_{i % 997}"] = {
+            'history': deque(maxlen=8),
+            'last_activity': now - timedelta(seconds=age),
+            'message_count': 0,
+            'user_name': '',
+            'personality_score': 0.8,
+            'topics': set(),
+        }
+    return conversations
+
+
+def legacy_cleanup(conversations):
+    expired = []
+    for key, conv in conversations.items():
+        if datetime.now() - conv['last_activity'] > timedelta(seconds=TIMEOUT):
+            expired.append(key)
+
+    for key in expired:
+        del conversations[key]
+
+    return len(expired)
+
+
+def build_current(size, expired):
+    manager = SmartConversationManager(timeout=TIMEOUT, memory_budget=float('inf'))
+    now = time.monotonic()
+    # Records enter in activity order, oldest first, exactly as add_message leaves them
+    ages = sorted((TIMEOUT + 60 if i < expired else random.uniform(0, TIMEOUT - 60) for i in range(size)),
+                  reverse=True)
+    for i, age in enumerate(ages):
+        conv = manager.get_conversation(i, i % 997)
+        conv.last_activity = now - age
+    return manager
+
+
+def timed(fn, *args):
+    gc.collect()
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--expired', type=float, default=0.01, help='fraction of conversations past the timeout')
+    args = parser.parse_args()
+
+    print(f"{'conversations':>14} {'expired':>9} {'legacy ms':>11} {'indexed ms':>11} {'speedup':>9}")
+    for size in args.sizes:
+        expired = int(size * args.expired)
+
+        legacy = build_legacy(size, expired)
+        legacy_time, legacy_removed = timed(legacy_cleanup, legacy)
+        del legacy
+
+        manager = build_current(size, expired)
+        current_time, current_removed = timed(manager.cleanup_expired)
+        del manager
+
+        assert legacy_removed == current_removed == expired
+        speedup = legacy_time / current_time if current_time else float('inf')
+        print(f"{size:>14,} {expired:>9,} {legacy_time * 1000:>11.2f} {current_time * 1000:>11.3f} {speedup:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""CPU per 1k gateway events with and without the raw-payload gateway filter
+
+Feeds synthetic MESSAGE_CREATE and MESSAGE_REACTION_ADD payloads through the bot's own parsers
+and handlers, the same path the gateway uses. The mix: human chatter, other bots, our own
+messages, and reactions (a few of them on our messages). Every (user, channel) pair is marked
+as already being replied to. So on_message stops right after deciding, and both runs measure
+only the work of getting to a decision.
+
+Usage: python benchmarks/bench_gateway.py [--events 100000] [--mentions 0.02] [--bots 0.1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOT_ID = 1
+GUILDS = 50
+CHANNELS = 5
+USERS = 2000
+WORDS = ['hello', 'anyone', 'playing', 'tonight', 'python', 'weather', 'great', 'idea', 'lol', 'what', 'think',
+         'about', 'games', 'music', 'really', 'the', 'this', 'that', 'pizza', 'help']
+
+
+def user_payload(user_id, bot=False):
+    return {'id': str(user_id), 'username': f'user{user_id}', 'global_name': None, 'discriminator': '0',
+            'avatar': None, 'bot': bot, 'public_flags': 0}
+
+
+def member_payload(user_id):
+    return {'roles': [], 'nick': None, 'avatar': None, 'joined_at': '2023-01-01T00:00:00+00:00', 'deaf': False,
+            'mute': False, 'flags': 0, 'pending': False, 'premium_since': None, 'communication_disabled_until': None}
+
+
+def guild_payload(guild_id):
+    return {
+        'id': str(guild_id), 'name': f'guild{guild_id}', 'owner_id': '2', 'unavailable': False, 'member_count': 5000,
+        'large': True, 'members': [dict(member_payload(BOT_ID), user=user_payload(BOT_ID, bot=True))],
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(guild_id * 100 + i), 'type': 0, 'name': f'chat{i}', 'position': i,
+                      'permission_overwrites': []} for i in range(CHANNELS)],
+        'features': [], 'emojis': [], 'stickers': [], 'threads': [], 'voice_states': [], 'presences': [],
+        'stage_instances': [], 'guild_scheduled_events': [],
+    }
+
+
+def message_payload(message_id, guild_id, channel_id, author_id, content, bot=False, mentions=()):
+    return {
+        'id': str(message_id), 'channel_id': str(channel_id), 'guild_id': str(guild_id), 'type': 0,
+        'content': content, 'author': user_payload(author_id, bot), 'member': member_payload(author_id),
+        'mentions': [dict(user_payload(user_id, user_id == BOT_ID), member=member_payload(user_id))
+                     for user_id in mentions],
+        'mention_roles': [], 'mention_everyone': False, 'attachments': [], 'embeds': [], 'components': [],
+        'pinned': False, 'tts': False, 'flags': 0, 'nonce': str(message_id),
+        'timestamp': '2024-01-01T00:00:00+00:00', 'edited_timestamp': None,
+    }
+
+
+def reaction_payload(message_id, guild_id, channel_id, user_id):
+    return {'user_id': str(user_id), 'message_id': str(message_id), 'channel_id': str(channel_id),
+            'guild_id': str(guild_id), 'emoji': {'id': None, 'name': '👍'}, 'member': dict(
+                member_payload(user_id), user=user_payload(user_id)), 'burst': False, 'type': 0}
+
+
+def workload(events, mentions, bots, reactions, own_reactions, seed):
+    """List of (event name, payload); our own messages are spread through it so reactions can target them"""
+    rng = random.Random(seed)
+    own, others, result = [], [], []
+    for i in range(events):
+        message_id = 10_000_000 + i
+        guild_id = rng.randint(1, GUILDS)
+        channel_id = guild_id * 100 + rng.randrange(CHANNELS)
+        roll = rng.random()
+        if roll < reactions and others:
+            target = rng.choice(own) if own and rng.random() < own_reactions else rng.choice(others)
+            result.append(('MESSAGE_REACTION_ADD', reaction_payload(target, guild_id, channel_id,
+                                                                    rng.randint(10, USERS))))
+            continue
+        if roll < reactions + 0.01:
+            author, is_bot = BOT_ID, True
+            own.append(message_id)
+        elif roll < reactions + 0.01 + bots:
+            author, is_bot = rng.randint(USERS + 1, USERS + 20), True
+        else:
+            author, is_bot = rng.randint(10, USERS), False
+        others.append(message_id)
+        content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 20)))
+        mentioned = (BOT_ID,) if rng.random() < mentions else ()
+        result.append(('MESSAGE_CREATE', message_payload(message_id, guild_id, channel_id, author, content,
+                                                         is_bot, mentioned)))
+    return result
+
+
+async def run(args, filtered):
+    import discord
+    import main
+
+    bot = main.bot
+    await bot._async_setup_hook()
+    state = bot._connection
+    if filtered:
+        main.gateway_filter.install(state)
+    # Logged in with guilds already available, without dispatching ready or guild_join
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID, bot=True))
+    for guild_id in range(1, GUILDS + 1):
+        state._add_guild_from_data(guild_payload(guild_id))
+    for guild_id in range(1, GUILDS + 1):
+        for i in range(CHANNELS):
+            for user_id in range(10, USERS + 1):
+                main.convo_manager.active_responses.add((user_id, guild_id * 100 + i))
+
+    events = workload(args.events, args.mentions, args.bots, args.reactions, args.own_reactions, args.seed)
+    parsers = state.parsers
+    this = asyncio.current_task()
+    started = time.process_time()
+    for index, (name, payload) in enumerate(events, 1):
+        parsers[name](payload)
+        if index % 500 == 0:
+            # Run the handlers discord.py scheduled, as the gateway loop would between frames
+            await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not this))
+    await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not this))
+    cpu = time.process_time() - started
+
+    return {
+        'cpu_ms_per_1k': cpu / len(events) * 1e6,
+        'decisions': {labels[0]: value for labels, value in main.MESSAGES._values.items()},
+        'gateway': main.gateway_filter.stats(),
+    }
+
+
+def run_mode(args, filtered):
+    # A fresh interpreter per mode so the second run doesn't inherit the first one's caches
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', 'filtered' if filtered else 'plain',
+                             '--events', str(args.events), '--mentions', str(args.mentions), '--bots', str(args.bots),
+                             '--reactions', str(args.reactions), '--own-reactions', str(args.own_reactions),
+                             '--seed', str(args.seed)],
+                            capture_output=True, text=True, check=True, env=dict(os.environ, GATEWAY_FILTER='0'))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100_000)
+    parser.add_argument('--mentions', type=float, default=0.02, help='fraction of messages that mention the bot')
+    parser.add_argument('--bots', type=float, default=0.1, help='fraction of events from other bots')
+    parser.add_argument('--reactions', type=float, default=0.15, help='fraction of events that are reactions')
+    parser.add_argument('--own-reactions', type=float, default=0.05, help='fraction of reactions on our messages')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--worker', choices=['plain', 'filtered'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run(args, args.worker == 'filtered'))))
+        return
+
+    plain = run_mode(args, filtered=False)
+    filtered = run_mode(args, filtered=True)
+    print(f"events            {args.events:,}")
+    print(f"decisions         {filtered['decisions']}")
+    print(f"dropped raw       {filtered['gateway']['messages_dropped']:,} messages, "
+          f"{filtered['gateway']['reactions_dropped']:,} reactions")
+    print(f"CPU per 1k events {plain['cpu_ms_per_1k']:.1f} ms -> {filtered['cpu_ms_per_1k']:.1f} ms "
+          f"({plain['cpu_ms_per_1k'] / filtered['cpu_ms_per_1k']:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
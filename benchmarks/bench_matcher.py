@@ -0,0 +1,131 @@
+"""Microbenchmark: legacy substring scans vs the precompiled MessageMatcher
+
+Usage: python benchmarks/bench_matcher.py [--messages 100000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import DEFAULT_ENGAGEMENT_KEYWORDS, DEFAULT_TRIGGER_PHRASES, MessageMatcher  # noqa: E402
+
+# Chat-like fragments; several contain 'ai'/'bot' inside other words on purpose
+FRAGMENTS = [
+    "lol", "same", "gg", "brb", "ok sounds good", "did you see that", "I said maybe later",
+    "it's gonna rain again", "who's playing tonight?", "the bottle broke", "that was wild",
+    "my train is late", "anyone up for a game", "what do you think about the new patch",
+    "this bot is funny", "hey bot how are you", "AI art is getting wild", "detailed explanation please",
+    "I feel like pizza", "should we start the raid", "robots will take over lol", "main character energy",
+    "can someone help me with my homework", "ngl that's a great opinion", "thoughts on the trailer?",
+    "email me the details", "i'm waiting for the bus", "artificial sweeteners are weird",
+    "why is the server lagging", "everybody join vc", "nice", "😂😂😂", "https://example.com/abc",
+]
+
+
+def build_corpus(size, seed=1234):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = rng.choices(FRAGMENTS, k=rng.choice((1, 1, 1, 2, 2, 3, 5)))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def legacy_classify(content):
+    """The keyword part of what on_message and should_respond_randomly used to do"""
+    lowered = content.lower()
+    keyword_matches = sum(1 for word in DEFAULT_ENGAGEMENT_KEYWORDS if word in lowered)
+    contains_trigger = any(phrase in content.lower() for phrase in DEFAULT_TRIGGER_PHRASES)
+    return contains_trigger, keyword_matches
+
+
+# should_respond_randomly's numbers for a quiet channel
+RANDOM_CHANCE = 0.12
+LOAD_MULTIPLIER = 1.2
+
+
+def make_legacy_decide(context, rng):
+    def decide(content):
+        # should_respond_randomly ran for every message, before the trigger check
+        recent_messages = list(context)[-5:]
+        bot_recently_active = any("Bot:" in msg for msg in recent_messages)
+        contains_trigger, keyword_matches = legacy_classify(content)
+        chance = (RANDOM_CHANCE + keyword_matches * 0.03 + min(len(content) / 200, 0.08)) * LOAD_MULTIPLIER
+        should_random_respond = not bot_recently_active and rng.random() < min(chance, 0.4)
+        return contains_trigger or should_random_respond
+    return decide
+
+
+def make_matcher_decide(matcher, context, rng):
+    def decide(content):
+        # decide_reply: trigger search first, then the random roll, counting keywords only if it matters
+        if matcher.has_trigger(content):
+            return True
+        if any("Bot:" in msg for msg in islice(reversed(context), 5)):
+            return False
+        length_bonus = min(len(content) / 200, 0.08)
+
+        def chance(engagement):
+            return min((RANDOM_CHANCE + engagement * 0.03 + length_bonus) * LOAD_MULTIPLIER, 0.4)
+
+        roll = rng.random()
+        if roll < chance(0):
+            return True
+        if roll >= chance(matcher.max_engagement):
+            return False
+        return roll < chance(matcher.engagement_count(content))
+    return decide
+
+
+def legacy_has_trigger(content):
+    return any(phrase in content.lower() for phrase in DEFAULT_TRIGGER_PHRASES)
+
+
+def bench(fn, corpus, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in corpus:
+            fn(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages)
+    matcher = MessageMatcher()
+
+    context = deque((f"user{i}: {content[:100]}" for i, content in enumerate(corpus[:15])), maxlen=15)
+
+    legacy_trigger_time = bench(legacy_has_trigger, corpus, args.repeat)
+    matcher_trigger_time = bench(matcher.has_trigger, corpus, args.repeat)
+    legacy_decide_time = bench(make_legacy_decide(context, random.Random(1)), corpus, args.repeat)
+    matcher_decide_time = bench(make_matcher_decide(matcher, context, random.Random(1)), corpus, args.repeat)
+
+    legacy_triggers = sum(1 for content in corpus if legacy_has_trigger(content))
+    matcher_triggers = sum(1 for content in corpus if matcher.has_trigger(content))
+
+    per_message = lambda total: total / len(corpus) * 1e6
+    print(f"messages:                {len(corpus):,}")
+    print(f"trigger check     legacy:  {per_message(legacy_trigger_time):.2f} µs/msg  "
+          f"({legacy_triggers:,} flagged as triggers)")
+    print(f"                  matcher: {per_message(matcher_trigger_time):.2f} µs/msg  "
+          f"({matcher_triggers:,} flagged as triggers)")
+    print(f"decide path       legacy:  {per_message(legacy_decide_time):.2f} µs/msg")
+    print(f"                  matcher: {per_message(matcher_decide_time):.2f} µs/msg "
+          f"({legacy_decide_time / matcher_decide_time:.2f}x)")
+    print(f"false triggers removed:  {legacy_triggers - matcher_triggers:,} "
+          f"({(legacy_triggers - matcher_triggers) / len(corpus):.0%} of messages no longer call the model)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Recall latency, recall quality and memory use of long-term memory at 1M stored turns
+
+Spreads the turns over many conversations, the way the bot stores them, and plants one
+distinctive fact per sampled conversation early on. It then asks about each planted fact in
+different words and checks the fact comes back in the top 3. That tests whether recall finds
+something useful, not just how fast it returns.
+
+Usage: python benchmarks/bench_memory.py [--turns 1000000] [--conversations 10000] [--queries 10000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from long_term_memory import LongTermMemory  # noqa: E402
+from metrics import rss_bytes  # noqa: E402
+
+CHATTER = ['anyone', 'playing', 'tonight', 'weather', 'great', 'idea', 'music', 'really', 'weekend', 'school',
+           'movie', 'coffee', 'tired', 'funny', 'meme', 'server', 'update', 'later', 'friend', 'dinner', 'pizza',
+           'football', 'stream', 'work', 'sleep', 'morning', 'busy', 'nice', 'cool', 'awesome']
+FACTS = [
+    ("my cat is named {0} and she hates the vacuum", "what was my cat called again"),
+    ("I'm learning to play the {0} guitar this summer", "how is my guitar practice going"),
+    ("my sister {0} is getting married in june", "remember my sister's wedding?"),
+    ("I work as a nurse at {0} hospital", "what do you remember about my job at the hospital"),
+    ("my favourite book is {0} by tolkien", "which tolkien book did I say I liked"),
+]
+NAMES = ['luna', 'pepper', 'mochi', 'biscuit', 'nova', 'ziggy', 'olive', 'cleo', 'marble', 'pixel']
+
+
+def chatter(rng):
+    return ' '.join(rng.choice(CHATTER) for _ in range(rng.randint(4, 14)))
+
+
+def fill(memory, turns, conversations, rng):
+    """Returns {key: probe question} for every conversation with a planted fact"""
+    per_conversation = turns // conversations
+    probes = {}
+    for c in range(conversations):
+        key = (c, c % 997)
+        texts = [chatter(rng) for _ in range(per_conversation)]
+        fact, question = rng.choice(FACTS)
+        texts[rng.randrange(min(5, per_conversation))] = fact.format(rng.choice(NAMES))
+        probes[key] = (question, fact.split('{0}')[0].strip())
+        memory.remember_many(key, texts, texts)
+    return probes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=1_000_000)
+    parser.add_argument('--conversations', type=int, default=10_000)
+    parser.add_argument('--queries', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    baseline = rss_bytes()
+    # Budget large enough to hold everything; eviction is measured separately below
+    memory = LongTermMemory(budget=float('inf'), max_turns=max(500, args.turns // args.conversations))
+    started = time.perf_counter()
+    probes = fill(memory, args.turns, args.conversations, rng)
+    fill_seconds = time.perf_counter() - started
+    stats = memory.stats()
+
+    keys = list(probes)
+    latencies = []
+    hits = 0
+    for _ in range(args.queries):
+        key = rng.choice(keys)
+        question, expected = probes[key]
+        began = time.perf_counter()
+        recalled = memory.recall(key, question, skip_recent=4)
+        latencies.append(time.perf_counter() - began)
+        hits += any(text.startswith(expected) for text in recalled)
+    latencies.sort()
+
+    # LRU-by-bytes: a budget of a tenth of the data keeps roughly a tenth of the conversations
+    bounded = LongTermMemory(budget=stats['bytes'] // 10, max_turns=memory.max_turns)
+    rng = random.Random(args.seed)
+    fill(bounded, args.turns, args.conversations, rng)
+
+    print(f"stored            {stats['stored']:,} turns in {stats['conversations']:,} conversations "
+          f"({fill_seconds:.1f}s, {stats['stored'] / fill_seconds:,.0f} turns/s)")
+    print(f"memory            {stats['bytes'] / 1e6:.0f} MB accounted, {(rss_bytes() - baseline) / 1e6:.0f} MB RSS "
+          f"({stats['bytes'] / stats['stored']:.0f} B/turn)")
+    print(f"recall latency    p50 {statistics.median(latencies) * 1e6:.0f} us  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us")
+    print(f"planted fact hit  {hits / args.queries:.1%} in top 3")
+    print(f"bounded to 1/10   {bounded.stats()['conversations']:,} conversations kept, "
+          f"{bounded.stats()['bytes'] / 1e6:.0f} MB, {bounded.stats()['evictions']:,} evicted")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Reply latency and 429s under outbound load, with discord.py alone and with the REST scheduler in front
+
+Runs a local fake Discord REST server with fixed-window limits per route and a global limit, the
+way Discord enforces them, and points discord.py at it. The bot-side traffic follows main.py:
+each incoming message gets a typing indicator, a reply after some thinking time, and sometimes a
+reaction. Reactions on our replies sometimes get a reaction back. At the default load the offered
+traffic is well over the global limit, so cosmetic calls and replies compete for it.
+
+Usage: python benchmarks/bench_rest.py [--channels 45] [--rate 0.8] [--seconds 15]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rest_scheduler import REST_REACTION, REST_REPLY, RestScheduler  # noqa: E402
+
+BOT_ID = 1
+# (requests, window seconds) per route and channel, and globally
+SERVER_LIMITS = {'send': (5, 5.0), 'reaction': (1, 0.25), 'typing': (5, 5.0)}
+SERVER_GLOBAL = (50, 1.0)
+SERVER_LATENCY = 0.02
+
+
+def user_payload(user_id):
+    return {'id': str(user_id), 'username': f'user{user_id}', 'global_name': None, 'discriminator': '0',
+            'avatar': None, 'bot': user_id == BOT_ID, 'public_flags': 0}
+
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes an exact 'application/json', without aiohttp's charset suffix
+    return web.Response(body=json.dumps(data).encode(), status=status,
+                        headers=dict(headers or {}, **{'Content-Type': 'application/json'}))
+
+
+class FakeDiscord:
+    """Just enough of the REST API for sends, reactions and typing, with Discord-style rate limiting"""
+
+    def __init__(self):
+        self.windows = {}  # key -> [window start, count]
+        self.requests = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self.next_id = 10_000_000
+        self.app = web.Application()
+        self.app.router.add_get('/api/v10/users/@me', self.me)
+        self.app.router.add_post('/api/v10/channels/{channel}/messages', self.send)
+        self.app.router.add_put('/api/v10/channels/{channel}/messages/{message}/reactions/{emoji}/@me', self.react)
+        self.app.router.add_post('/api/v10/channels/{channel}/typing', self.typing)
+
+    def _hit(self, key, limit, window, now):
+        state = self.windows.get(key)
+        if state is None or now - state[0] >= window:
+            state = self.windows[key] = [now, 0]
+        if state[1] >= limit:
+            return None, window - (now - state[0])
+        state[1] += 1
+        return limit - state[1], window - (now - state[0])
+
+    async def _limited(self, route, channel):
+        await asyncio.sleep(SERVER_LATENCY)
+        now = time.monotonic()
+        self.requests[route] += 1
+        remaining, reset_after = self._hit('global', *SERVER_GLOBAL, now)
+        if remaining is None:
+            self.rate_limited['global'] += 1
+            return json_response({'message': 'You are being rate limited.', 'retry_after': reset_after,
+                                  'global': True}, status=429,
+                                 headers={'Retry-After': f'{reset_after:.3f}', 'X-RateLimit-Global': 'true',
+                                          'Via': '1.1 google'})
+        limit, window = SERVER_LIMITS[route]
+        remaining, reset_after = self._hit((route, channel), limit, window, now)
+        headers = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Bucket': route,
+                   'X-RateLimit-Reset-After': f'{reset_after:.3f}', 'Via': '1.1 google'}
+        if remaining is None:
+            self.rate_limited[route] += 1
+            headers.update({'X-RateLimit-Remaining': '0', 'Retry-After': f'{reset_after:.3f}'})
+            return json_response({'message': 'You are being rate limited.', 'retry_after': reset_after,
+                                  'global': False}, status=429, headers=headers)
+        headers['X-RateLimit-Remaining'] = str(remaining)
+        return headers
+
+    async def me(self, request):
+        return json_response(dict(user_payload(BOT_ID), verified=True, mfa_enabled=False, flags=0))
+
+    async def send(self, request):
+        channel = request.match_info['channel']
+        result = await self._limited('send', channel)
+        if isinstance(result, web.Response):
+            return result
+        body = await request.json()
+        self.next_id += 1
+        return json_response({
+            'id': str(self.next_id), 'channel_id': channel, 'type': 0, 'content': body.get('content', ''),
+            'author': user_payload(BOT_ID), 'mentions': [], 'mention_roles': [], 'mention_everyone': False,
+            'attachments': [], 'embeds': [], 'components': [], 'pinned': False, 'tts': False, 'flags': 0,
+            'timestamp': '2024-01-01T00:00:00+00:00', 'edited_timestamp': None,
+        }, headers=result)
+
+    async def react(self, request):
+        result = await self._limited('reaction', request.match_info['channel'])
+        return result if isinstance(result, web.Response) else web.Response(status=204, headers=result)
+
+    async def typing(self, request):
+        result = await self._limited('typing', request.match_info['channel'])
+        return result if isinstance(result, web.Response) else web.Response(status=204, headers=result)
+
+
+class Bot:
+    """The outbound half of main.py's on_message and on_reaction_add, with or without the scheduler"""
+
+    def __init__(self, client, scheduler, think):
+        self.client = client
+        self.scheduler = scheduler
+        self.think = think
+        self.reply_latencies = []
+        self.sent = collections.Counter()
+        self.replies = []
+
+    async def on_message(self, channel_id, message_id, rng):
+        channel = self.client.get_partial_messageable(channel_id)
+        typing = self.scheduler.typing(channel) if self.scheduler else channel.typing()
+        async with typing:
+            await asyncio.sleep(self.think)
+            if rng.random() < 0.2:
+                await self.react(channel.get_partial_message(message_id), '😄')
+            started = time.perf_counter()
+            if self.scheduler:
+                reply = await self.scheduler.run(REST_REPLY, ('send', channel_id), channel.send, 'a reply')
+            else:
+                reply = await channel.send('a reply')
+            self.reply_latencies.append(time.perf_counter() - started)
+            self.replies.append(reply)
+
+    async def react(self, message, emoji):
+        if self.scheduler and not await self.scheduler.acquire(REST_REACTION, ('reaction', message.channel.id)):
+            return
+        await message.add_reaction(emoji)
+        self.sent['reaction'] += 1
+
+
+async def run(args, scheduled):
+    import discord
+
+    server = FakeDiscord()
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    discord.http.Route.BASE = f'http://127.0.0.1:{port}/api/v10'
+
+    scheduler = RestScheduler() if scheduled else None
+    client = discord.Client(intents=discord.Intents.none(),
+                            http_trace=scheduler.trace_config() if scheduler else None)
+    # Login without the application lookup discord.Client.login also does
+    await client._async_setup_hook()
+    client._connection.user = discord.ClientUser(state=client._connection,
+                                                 data=await client.http.static_login('benchmark'))
+    bot = Bot(client, scheduler, args.think)
+
+    rng = random.Random(args.seed)
+    tasks = []
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.seconds
+    tick = 0.05
+    message_id = 1
+    while loop.time() < deadline:
+        for channel_id in range(1000, 1000 + args.channels):
+            if rng.random() < args.rate * tick:
+                message_id += 1
+                tasks.append(asyncio.create_task(bot.on_message(channel_id, message_id, rng)))
+        # People reacting to our replies; the bot reacts back 30% of the time
+        for _ in range(int(args.reactions * tick) + (rng.random() < args.reactions * tick % 1)):
+            if bot.replies and rng.random() < 0.3:
+                tasks.append(asyncio.create_task(bot.react(rng.choice(bot.replies), '👍')))
+        await asyncio.sleep(tick)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = args.seconds + loop.time() - deadline
+
+    await client.close()
+    if scheduler:
+        await scheduler.close()
+    await runner.cleanup()
+    latencies = sorted(bot.reply_latencies)
+    return {
+        'replies': len(latencies),
+        'errors': sum(isinstance(result, Exception) for result in results),
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99)],
+        'elapsed': elapsed,
+        'server': dict(server.requests),
+        'rate_limited': dict(server.rate_limited),
+        'scheduler': scheduler.stats() if scheduler else None,
+    }
+
+
+def report(name, result):
+    print(f"{name:<10} replies {result['replies']:,} in {result['elapsed']:.1f}s, "
+          f"reply send p50 {result['p50'] * 1000:.0f} ms  p99 {result['p99'] * 1000:.0f} ms")
+    print(f"{'':<10} requests {result['server']}  429s {result['rate_limited'] or 0}  errors {result['errors']}")
+    if result['scheduler']:
+        stats = result['scheduler']
+        print(f"{'':<10} dropped {stats['dropped']}  max queue {stats['max_queue_depth']}  "
+              f"header updates {stats['header_updates']:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=45)
+    parser.add_argument('--rate', type=float, default=0.8, help='incoming messages per second per channel')
+    parser.add_argument('--reactions', type=float, default=20, help='reactions on our replies per second')
+    parser.add_argument('--think', type=float, default=0.5, help='seconds between typing and the reply')
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    report('discord.py', asyncio.run(run(args, scheduled=False)))
+    report('scheduled', asyncio.run(run(args, scheduled=True)))
+
+
+if __name__ == '__main__':
+    main()
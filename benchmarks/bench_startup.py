@@ -0,0 +1,137 @@
+"""Cold-start time and memory against guild count, with and without startup member chunking
+
+Replays a synthetic gateway login (READY, one GUILD_CREATE per guild, GUILD_MEMBERS_CHUNK replies
+to every member request) into the bot's real client configuration. Each run is a fresh process so
+its RSS reflects one startup only. Member counts per guild follow a heavy-tailed distribution.
+
+Discord allows about 110 gateway sends a minute per shard, and chunking sends one request per
+guild. This benchmark doesn't sleep through that limit. It reports the limit's floor separately.
+
+Usage: python benchmarks/bench_startup.py [--guilds 100 1000 5000] [--chunk-latency 0.05]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOT_ID = 1
+CHUNK_SIZE = 1000  # Members per GUILD_MEMBERS_CHUNK, as the gateway sends them
+GATEWAY_SENDS_PER_MINUTE = 110  # discord.py's own budget for gateway sends per shard
+
+
+def member_payload(user_id, bot=False):
+    return {
+        'user': {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'avatar': None, 'bot': bot},
+        'roles': [], 'joined_at': '2023-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0,
+    }
+
+
+def guild_payload(guild_id, member_count):
+    # Without the presences intent GUILD_CREATE carries only our own member
+    return {
+        'id': str(guild_id), 'name': f'guild{guild_id}', 'owner_id': str(guild_id * 1000), 'unavailable': False,
+        'member_count': member_count, 'large': member_count > 250, 'members': [member_payload(BOT_ID, bot=True)],
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(guild_id * 10 + i), 'type': 0, 'name': f'chat{i}', 'position': i,
+                      'permission_overwrites': []} for i in range(5)],
+        'features': [], 'emojis': [], 'stickers': [], 'threads': [], 'voice_states': [], 'presences': [],
+        'stage_instances': [], 'guild_scheduled_events': [],
+    }
+
+
+def member_counts(guilds, seed):
+    rng = random.Random(seed)
+    return [min(100_000, int(20 * rng.paretovariate(1.2))) for _ in range(guilds)]
+
+
+async def start(mode, guilds, seed, chunk_latency):
+    import discord
+    import main
+    from metrics import rss_bytes
+
+    options = main.cache_options if mode == 'lazy' else {'chunk_guilds_at_startup': True}
+    client = discord.Client(intents=main.intents, guild_ready_timeout=0.05, **options)
+    await client._async_setup_hook()  # What login() does before connecting
+    state = client._connection
+    counts = member_counts(guilds, seed)
+    chunk_requests = 0
+
+    async def feed_chunks(guild_id, nonce):
+        await asyncio.sleep(chunk_latency)
+        count = counts[guild_id - 1]
+        base = guild_id * 1_000_000
+        chunk_count = max(1, -(-count // CHUNK_SIZE))
+        for index in range(chunk_count):
+            members = [member_payload(base + i, bot=i % 25 == 0)
+                       for i in range(index * CHUNK_SIZE, min(count, (index + 1) * CHUNK_SIZE))]
+            state.parse_guild_members_chunk({'guild_id': str(guild_id), 'members': members, 'nonce': nonce,
+                                             'chunk_index': index, 'chunk_count': chunk_count})
+            await asyncio.sleep(0)  # One gateway frame per chunk
+
+    async def chunker(guild_id, query='', limit=0, presences=False, *, nonce=None):
+        nonlocal chunk_requests
+        chunk_requests += 1
+        asyncio.create_task(feed_chunks(guild_id, nonce))
+
+    state.chunker = chunker
+    baseline = rss_bytes()
+    started = time.perf_counter()
+    state.parse_ready({'user': {'id': str(BOT_ID), 'username': 'AIBot', 'discriminator': '0', 'avatar': None,
+                                'bot': True},
+                       'guilds': [{'id': str(i), 'unavailable': True} for i in range(1, guilds + 1)]})
+    for guild_id in range(1, guilds + 1):
+        state.parse_guild_create(guild_payload(guild_id, counts[guild_id - 1]))
+        if guild_id % 100 == 0:
+            await asyncio.sleep(0)
+    await client.wait_until_ready()
+    # guild_ready_timeout is idle time after the last GUILD_CREATE, the same in both modes
+    elapsed = time.perf_counter() - started - state.guild_ready_timeout
+
+    return {
+        'mode': mode,
+        'guilds': guilds,
+        'members': sum(counts),
+        'ready_seconds': elapsed,
+        'gateway_floor_seconds': chunk_requests * 60 / GATEWAY_SENDS_PER_MINUTE,
+        'chunk_requests': chunk_requests,
+        'cached_members': sum(len(guild._members) for guild in client.guilds),
+        'rss_mb': (rss_bytes() - baseline) / 1e6,
+    }
+
+
+def run_worker(mode, guilds, seed, chunk_latency):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', mode, '--guilds', str(guilds),
+                             '--seed', str(seed), '--chunk-latency', str(chunk_latency)],
+                            capture_output=True, text=True, check=True, env=dict(os.environ, LAZY_MEMBERS='1'))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--chunk-latency', type=float, default=0.05, help='seconds before a member request answers')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--worker', choices=['eager', 'lazy'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(start(args.worker, args.guilds[0], args.seed, args.chunk_latency))))
+        return
+
+    print(f"{'guilds':>7} {'members':>10} {'mode':>6} {'ready':>9} {'+gateway floor':>15} {'cached':>10} {'RSS':>9}")
+    for guilds in args.guilds:
+        for mode in ('eager', 'lazy'):
+            r = run_worker(mode, guilds, args.seed, args.chunk_latency)
+            print(f"{r['guilds']:>7,} {r['members']:>10,} {mode:>6} {r['ready_seconds']:>8.2f}s "
+                  f"{r['gateway_floor_seconds']:>14.0f}s {r['cached_members']:>10,} {r['rss_mb']:>7.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Write throughput and restart cost of the SQLite conversation store
+
+Fills the store through the same write-behind path the bot uses, then reopens it and
+compares lazy page-in against loading every row up front.
+
+Usage: python benchmarks/bench_storage.py [--conversations 1000000] [--path /tmp/bench.db]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversations import SmartConversationManager  # noqa: E402
+from storage import ConversationStore  # noqa: E402
+
+TIMEOUT = 600
+CHANNELS = 997
+WORDS = ['hello', 'python', 'weather', 'games', 'music', 'anyone', 'thinks', 'really', 'great', 'idea']
+
+
+def message(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 12)))
+
+
+def fill(path, conversations, rng):
+    store = ConversationStore(path)
+    manager = SmartConversationManager(timeout=TIMEOUT, memory_budget=float('inf'), store=store)
+
+    mark_time = 0.0
+    flush_time = 0.0
+    for start in range(0, conversations, 100_000):
+        for i in range(start, min(start + 100_000, conversations)):
+            began = time.perf_counter()
+            manager.add_message(i, i % CHANNELS, f"user{i}", message(rng))
+            mark_time += time.perf_counter() - began
+        began = time.perf_counter()
+        store.flush_sync()
+        flush_time += time.perf_counter() - began
+        manager.conversations.clear()  # Keep the benchmark's own memory flat
+        manager.conversation_bytes = 0
+
+    store.close()
+    return mark_time, flush_time
+
+
+def restart_lazy(path, keys):
+    began = time.perf_counter()
+    store = ConversationStore(path)
+    manager = SmartConversationManager(timeout=TIMEOUT, memory_budget=float('inf'), store=store)
+    ready = time.perf_counter() - began
+
+    page_ins = []
+    for user_id, channel_id in keys:
+        began = time.perf_counter()
+        conv = manager.get_conversation(user_id, channel_id)
+        page_ins.append(time.perf_counter() - began)
+        assert len(conv.history) == 1
+    store.close()
+    return ready, page_ins
+
+
+def restart_eager(path):
+    """What loading everything at startup would cost"""
+    began = time.perf_counter()
+    store = ConversationStore(path)
+    rows = 0
+    for history, topics in store._reader.execute('SELECT history, topics FROM conversations'):
+        json.loads(history)
+        json.loads(topics)
+        rows += 1
+    store.close()
+    return time.perf_counter() - began, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=1_000_000)
+    parser.add_argument('--path', help='database file (default: a temporary directory)')
+    parser.add_argument('--samples', type=int, default=1000, help='conversations paged in after restart')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path or os.path.join(tmp, 'conversations.db')
+        mark_time, flush_time = fill(path, args.conversations, rng)
+        size = os.path.getsize(path)
+
+        keys = [(i, i % CHANNELS) for i in rng.sample(range(args.conversations), args.samples)]
+        ready, page_ins = restart_lazy(path, keys)
+        eager, rows = restart_eager(path)
+        assert rows == args.conversations
+
+        page_ins.sort()
+        print(f"conversations stored        {args.conversations:>12,}  ({size / 1e6:.0f} MB on disk)")
+        print(f"add_message, new convo     {mark_time / args.conversations * 1e6:>12.2f} µs/msg")
+        print(f"write-behind flush          {args.conversations / flush_time:>12,.0f} rows/s")
+        print(f"restart, lazy               {ready * 1000:>12.1f} ms to ready")
+        print(f"  first touch page-in       {statistics.median(page_ins) * 1e6:>12.1f} µs p50, "
+              f"{page_ins[int(len(page_ins) * 0.99)] * 1e6:.1f} µs p99")
+        print(f"restart, eager load         {eager * 1000:>12.1f} ms to ready")
+
+        store = ConversationStore(path)
+        began = time.perf_counter()
+        removed = store._compact(max_age=-1)  # Everything counts as expired
+        print(f"compaction                  {time.perf_counter() - began:>12.2f} s for {removed:,} rows, "
+              f"{os.path.getsize(path) / 1e6:.1f} MB left")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
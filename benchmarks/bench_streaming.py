@@ -0,0 +1,84 @@
+"""Time-to-first-response with and without streaming, against the local fake inference server
+
+Usage: python benchmarks/bench_streaming.py [--token-delay 0.08] [--latency 0.3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import RemoteBackend  # noqa: E402
+from fake_inference_server import make_app, start_server  # noqa: E402
+from http_client import HTTPClientPool  # noqa: E402
+from streaming import StreamingReply  # noqa: E402
+
+PROMPT = "Human (alex): what do you think about pineapple on pizza?\nAI:"
+
+
+class FakeMessage:
+    """Records when the bot's message was sent and edited"""
+
+    def __init__(self, content, log):
+        self.content = content
+        self.log = log
+
+    async def edit(self, content):
+        self.content = content
+        self.log.append(('edit', time.monotonic(), content))
+
+
+def clean(text):
+    return text.split('\nHuman')[0].strip()[:600]
+
+
+async def run(args):
+    runner, base_url = await start_server(make_app(latency=args.latency, token_delay=args.token_delay))
+    pool = HTTPClientPool()
+    await pool.start()
+    backend = RemoteBackend(pool, f"{base_url}/models/fake", token='fake', timeout=30)
+    parameters = {"max_new_tokens": 80, "temperature": 0.8}
+
+    # Buffered: the user sees nothing until generation is complete
+    [chunk async for chunk in backend.stream(PROMPT, parameters)]  # warm the connection
+    start = time.monotonic()
+    chunks = [chunk async for chunk in backend.stream(PROMPT, parameters)]
+    buffered_first = time.monotonic() - start
+
+    # Streamed: first sentence goes out early, then rate-limited edits
+    log = []
+
+    async def send(text):
+        log.append(('send', time.monotonic(), text))
+        return FakeMessage(text, log)
+
+    reply = StreamingReply(send, clean, edit_interval=args.edit_interval)
+    start = time.monotonic()
+    async for chunk in backend.stream(PROMPT, parameters):
+        await reply.feed(chunk)
+    await reply.finish(clean(''.join(chunks)))
+    total = time.monotonic() - start
+
+    await pool.close()
+    await runner.cleanup()
+
+    print(f"buffered time to first response:  {buffered_first * 1000:.0f} ms")
+    print(f"streamed time to first response:  {reply.time_to_first_send * 1000:.0f} ms")
+    print(f"streamed time to final text:      {total * 1000:.0f} ms ({reply.edits} edits)")
+    for kind, at, text in log:
+        print(f"  +{(at - start) * 1000:6.0f} ms {kind:<4} {text!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.3, help='server think time before first token')
+    parser.add_argument('--token-delay', type=float, default=0.08)
+    parser.add_argument('--edit-interval', type=float, default=1.2)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
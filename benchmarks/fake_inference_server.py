@@ -0,0 +1,112 @@
+"""Local stand-in for the Hugging Face inference API (JSON and streamed SSE responses)
+
+Usage: python benchmarks/fake_inference_server.py [--port 8080] [--latency 0.2] [--token-delay 0.05]
+Then point the bot at it with HUGGINGFACE_API_URL=http://127.0.0.1:8080/models/fake
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+REPLIES = [
+    "That's a great question. I think it depends on what you enjoy most, honestly.",
+    "Oh nice! I've always wondered about that too. Tell me more about how it went.",
+    "Hmm, I'm not sure. Some people swear by it, others can't stand it at all.",
+]
+
+
+def make_app(latency=0.0, token_delay=0.05, error_rate=0.0, loading_rate=0.0, seed=None,
+             webhook_latency=0.0, webhook_error_rate=0.0, small_latency=None):
+    """Build the fake API; latency and error rates are tunable per instance
+
+    small_latency, if given, is the latency of models whose name contains 'small'.
+    """
+    rng = random.Random(seed)
+    app = web.Application()
+    app['stats'] = {'requests': 0, 'streams': 0, 'errors': 0, 'batched_inputs': 0, 'webhooks': 0}
+
+    def reply_for(prompt):
+        return REPLIES[sum(map(ord, prompt)) % len(REPLIES)]
+
+    async def generate(request):
+        stats = request.app['stats']
+        stats['requests'] += 1
+        body = await request.json()
+        inputs = body.get('inputs', '')
+
+        delay = small_latency if small_latency is not None and 'small' in request.match_info['name'] else latency
+        if delay:
+            await asyncio.sleep(delay)
+
+        roll = rng.random()
+        if roll < loading_rate:
+            stats['errors'] += 1
+            return web.json_response({'error': 'Model is currently loading', 'estimated_time': 2.0}, status=503)
+        if roll < loading_rate + error_rate:
+            stats['errors'] += 1
+            return web.json_response({'error': 'Internal error'}, status=500,
+                                     headers={'Retry-After': '1'})
+
+        if isinstance(inputs, list):
+            stats['batched_inputs'] += len(inputs)
+            return web.json_response([[{'generated_text': f"{prompt} {reply_for(prompt)}"}] for prompt in inputs])
+
+        if not body.get('stream'):
+            return web.json_response([{'generated_text': f"{inputs} {reply_for(inputs)}"}])
+
+        stats['streams'] += 1
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        words = reply_for(inputs).split()
+        for index, word in enumerate(words):
+            await asyncio.sleep(token_delay)
+            final = index == len(words) - 1
+            event = {
+                'token': {'id': index, 'text': f" {word}", 'special': False},
+                'generated_text': f"{inputs} {' '.join(words)}" if final else None,
+            }
+            await response.write(f"data:{json.dumps(event)}\n\n".encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    async def webhook(request):
+        request.app['stats']['webhooks'] += 1
+        await request.read()
+        if webhook_latency:
+            await asyncio.sleep(webhook_latency)
+        if rng.random() < webhook_error_rate:
+            return web.json_response({'message': 'You are being rate limited.', 'retry_after': 1.0}, status=429)
+        return web.Response(status=204)
+
+    app.router.add_post('/models/{name:.*}', generate)
+    app.router.add_post('/webhook', webhook)
+    return app
+
+
+async def start_server(app, host='127.0.0.1', port=0):
+    """Start the app and return (runner, base_url); port 0 picks a free port"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--token-delay', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--loading-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.token_delay, args.error_rate, args.loading_rate),
+                host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""Offline load test: synthetic Discord events through main.py's handlers against the fake inference server
+
+Drives on_message, on_reaction_add and on_guild_join with Message-like objects at a fixed
+arrival rate (open loop, so a slow bot builds a backlog instead of slowing the test down).
+Nothing talks to Discord. The inference API and webhook are the local fake server.
+
+Usage: python benchmarks/loadtest.py [--rate 200] [--duration 20] [--guilds 500] [--latency 0.3]
+       python benchmarks/loadtest.py --backend stub --rate 1000 --json   # machine-readable output
+"""
+import argparse
+import asyncio
+import contextvars
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('PORT', '0')  # No metrics server during the run
+
+import discord  # noqa: E402
+
+from fake_inference_server import make_app, start_server  # noqa: E402
+
+CHATTER = [
+    "anyone watching the game tonight", "lol that's wild", "brb getting food", "what should I cook for dinner",
+    "how do I fix my python imports", "I think the new update is great", "morning everyone",
+    "does anyone have advice for a first job interview?", "this song is stuck in my head", "gg",
+]
+TRIGGER_CHATTER = ["is the bot awake", "do you think ai will take our jobs", "hey bot what's up",
+                   "robots are cool", "artificial intelligence is overhyped"]
+
+_ids = itertools.count(1 << 40)
+_current = contextvars.ContextVar('current_event')
+
+
+class Recorder:
+    """Collects per-event latency and what the bot sent"""
+
+    def __init__(self):
+        self.latencies = []
+        self.sends = 0
+        self.edits = 0
+        self.reactions = 0
+        self.errors = 0
+
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.global_name = name
+        self.discriminator = '0'
+        self.bot = bot
+        self.avatar = None
+        self.mention = f"<@{user_id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, channel_id, name, guild, recorder, send_latency):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.recorder = recorder
+        self.send_latency = send_latency
+
+    def typing(self):
+        return _Typing()
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.send_latency)
+        self.recorder.sends += 1
+        event = _current.get(None)
+        if event is not None:
+            event['replied'] = True
+        return FakeMessage(content or '', self, self.guild, bot_user, self.recorder)
+
+
+class FakeMessage:
+    def __init__(self, content, channel, guild, author, recorder, mentions=()):
+        self.id = next(_ids)
+        self.content = content
+        self.channel = channel
+        self.guild = guild
+        self.author = author
+        self.mentions = list(mentions)
+        self.recorder = recorder
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def edit(self, content=None, **kwargs):
+        await asyncio.sleep(self.channel.send_latency)
+        self.content = content
+        self.recorder.edits += 1
+        return self
+
+    async def add_reaction(self, emoji):
+        self.recorder.reactions += 1
+
+
+class FakeReaction:
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+
+
+class FakeGuild:
+    def __init__(self, guild_id, members, channels, recorder, send_latency):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.member_count = members
+        self.members = [FakeUser(guild_id * 1000 + i, f"member{i}") for i in range(min(members, 50))]
+        self.owner = self.members[0]
+        self.owner_id = self.owner.id
+        self.chunked = False  # As with LAZY_MEMBERS: the join summary fetches members on demand
+        self.created_at = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        self.icon = None
+        self.features = []
+        self.premium_tier = 0
+        self.premium_subscription_count = 0
+        self.verification_level = discord.VerificationLevel.low
+        self.emojis = []
+        self.emoji_limit = 50
+        self.voice_channels = []
+        self.categories = []
+        names = ['general'] + [f"chat-{i}" for i in range(1, channels)]
+        self.text_channels = [FakeChannel(guild_id * 100 + i, name, self, recorder, send_latency)
+                              for i, name in enumerate(names)]
+        self.channels = self.text_channels
+
+    async def chunk(self, cache=True):
+        await asyncio.sleep(0.05)
+        return self.members
+
+
+def zipf_weights(count, exponent):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class Workload:
+    """Skewed guild/user/channel picks: a few big guilds, a long tail of quiet ones"""
+
+    def __init__(self, args, recorder, rng):
+        self.args = args
+        self.rng = rng
+        self.guilds = [FakeGuild(1000 + i, rng.randint(20, 5000), args.channels, recorder, args.send_latency)
+                       for i in range(args.guilds)]
+        self.weights = list(itertools.accumulate(zipf_weights(args.guilds, args.skew)))
+        self.users = {}
+        self.recorder = recorder
+
+    def user(self, guild):
+        user_id = guild.id * 1_000_000 + min(int(self.rng.paretovariate(1.2)), self.args.users_per_guild)
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = FakeUser(user_id, f"user{user_id % 100000}")
+        return user
+
+    def message(self):
+        guild = self.rng.choices(self.guilds, cum_weights=self.weights)[0]
+        channel = self.rng.choice(guild.text_channels)
+        author = self.user(guild)
+        roll = self.rng.random()
+        if roll < self.args.mention_ratio:
+            content = f"<@{bot_user.id}> {self.rng.choice(CHATTER)}"
+            mentions = [bot_user]
+        elif roll < self.args.mention_ratio + self.args.trigger_ratio:
+            content = self.rng.choice(TRIGGER_CHATTER)
+            mentions = []
+        else:
+            content = self.rng.choice(CHATTER)
+            mentions = []
+        return FakeMessage(content, channel, guild, author, self.recorder, mentions)
+
+
+async def measure_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def drive(handler, recorder, *args, timed=False):
+    """Run one event handler; timed=True records its latency if it replied"""
+    event = {'replied': False}
+    _current.set(event)
+    started = time.perf_counter()
+    try:
+        await handler(*args)
+    except Exception:
+        recorder.errors += 1
+    if timed and event['replied']:
+        recorder.latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(args):
+    global bot_user
+    import main
+    from metrics import max_rss_bytes
+    from router import REPLY_TOKENS, TIER_LARGE, TIER_SMALL
+
+    runner, base_url = await start_server(make_app(
+        latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate,
+        loading_rate=args.loading_rate, seed=args.seed, webhook_latency=args.webhook_latency,
+        small_latency=args.small_latency))
+
+    # Point the bot at the fake services and skip the gateway entirely
+    bot_user = FakeUser(1, 'AIBot', bot=True)
+    main.bot._connection.user = bot_user
+    main.WEBHOOK_URL = main.webhook_notifier.url = f"{base_url}/webhook"
+    main.webhook_notifier.spill_path = None
+    if args.backend == 'remote':
+        main.inference_backend.backend.api_url = f"{base_url}/models/fake"
+        main.small_backend.backend.api_url = f"{base_url}/models/fake-small"
+    else:
+        from backends import StubBackend
+        main.inference_backend.backend = StubBackend(latency=args.latency)
+        main.small_backend.backend = StubBackend(latency=args.small_latency)
+    if args.no_tiering:
+        # Every reply to the large model with a full-length budget, as before deadline routing
+        main.model_router.tiers.pop(TIER_SMALL)
+        main.model_router.preferences = {reply_class: (TIER_LARGE,) for reply_class in main.model_router.deadlines}
+        main.model_router.tiers[TIER_LARGE].affordable_tokens = lambda seconds: REPLY_TOKENS[1]
+    if args.no_rate_limit:
+        main.rate_limiter.limits = {}
+    await main.http_pool.start()
+    await main.inference_backend.start()
+    await main.small_backend.start()
+    main.inference_dispatcher.start()
+    main.small_dispatcher.start()
+    main.webhook_notifier.start()
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    workload = Workload(args, recorder, rng)
+
+    lag_samples = []
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples))
+    tasks = set()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    sent_events = 0
+    recent_bot_messages = []
+
+    # Open-loop arrivals: schedule by the clock, not by completions
+    while (now := loop.time()) - started < args.duration:
+        due = int((now - started) * args.rate) - sent_events
+        for _ in range(due):
+            sent_events += 1
+            roll = rng.random()
+            if roll < args.join_ratio:
+                guild = FakeGuild(next(_ids), rng.randint(20, 5000), args.channels, recorder, args.send_latency)
+                coro = drive(main.on_guild_join, recorder, guild)
+            elif roll < args.join_ratio + args.reaction_ratio and recent_bot_messages:
+                message = rng.choice(recent_bot_messages)
+                coro = drive(main.on_reaction_add, recorder, FakeReaction(message, '👍'), workload.user(message.guild))
+            else:
+                message = workload.message()
+                coro = drive(main.on_message, recorder, message, timed=True)
+                if len(recent_bot_messages) < 1000:
+                    recent_bot_messages.append(FakeMessage('hi', message.channel, message.guild, bot_user, recorder))
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.sleep(0.005)
+
+    arrival_window = loop.time() - started
+    if tasks:
+        await asyncio.wait(tasks, timeout=args.drain)
+    elapsed = loop.time() - started
+    lag_task.cancel()
+    await main.webhook_notifier.close()
+
+    server_stats = runner.app['stats']
+    report = {
+        'events': sent_events,
+        'events_per_sec': sent_events / arrival_window,
+        'replies': len(recorder.latencies),
+        'replies_per_sec': len(recorder.latencies) / elapsed,
+        'reply_p50_ms': percentile(recorder.latencies, 0.50) * 1000,
+        'reply_p99_ms': percentile(recorder.latencies, 0.99) * 1000,
+        'loop_lag_p50_ms': percentile(lag_samples, 0.50) * 1000,
+        'loop_lag_p99_ms': percentile(lag_samples, 0.99) * 1000,
+        'loop_lag_max_ms': max(lag_samples, default=0.0) * 1000,
+        'peak_rss_mb': max_rss_bytes() / 1e6,
+        'unfinished': len(tasks),
+        'handler_errors': recorder.errors,
+        'sends': recorder.sends,
+        'edits': recorder.edits,
+        'reactions': recorder.reactions,
+        'inference_requests': server_stats['requests'],
+        'webhooks': server_stats['webhooks'],
+        'webhook_embeds': main.webhook_notifier.embeds_sent,
+        'outcomes': {labels[0]: value for labels, value in main.REPLY_OUTCOMES._values.items()},
+        'decisions': {labels[0]: value for labels, value in main.MESSAGES._values.items()},
+        'routed': main.model_router.stats()['routed'],
+        'deadline_missed': {reply_class: missed / max(1, missed + main.model_router.deadline_met[reply_class])
+                            for reply_class, missed in main.model_router.deadline_missed.items()},
+    }
+
+    for task in list(tasks):
+        task.cancel()
+    await main.inference_dispatcher.close()
+    await main.small_dispatcher.close()
+    await main.http_pool.close()
+    await runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=200, help='events per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of arrivals')
+    parser.add_argument('--drain', type=float, default=30, help='seconds to wait for in-flight events')
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--channels', type=int, default=5, help='text channels per guild')
+    parser.add_argument('--users-per-guild', type=int, default=200)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of guild activity')
+    parser.add_argument('--mention-ratio', type=float, default=0.15)
+    parser.add_argument('--trigger-ratio', type=float, default=0.15)
+    parser.add_argument('--reaction-ratio', type=float, default=0.05)
+    parser.add_argument('--join-ratio', type=float, default=0.001)
+    parser.add_argument('--backend', choices=['remote', 'stub'], default='remote')
+    parser.add_argument('--latency', type=float, default=0.3, help='fake inference latency (s)')
+    parser.add_argument('--small-latency', type=float, default=0.1, help='fake small-model latency (s)')
+    parser.add_argument('--no-tiering', action='store_true', help='send every reply to the large model')
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--loading-rate', type=float, default=0.0)
+    parser.add_argument('--webhook-latency', type=float, default=0.05)
+    parser.add_argument('--send-latency', type=float, default=0.05, help='simulated Discord REST latency (s)')
+    parser.add_argument('--no-rate-limit', action='store_true', help='disable inference budgets')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"events            {report['events']:>10,}  ({report['events_per_sec']:.0f}/s offered)")
+    print(f"replies           {report['replies']:>10,}  ({report['replies_per_sec']:.1f}/s)")
+    print(f"reply latency     {report['reply_p50_ms']:>10.0f} ms p50  {report['reply_p99_ms']:.0f} ms p99")
+    print(f"event-loop lag    {report['loop_lag_p50_ms']:>10.1f} ms p50  {report['loop_lag_p99_ms']:.1f} ms p99  "
+          f"{report['loop_lag_max_ms']:.1f} ms max")
+    print(f"peak RSS          {report['peak_rss_mb']:>10.0f} MB")
+    print(f"inference calls   {report['inference_requests']:>10,}  webhooks {report['webhooks']} ({report['webhook_embeds']} embeds)")
+    print(f"unfinished        {report['unfinished']:>10,}  handler errors {report['handler_errors']}")
+    print(f"decisions         {report['decisions']}")
+    print(f"reply outcomes    {report['outcomes']}")
+    print(f"routed            {report['routed']}")
+    print(f"deadline missed   {{{', '.join(f'{c}: {share:.1%}' for c, share in report['deadline_missed'].items())}}}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Memory-bounded conversation and channel-context tracking"""
+import random
+import sys
+import time
+from collections import OrderedDict, deque
+
+from dispatcher import FairResponseQueue
+from prompt_builder import ContextBuffer, summarize_channel
+
+MAX_TOPICS = 10  # Topics remembered per conversation
+CHANNEL_CONTEXT_SIZE = 15  # Lines of channel-wide context
+MAX_CHANNEL_CONTEXTS = 5000  # Channels with live context before the least active is dropped
+CONVERSATION_MEMORY_BUDGET = 64 * 1024 * 1024  # Approximate bytes for all conversations
+
+
+class Conversation:
+    """Rolling history and stats for one (user_id, channel_id) pair"""
+    __slots__ = ('key', 'history', 'last_activity', 'message_count', 'user_name',
+                 'personality_score', 'topics', 'nbytes')
+
+    def __init__(self, key, history_size, now):
+        self.key = key
+        self.history = ContextBuffer(maxlen=history_size)  # Lines plus token counts for the prompt
+        self.last_activity = now  # time.monotonic() seconds
+        self.message_count = 0
+        self.user_name = ''
+        self.personality_score = random.uniform(0.7, 1.0)  # How much personality to show
+        self.topics = deque(maxlen=MAX_TOPICS)  # Most recent distinct topics
+        self.nbytes = 0
+
+
+class ChannelContext:
+    """Recent lines from everyone in a channel, for awareness of ongoing discussions"""
+    __slots__ = ('lines', 'last_activity', 'summary')
+
+    def __init__(self, now):
+        self.lines = deque(maxlen=CHANNEL_CONTEXT_SIZE)
+        self.last_activity = now
+        self.summary = None  # (exclude_speaker, text), rebuilt lazily after new lines arrive
+
+
+def _base_conversation_bytes(history_size):
+    # Fixed cost of an empty record: the object, its two deques and the tuple key in the index
+    probe = Conversation((0, 0), history_size, 0.0)
+    history = probe.history
+    return (sys.getsizeof(probe)
+            + sys.getsizeof(history) + sys.getsizeof(history.lines) + sys.getsizeof(history.tokens)
+            + sys.getsizeof(probe.topics)
+            + sys.getsizeof(probe.key) + 2 * sys.getsizeof(2 ** 62)
+            + sys.getsizeof(0.0))
+
+
+class SmartConversationManager:
+    def __init__(self, history_size=8, timeout=600, memory_budget=CONVERSATION_MEMORY_BUDGET,
+                 max_channel_contexts=MAX_CHANNEL_CONTEXTS, store=None):
+        self.history_size = history_size
+        self.timeout = timeout
+        self.memory_budget = memory_budget
+        self.max_channel_contexts = max_channel_contexts
+        # Both maps are kept in least-recently-active order so eviction pops from the front
+        self.conversations = OrderedDict()  # (user_id, channel_id) -> Conversation
+        self.channel_contexts = OrderedDict()  # channel_id -> ChannelContext
+        self.user_personalities = {}  # user_id -> personality traits
+        self.response_queue = FairResponseQueue()  # Drained by the inference dispatcher
+        self.active_responses = set()
+        self.conversation_bytes = 0
+        self.budget_evictions = 0
+        self.channel_evictions = 0
+        self._base_bytes = _base_conversation_bytes(history_size)
+        self.store = store  # Optional ConversationStore; records are paged in the first time they are touched
+
+    def get_conversation(self, user_id, channel_id):
+        key = (user_id, channel_id)
+        conv = self.conversations.get(key)
+        if conv is None:
+            conv = self.conversations[key] = Conversation(key, self.history_size, time.monotonic())
+            conv.nbytes = self._base_bytes
+            if self.store is not None:
+                self._page_in(conv)
+            self.conversation_bytes += conv.nbytes
+            self._enforce_budget()
+        return conv
+
+    def _page_in(self, conv):
+        row = self.store.load_conversation(conv.key, self.timeout)
+        if row is None:
+            return
+        for line in row.history:
+            conv.history.append(line)
+            conv.nbytes += sys.getsizeof(line)
+        for topic in row.topics:
+            conv.topics.append(topic)
+            conv.nbytes += sys.getsizeof(topic)
+        conv.user_name = row.user_name
+        conv.message_count = row.message_count
+        conv.personality_score = row.personality_score
+
+    def _channel_context(self, channel_id, now=None):
+        """Channel context from memory or the store; with now, create it if there is none"""
+        context = self.channel_contexts.get(channel_id)
+        if context is not None:
+            return context
+        stored = self.store.load_channel(channel_id, self.timeout) if self.store is not None else None
+        if stored is None and now is None:
+            return None
+        context = self.channel_contexts[channel_id] = ChannelContext(now or time.monotonic())
+        if stored is not None:
+            context.lines.extend(stored[0])
+        if len(self.channel_contexts) > self.max_channel_contexts:
+            self.channel_contexts.popitem(last=False)
+            self.channel_evictions += 1
+        return context
+
+    def get_channel_context(self, channel_id):
+        """Recent channel lines (read-only; does not create an entry)"""
+        context = self._channel_context(channel_id)
+        return context.lines if context is not None else ()
+
+    def channel_summary(self, channel_id, exclude_speaker=None):
+        """Compact "who else is talking about what" line for the prompt, cached until the channel changes"""
+        context = self._channel_context(channel_id)
+        if context is None:
+            return ''
+        if context.summary is None or context.summary[0] != exclude_speaker:
+            context.summary = (exclude_speaker, summarize_channel(context.lines, exclude_speaker))
+        return context.summary[1]
+
+    def add_message(self, user_id, channel_id, username, message, is_bot=False):
+        now = time.monotonic()
+        conv = self.get_conversation(user_id, channel_id)
+        line = f"{'Bot' if is_bot else username}: {message}"
+
+        delta = sys.getsizeof(line)
+        if len(conv.history) == conv.history.maxlen:
+            delta -= sys.getsizeof(conv.history[0])
+        conv.history.append(line)
+        conv.last_activity = now
+        conv.user_name = username
+        conv.message_count += 1
+        self.conversations.move_to_end(conv.key)
+
+        # Add to channel context for awareness of ongoing discussions
+        context = self._channel_context(channel_id, now)
+        self.channel_contexts.move_to_end(channel_id)
+        context.lines.append(f"{'Bot' if is_bot else username}: {message[:100]}")
+        context.last_activity = now
+        context.summary = None
+
+        # Extract topics (simple keyword extraction)
+        words = message.lower().split()
+        topics = [word for word in words if len(word) > 4 and word.isalpha()]
+        for topic in topics[:3]:  # Keep top 3 topics
+            if topic in conv.topics:
+                continue
+            if len(conv.topics) == conv.topics.maxlen:
+                delta -= sys.getsizeof(conv.topics[0])
+            conv.topics.append(topic)
+            delta += sys.getsizeof(topic)
+
+        conv.nbytes += delta
+        self.conversation_bytes += delta
+        if self.store is not None:
+            self.store.mark_conversation(conv)
+            self.store.mark_channel(channel_id, context)
+        self._enforce_budget()
+
+    def remove_conversation(self, key):
+        conv = self.conversations.pop(key, None)
+        if conv is not None:
+            self.conversation_bytes -= conv.nbytes
+        return conv
+
+    def cleanup_expired(self, max_items=None):
+        """Drop conversations and channel contexts idle longer than the timeout
+        
+        Every record shares one timeout and is moved to the back of its map whenever it is
+        touched, so activity order is expiry order: popping from the front until the first live
+        record costs O(expired), not O(total). max_items bounds the work done per call.
+        """
+        cutoff = time.monotonic() - self.timeout
+        budget = max_items if max_items is not None else float('inf')
+
+        expired = 0
+        conversations = self.conversations
+        while conversations and expired < budget:
+            key = next(iter(conversations))
+            if conversations[key].last_activity > cutoff:
+                break
+            self.remove_conversation(key)
+            expired += 1
+
+        channel_contexts = self.channel_contexts
+        dropped = 0
+        while channel_contexts and dropped < budget:
+            channel_id = next(iter(channel_contexts))
+            if channel_contexts[channel_id].last_activity > cutoff:
+                break
+            del channel_contexts[channel_id]
+            dropped += 1
+
+        return expired
+
+    def _enforce_budget(self):
+        # Drop least-recently-active conversations until we are back under budget
+        while self.conversation_bytes > self.memory_budget and len(self.conversations) > 1:
+            key = next(iter(self.conversations))
+            self.remove_conversation(key)
+            self.budget_evictions += 1
+
+    def memory_report(self, deep=False):
+        """Approximate memory use; deep=True re-measures every record instead of using running totals"""
+        if deep:
+            conversation_bytes = sum(
+                self._base_bytes
+                + sum(sys.getsizeof(line) for line in conv.history)
+                + sum(sys.getsizeof(topic) for topic in conv.topics)
+                for conv in self.conversations.values()
+            )
+        else:
+            conversation_bytes = self.conversation_bytes
+
+        channel_bytes = sum(
+            sys.getsizeof(context) + sys.getsizeof(context.lines)
+            + sum(sys.getsizeof(line) for line in context.lines)
+            for context in self.channel_contexts.values()
+        ) if deep else None
+
+        count = len(self.conversations)
+        return {
+            'conversations': count,
+            'conversation_bytes': conversation_bytes,
+            'bytes_per_conversation': conversation_bytes / count if count else 0.0,
+            'index_bytes': sys.getsizeof(self.conversations) + sys.getsizeof(self.channel_contexts),
+            'channel_contexts': len(self.channel_contexts),
+            'channel_context_bytes': channel_bytes,
+            'memory_budget': self.memory_budget,
+            'budget_evictions': self.budget_evictions,
+            'channel_evictions': self.channel_evictions,
+        }
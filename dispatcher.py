@@ -0,0 +1,273 @@
+"""Bounded, guild-fair inference dispatcher with micro-batching and load shedding"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_QUEUE_SIZE = int(os.getenv('RESPONSE_QUEUE_SIZE', '50'))  # Pending inference jobs
+BATCH_WINDOW = float(os.getenv('BATCH_WINDOW', '0.05'))  # Seconds to wait for prompts to coalesce
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '4'))
+
+# Reply classes, in the order we are willing to drop them under load
+REPLY_RANDOM = 'random'
+REPLY_TRIGGER = 'trigger'
+REPLY_MENTION = 'mention'
+REPLY_DM = 'dm'
+
+REPLY_PRIORITY = {
+    REPLY_RANDOM: 0,
+    REPLY_TRIGGER: 1,
+    REPLY_MENTION: 2,
+    REPLY_DM: 2,
+}
+
+
+class LoadShed(Exception):
+    """Raised when a job is rejected or evicted because the queue is full"""
+
+
+class InferenceJob:
+    __slots__ = ('prompt', 'parameters', 'guild_id', 'reply_class', 'priority',
+                 'batch_key', 'stream', 'future', 'enqueued_at', 'deadline')
+
+    def __init__(self, prompt, parameters, guild_id=None, reply_class=REPLY_MENTION, batch_key=None,
+                 stream=None, deadline=None):
+        loop = asyncio.get_running_loop()
+        self.prompt = prompt
+        self.parameters = parameters
+        self.guild_id = guild_id
+        self.reply_class = reply_class
+        self.priority = REPLY_PRIORITY.get(reply_class, 0)
+        self.stream = stream  # async callback for incremental text; streamed jobs are never batched
+        self.batch_key = batch_key if stream is None else None  # Same key = may share a request
+        self.future = loop.create_future()
+        self.enqueued_at = loop.time()
+        self.deadline = deadline  # Loop time after which the caller stops waiting, or None
+
+
+class FairResponseQueue:
+    """Bounded job queue that round-robins between guilds and sheds low-priority jobs when full"""
+
+    def __init__(self, maxsize=RESPONSE_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._guilds = OrderedDict()  # guild_id -> deque of jobs, in round-robin order
+        self._size = 0
+        self._changed = asyncio.Event()
+        self.shed_count = 0
+
+    def qsize(self):
+        return self._size
+
+    def full(self):
+        return self._size >= self.maxsize
+
+    def put_nowait(self, job):
+        """Queue a job, evicting a lower-priority one if the queue is full"""
+        if self.full():
+            victim = self._lowest_priority_job(below=job.priority)
+            if victim is None:
+                self.shed_count += 1
+                raise LoadShed(f"queue full ({self._size} jobs)")
+            self._remove(victim)
+            self.shed_count += 1
+            if not victim.future.done():
+                victim.future.set_exception(LoadShed("evicted by higher-priority reply"))
+
+        jobs = self._guilds.get(job.guild_id)
+        if jobs is None:
+            jobs = self._guilds[job.guild_id] = deque()
+        jobs.append(job)
+        self._size += 1
+        self._notify()
+
+    async def get(self):
+        """Take the next job, rotating fairly between guilds"""
+        while self._size == 0:
+            await self._wait_changed()
+        return self._pop_next()
+
+    def take_matching(self, batch_key, limit):
+        """Remove up to `limit` queued jobs with the same batch key, one guild at a time"""
+        taken = []
+        if batch_key is None or limit <= 0:
+            return taken
+
+        progress = True
+        while progress and len(taken) < limit:
+            progress = False
+            for guild_id in list(self._guilds):
+                jobs = self._guilds[guild_id]
+                for job in jobs:
+                    if job.batch_key == batch_key:
+                        self._remove(job)
+                        taken.append(job)
+                        progress = True
+                        break
+                if len(taken) >= limit:
+                    break
+        return taken
+
+    async def wait_for_put(self, timeout):
+        """Wait until something is queued or `timeout` seconds pass"""
+        try:
+            await asyncio.wait_for(self._wait_changed(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def drain(self):
+        """Remove and return every queued job"""
+        jobs = [job for queue in self._guilds.values() for job in queue]
+        self._guilds.clear()
+        self._size = 0
+        return jobs
+
+    def _pop_next(self):
+        guild_id, jobs = next(iter(self._guilds.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._guilds.move_to_end(guild_id)
+        else:
+            del self._guilds[guild_id]
+        self._size -= 1
+        return job
+
+    def _remove(self, job):
+        jobs = self._guilds[job.guild_id]
+        jobs.remove(job)
+        if not jobs:
+            del self._guilds[job.guild_id]
+        self._size -= 1
+
+    def _lowest_priority_job(self, below):
+        # Abandoned jobs first, then the oldest job of the lowest priority class
+        victim = None
+        victim_rank = None
+        for jobs in self._guilds.values():
+            for job in jobs:
+                if job.future.done():
+                    return job
+                if job.priority >= below:
+                    continue
+                rank = (job.priority, job.enqueued_at)
+                if victim is None or rank < victim_rank:
+                    victim, victim_rank = job, rank
+        return victim
+
+    async def _wait_changed(self):
+        await self._changed.wait()
+
+    def _notify(self):
+        # Wake every waiter, then arm a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class InferenceDispatcher:
+    """Worker pool that drains a FairResponseQueue with bounded concurrency"""
+
+    def __init__(self, queue, handler, concurrency, batch_window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.queue = queue
+        self.handler = handler  # async callable: list[InferenceJob] -> list of results
+        self.concurrency = concurrency
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._workers = []
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.batched_jobs = 0
+
+    @property
+    def running(self):
+        return any(not worker.done() for worker in self._workers)
+
+    def start(self):
+        """Spawn the worker pool; calling it again while running does nothing"""
+        if self.running:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"inference-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(f"⚙️ Inference dispatcher started with {self.concurrency} workers")
+
+    async def submit(self, prompt, parameters, guild_id=None, reply_class=REPLY_MENTION, batch_key=None,
+                     stream=None, deadline=None):
+        """Queue a prompt and wait for its result (raises LoadShed under backpressure)"""
+        job = InferenceJob(prompt, parameters, guild_id, reply_class, batch_key, stream, deadline)
+        self.queue.put_nowait(job)
+        self.submitted += 1
+        return await job.future
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            batch = await self._collect_batch(job)
+            # Callers that timed out cancel their future; don't spend inference on them
+            batch = [queued for queued in batch if not queued.future.done()]
+            if not batch:
+                continue
+
+            self.in_flight += len(batch)
+            try:
+                results = await self.handler(batch)
+            except asyncio.CancelledError:
+                for queued in batch:
+                    queued.future.cancel()
+                raise
+            except Exception as e:
+                self.failed += len(batch)
+                for queued in batch:
+                    if not queued.future.done():
+                        queued.future.set_exception(e)
+            else:
+                self.completed += len(batch)
+                for queued, result in zip(batch, results):
+                    if not queued.future.done():
+                        queued.future.set_result(result)
+            finally:
+                self.in_flight -= len(batch)
+
+    async def _collect_batch(self, first):
+        batch = [first]
+        if first.batch_key is None or self.max_batch_size <= 1:
+            return batch
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            batch.extend(self.queue.take_matching(first.batch_key, self.max_batch_size - len(batch)))
+            remaining = deadline - loop.time()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                break
+            await self.queue.wait_for_put(remaining)
+
+        if len(batch) > 1:
+            self.batches += 1
+            self.batched_jobs += len(batch)
+        return batch
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'shed': self.queue.shed_count,
+            'batches': self.batches,
+            'batched_jobs': self.batched_jobs,
+        }
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in self.queue.drain():
+            if not job.future.done():
+                job.future.set_exception(LoadShed("dispatcher shutting down"))
@@ -0,0 +1,83 @@
+"""Drop irrelevant gateway events from their raw payloads, before discord.py builds models for them"""
+import os
+from collections import OrderedDict
+
+GATEWAY_FILTER = os.getenv('GATEWAY_FILTER', '1') == '1'  # 0 hands every event to discord.py as before
+OWN_MESSAGE_IDS = 1000  # Our recent message ids kept for reaction filtering (discord.py's message cache size)
+
+
+class GatewayFilter:
+    """Wraps discord.py's MESSAGE_CREATE and MESSAGE_REACTION_ADD parsers
+
+    Building a Message means constructing its author Member, mentions, embeds and attachments.
+    Most events are then ignored anyway. `message_filter(data)` sees the raw payload of every
+    message that isn't ours and returns whether to build and dispatch it. Our own messages always
+    go through, so they land in the message cache that reaction events are resolved against.
+    Their ids are also remembered, so a reaction is only parsed when it is on one of our messages.
+    """
+
+    def __init__(self, message_filter, max_own_messages=OWN_MESSAGE_IDS):
+        self.message_filter = message_filter
+        self.max_own_messages = max_own_messages
+        self._own_messages = OrderedDict()  # message_id -> None, oldest first
+        self._connection = None
+        self._parse_message = None
+        self._parse_reaction = None
+        self.messages_seen = 0
+        self.messages_dropped = 0
+        self.reactions_seen = 0
+        self.reactions_dropped = 0
+
+    @property
+    def installed(self):
+        return self._connection is not None
+
+    def install(self, connection):
+        """Wrap the parsers of a client's ConnectionState; must happen before the gateway connects"""
+        if self.installed:
+            return
+        parsers = connection.parsers
+        self._connection = connection
+        self._parse_message = parsers['MESSAGE_CREATE']
+        self._parse_reaction = parsers['MESSAGE_REACTION_ADD']
+        parsers['MESSAGE_CREATE'] = self._message_create
+        parsers['MESSAGE_REACTION_ADD'] = self._reaction_add
+
+    def uninstall(self):
+        if not self.installed:
+            return
+        parsers = self._connection.parsers
+        parsers['MESSAGE_CREATE'] = self._parse_message
+        parsers['MESSAGE_REACTION_ADD'] = self._parse_reaction
+        self._connection = None
+
+    def _remember(self, message_id):
+        own = self._own_messages
+        own[message_id] = None
+        if len(own) > self.max_own_messages:
+            own.popitem(last=False)
+
+    def _message_create(self, data):
+        self.messages_seen += 1
+        if int(data['author']['id']) == self._connection.self_id:
+            self._remember(int(data['id']))
+        elif not self.message_filter(data):
+            self.messages_dropped += 1
+            return
+        self._parse_message(data)
+
+    def _reaction_add(self, data):
+        self.reactions_seen += 1
+        if int(data['message_id']) not in self._own_messages or int(data['user_id']) == self._connection.self_id:
+            self.reactions_dropped += 1
+            return
+        self._parse_reaction(data)
+
+    def stats(self):
+        return {
+            'messages_seen': self.messages_seen,
+            'messages_dropped': self.messages_dropped,
+            'reactions_seen': self.reactions_seen,
+            'reactions_dropped': self.reactions_dropped,
+            'own_messages': len(self._own_messages),
+        }
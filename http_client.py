@@ -0,0 +1,138 @@
+"""Shared pooled HTTP client for inference and webhook calls"""
+import aiohttp
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration (override through environment variables)
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))  # Total open connections
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '20'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '75'))  # Idle socket lifetime
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_TOTAL_TIMEOUT = float(os.getenv('HTTP_TOTAL_TIMEOUT', '30'))
+
+
+class HTTPClientPool:
+    """One long-lived aiohttp session with keep-alive and connection metrics"""
+
+    def __init__(self, limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, dns_cache_ttl=HTTP_DNS_CACHE_TTL,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, total_timeout=HTTP_TOTAL_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.total_timeout = total_timeout
+        self._session = None
+        self._connector = None
+        self._start_lock = asyncio.Lock()
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    async def start(self):
+        """Create the session; safe to call again (e.g. when on_ready fires after a reconnect)"""
+        async with self._start_lock:
+            if self._session is not None and not self._session.closed:
+                return self._session
+
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=self._connector,
+                timeout=self.timeout(),
+                trace_configs=[self._trace_config()],
+            )
+            logger.info(f"🔌 HTTP pool ready (limit={self.limit}, per_host={self.limit_per_host})")
+            return self._session
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP pool is not started")
+        return self._session
+
+    @property
+    def started(self):
+        return self._session is not None and not self._session.closed
+
+    def timeout(self, total=None, connect=None):
+        """Build a ClientTimeout using the pool defaults for anything not given"""
+        return aiohttp.ClientTimeout(
+            total=total if total is not None else self.total_timeout,
+            sock_connect=connect if connect is not None else self.connect_timeout,
+        )
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.dns_cache_misses += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    def stats(self):
+        """Snapshot of pool usage: open/idle/active connections and reuse rate"""
+        idle = active = 0
+        if self._connector is not None and not self._connector.closed:
+            # aiohttp keeps idle sockets in _conns and checked-out ones in _acquired
+            idle = sum(len(conns) for conns in self._connector._conns.values())
+            active = len(self._connector._acquired)
+
+        acquired_total = self.connections_created + self.connections_reused
+        return {
+            'open_connections': idle + active,
+            'idle_connections': idle,
+            'active_connections': active,
+            'requests': self.requests,
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'reuse_rate': self.connections_reused / acquired_total if acquired_total else 0.0,
+            'dns_cache_hits': self.dns_cache_hits,
+            'dns_cache_misses': self.dns_cache_misses,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            # Give SSL transports a moment to shut down cleanly
+            await asyncio.sleep(0.25)
+            logger.info("🔌 HTTP pool closed")
+        self._session = None
+        self._connector = None
+
+
+def float_header(headers, name):
+    """A numeric response header such as Retry-After, or None when it is missing or malformed"""
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,35 @@
+"""Worker-process side of the local backend; imports nothing from the bot so spawned workers stay light"""
+import time
+
+_pipeline = None
+
+
+def load_model(model_name, threads):
+    """Process-pool initializer: load the model once per worker and keep it for the process lifetime"""
+    global _pipeline
+    import torch
+    from transformers import pipeline
+
+    torch.set_num_threads(threads)
+    _pipeline = pipeline('text-generation', model=model_name, device=-1)
+
+
+def generate(prompts, parameters):
+    cpu_start = time.process_time()
+    tokenizer = _pipeline.tokenizer
+    outputs = _pipeline(
+        list(prompts),
+        max_new_tokens=parameters.get('max_new_tokens', 80),
+        do_sample=parameters.get('do_sample', True),
+        temperature=parameters.get('temperature', 0.8),
+        top_p=parameters.get('top_p', 0.9),
+        repetition_penalty=parameters.get('repetition_penalty', 1.1),
+        pad_token_id=parameters.get('pad_token_id', tokenizer.eos_token_id),
+        return_full_text=True,
+    )
+    texts = [output[0]['generated_text'] for output in outputs]
+    new_tokens = sum(
+        max(0, len(tokenizer.encode(text)) - len(tokenizer.encode(prompt)))
+        for prompt, text in zip(prompts, texts)
+    )
+    return texts, new_tokens, time.process_time() - cpu_start
@@ -0,0 +1,204 @@
+"""Long-term conversation memory: hashed n-gram embeddings in compact per-conversation arrays, searched with NumPy"""
+import logging
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # Optional: without NumPy the bot simply has no long-term memory
+    np = None
+
+logger = logging.getLogger(__name__)
+
+LONG_TERM_MEMORY_BUDGET = int(os.getenv('LONG_TERM_MEMORY_BUDGET', str(64 * 1024 * 1024)))  # Bytes; 0 disables
+MEMORY_DIM = 256  # Hashed feature buckets per embedding
+MEMORY_TURNS_PER_CONVERSATION = int(os.getenv('MEMORY_TURNS_PER_CONVERSATION', '500'))  # Oldest overwritten beyond this
+MEMORY_TOP_K = 3  # Past exchanges recalled into a prompt
+MEMORY_MIN_SIMILARITY = float(os.getenv('MEMORY_MIN_SIMILARITY', '0.2'))  # Cosine below this isn't worth the tokens
+_INITIAL_CAPACITY = 8  # Rows allocated for a new conversation; doubled as it fills
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "the and for are but not you your yours with this that have has had was were will would can could "
+    "should just what when where who how why all any some its it's i'm im our out about from they them "
+    "their there then than too very into onto also been being get got lol yeah yes okay hey".split())
+
+
+def _features(text):
+    """Content words plus their character trigrams, so 'games' and 'gaming' still overlap"""
+    for word in _WORD_RE.findall(text.lower()):
+        if len(word) < 3 or word in _STOPWORDS:
+            continue
+        yield word, 1.0
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3], 0.3
+
+
+def embed(texts, dim=MEMORY_DIM):
+    """Unit-length float32 rows: each feature adds its weight to one hashed bucket with a hashed sign
+
+    Python's str hash is salted per process, which is fine because embeddings never leave it.
+    """
+    indices = []
+    weights = []
+    for row, text in enumerate(texts):
+        base = row * dim
+        for feature, weight in _features(text):
+            h = hash(feature)
+            indices.append(base + h % dim)
+            weights.append(weight if h & 1 else -weight)
+    vectors = np.bincount(np.asarray(indices, np.intp), weights, minlength=len(texts) * dim)
+    vectors = vectors.astype(np.float32).reshape(len(texts), dim)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+class _Shelf:
+    """One conversation's memories: int8 vectors, their texts, and a sequence number per row"""
+    __slots__ = ('vectors', 'seqs', 'texts', 'count', 'total', 'nbytes')
+
+    def __init__(self, dim):
+        self.vectors = np.zeros((_INITIAL_CAPACITY, dim), np.int8)
+        self.seqs = np.zeros(_INITIAL_CAPACITY, np.int64)
+        self.texts = [None] * _INITIAL_CAPACITY
+        self.count = 0  # Rows in use
+        self.total = 0  # Memories ever added; the next one's sequence number
+        self.nbytes = self._fixed_bytes()
+
+    def _fixed_bytes(self):
+        return self.vectors.nbytes + self.seqs.nbytes + sys.getsizeof(self.texts)
+
+    def add(self, vectors, texts, max_turns):
+        """Append rows (growing up to max_turns, then overwriting the oldest); returns the change in bytes"""
+        before = self.nbytes
+        for vector, text in zip(vectors, texts):
+            if self.count < max_turns:
+                if self.count == len(self.texts):
+                    self._grow(min(max_turns, 2 * self.count))
+                row = self.count
+                self.count += 1
+            else:
+                row = self.total % max_turns
+                self.nbytes -= sys.getsizeof(self.texts[row])
+            self.vectors[row] = vector
+            self.seqs[row] = self.total
+            self.texts[row] = text
+            self.nbytes += sys.getsizeof(text)
+            self.total += 1
+        return self.nbytes - before
+
+    def _grow(self, capacity):
+        old = self._fixed_bytes()
+        vectors = np.zeros((capacity, self.vectors.shape[1]), np.int8)
+        vectors[:self.count] = self.vectors[:self.count]
+        seqs = np.zeros(capacity, np.int64)
+        seqs[:self.count] = self.seqs[:self.count]
+        self.vectors = vectors
+        self.seqs = seqs
+        self.texts.extend([None] * (capacity - len(self.texts)))
+        self.nbytes += self._fixed_bytes() - old
+
+
+class LongTermMemory:
+    """Past exchanges per (user_id, channel_id), recalled by similarity to the new message
+
+    Each conversation keeps its memories in one preallocated int8 array, so recall is a single
+    matrix-vector product over that array plus an argpartition for the top k. Conversations are
+    kept in least-recently-used order. The least recent ones are dropped whenever the total goes
+    over the byte budget.
+    """
+
+    def __init__(self, budget=LONG_TERM_MEMORY_BUDGET, dim=MEMORY_DIM, max_turns=MEMORY_TURNS_PER_CONVERSATION,
+                 min_similarity=MEMORY_MIN_SIMILARITY):
+        self.budget = budget
+        self.dim = dim
+        self.max_turns = max_turns
+        self.min_similarity = min_similarity
+        self._shelves = OrderedDict()  # (user_id, channel_id) -> _Shelf
+        self.nbytes = 0
+        self.stored = 0
+        self.recalls = 0
+        self.recalled = 0
+        self.evictions = 0
+        self.recall_seconds = 0.0
+        if budget > 0 and np is None:
+            logger.warning("⚠️ NumPy is not installed; long-term memory is disabled")
+
+    @property
+    def enabled(self):
+        return np is not None and self.budget > 0
+
+    def remember(self, key, text, memory=None):
+        """Store one exchange: text is what gets embedded, memory what a later recall returns"""
+        self.remember_many(key, [text], [memory if memory is not None else text])
+
+    def remember_many(self, key, texts, memories):
+        if not self.enabled or not texts:
+            return
+        shelf = self._shelves.get(key)
+        if shelf is None:
+            shelf = self._shelves[key] = _Shelf(self.dim)
+            self.nbytes += shelf.nbytes
+        else:
+            self._shelves.move_to_end(key)
+        # Unit vectors scaled into int8: a quarter of the float32 footprint for a tiny loss in ranking
+        quantized = np.rint(embed(texts, self.dim) * 127).astype(np.int8)
+        self.nbytes += shelf.add(quantized, memories, self.max_turns)
+        self.stored += len(texts)
+        self._enforce_budget()
+
+    def recall(self, key, query, k=MEMORY_TOP_K, skip_recent=0):
+        """Up to k stored memories most similar to query, oldest first
+
+        skip_recent leaves out the newest memories, which the prompt already has as recent history.
+        """
+        if not self.enabled:
+            return []
+        shelf = self._shelves.get(key)
+        if shelf is None or shelf.count == 0 or shelf.total <= skip_recent:
+            return []
+        started = time.perf_counter()
+        self._shelves.move_to_end(key)
+        self.recalls += 1
+
+        count = shelf.count
+        scores = shelf.vectors[:count].astype(np.float32) @ embed([query], self.dim)[0] / 127
+        if skip_recent:
+            scores[shelf.seqs[:count] >= shelf.total - skip_recent] = -1.0
+        if count > k:
+            rows = np.argpartition(scores, count - k)[count - k:]
+        else:
+            rows = np.arange(count)
+        rows = rows[scores[rows] >= self.min_similarity]
+        rows = rows[np.argsort(shelf.seqs[rows])]
+        self.recalled += len(rows)
+        self.recall_seconds += time.perf_counter() - started
+        return [shelf.texts[row] for row in rows]
+
+    def forget(self, key):
+        shelf = self._shelves.pop(key, None)
+        if shelf is not None:
+            self.nbytes -= shelf.nbytes
+
+    def _enforce_budget(self):
+        while self.nbytes > self.budget and len(self._shelves) > 1:
+            _, shelf = self._shelves.popitem(last=False)
+            self.nbytes -= shelf.nbytes
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'conversations': len(self._shelves),
+            'bytes': self.nbytes,
+            'budget': self.budget,
+            'stored': self.stored,
+            'recalls': self.recalls,
+            'recalled': self.recalled,
+            'recall_seconds': self.recall_seconds,
+            'evictions': self.evictions,
+        }
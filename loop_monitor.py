@@ -0,0 +1,109 @@
+"""Event-loop lag watchdog with stack snapshots of stalls, and cooperative iteration helpers"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.1'))  # Seconds between scheduling probes
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '0.25'))  # Seconds blocked before we dump a stack
+COOPERATIVE_CHUNK = 2000  # Items processed between yields to the event loop
+
+
+class LoopMonitor:
+    """Measures how late the loop runs a timer, and catches whatever is blocking it while it blocks
+
+    A probe task sleeps for `interval` and records how late it woke up. A watchdog thread watches
+    the probe's heartbeat. When the heartbeat is older than `threshold`, the watchdog grabs the
+    loop thread's current stack. That stack is the code holding the loop, caught while it runs.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_STALL_THRESHOLD, histogram=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = histogram  # Optional metrics.Histogram for every lag sample
+        self.samples = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = 0
+        self.last_stall_stack = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._probe(), name='loop-lag-probe')
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._heartbeat = time.monotonic()
+            self.samples += 1
+            self.last_lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+
+    def _watch(self):
+        reported = False  # One stack per stall, not one per check
+        while not self._stopping.wait(self.threshold / 2):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self.stalls += 1
+            self.last_stall_stack = ''.join(traceback.format_stack(frame))
+            logger.warning(f"🐢 Event loop blocked for {blocked * 1000:.0f}ms in:\n{self.last_stall_stack}")
+
+    def stats(self):
+        return {
+            'samples': self.samples,
+            'last_lag_seconds': self.last_lag,
+            'max_lag_seconds': self.max_lag,
+            'stalls': self.stalls,
+        }
+
+    async def close(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+async def count_cooperatively(iterable, predicate, chunk_size=COOPERATIVE_CHUNK):
+    """sum(1 for item in iterable if predicate(item)), yielding to the loop every chunk_size items"""
+    count = 0
+    for index, item in enumerate(iterable, 1):
+        if predicate(item):
+            count += 1
+        if index % chunk_size == 0:
+            await asyncio.sleep(0)
+    return count
@@ -1,14 +1,41 @@
 import discord
 from discord.ext import tasks
-import aiohttp
+from aiohttp import web
 import asyncio
+import contextlib
 import random
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
-from collections import defaultdict, deque
 import platform
+import sqlite3
+import time
+import hmac
+from collections import OrderedDict
+from http_client import HTTPClientPool
+from activity import ActivityTracker
+from metrics import REGISTRY, MetricsServer
+from loop_monitor import LoopMonitor, count_cooperatively
+from profiler import PROFILE_MAX_SECONDS, SamplingProfiler
+from notifications import WebhookNotifier
+from rest_scheduler import (REST_PRESENCE, REST_REACTION, REST_REPLY, REST_WELCOME,
+                            RestScheduler)
+from gateway_filter import GATEWAY_FILTER, GatewayFilter
+from response_cache import ResponseCache
+from conversations import SmartConversationManager
+from sharding import SHARD_COUNT, SHARD_IDS, SHARD_PROCESSES, create_state_backend, launch, parse_shard_ids
+from storage import CONVERSATION_DB_PATH, STORAGE_FLUSH_INTERVAL, ConversationStore
+from matcher import MatcherRegistry
+from streaming import StreamingReply
+from prompt_builder import PromptBuilder, load_tokenizer
+from long_term_memory import LongTermMemory
+from rate_limiter import RateLimiter
+from router import REPLY_TOKENS, TIER_LARGE, TIER_SMALL, ModelRouter, ModelTier
+from backends import InferenceError, create_backend
+from resilience import RETRY_BUDGET, ResilientBackend
+from dispatcher import (FairResponseQueue, InferenceDispatcher, LoadShed,
+                        REPLY_DM, REPLY_MENTION, REPLY_RANDOM, REPLY_TRIGGER)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -21,70 +48,233 @@ intents.guilds = True
 intents.members = True
 intents.reactions = True
 
-bot = discord.Client(intents=intents)
+# With SHARD_COUNT set, one process runs the shards in SHARD_IDS (all of them if unset)
+BotBase = discord.AutoShardedClient if SHARD_COUNT else discord.Client
+shard_options = {'shard_count': SHARD_COUNT, 'shard_ids': parse_shard_ids(SHARD_IDS)} if SHARD_COUNT else {}
+# This process's part of bot-wide budgets: the fraction of all shards it runs. Launched workers have
+# SHARD_PROCESSES=1 in their environment, so it can't be derived from that.
+SHARD_SHARE = len(shard_options['shard_ids']) / SHARD_COUNT if shard_options.get('shard_ids') else 1.0
+
+# Startup fast-path: don't download every guild's member list at login and don't cache members
+# (the bot's own member is always kept). The join summary fetches a guild's members when it needs them.
+LAZY_MEMBERS = os.getenv('LAZY_MEMBERS', '1') == '1'
+MEMBER_FETCH_TIMEOUT = float(os.getenv('MEMBER_FETCH_TIMEOUT', '30'))  # Seconds to wait for a guild's members
+cache_options = {
+    'chunk_guilds_at_startup': False,
+    'member_cache_flags': discord.MemberCacheFlags.none(),
+} if LAZY_MEMBERS else {}
+
+# Outbound Discord calls share per-route and global buckets; replies go first, cosmetic calls are dropped when full
+rest_scheduler = RestScheduler(global_share=SHARD_SHARE, histogram=REGISTRY.histogram(
+    'bot_rest_queue_seconds', 'Time outbound Discord calls waited for a rate-limit slot', ('kind',)))
+
+class AIBot(BotBase):
+    async def setup_hook(self):
+        """One-time setup before connecting to the gateway"""
+        global conversation_store
+        if CONVERSATION_DB_PATH:
+            conversation_store = await asyncio.to_thread(ConversationStore, CONVERSATION_DB_PATH)
+            convo_manager.store = conversation_store
+            REGISTRY.collect_stats('bot_conversation_store', conversation_store.stats)
+        if GATEWAY_FILTER:
+            gateway_filter.install(self._connection)
+        # Up first so the platform health check passes while everything else warms
+        await metrics_server.start()
+        loop_monitor.start()
+        rest_scheduler.start()
+        try:
+            await state_backend.start()
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ Shared state unavailable at startup, will retry on use: {e}")
+        await asyncio.to_thread(response_cache.load)
+        message_matchers.load_config()
+        await asyncio.to_thread(load_tokenizer)
+        # Warm the model before connecting so the first reply doesn't pay for loading it
+        await inference_backend.start()
+        if small_backend is not None:
+            await small_backend.start()
+    
+    async def close(self):
+        """Release shared resources before the gateway connection goes away"""
+        await inference_dispatcher.close()
+        await inference_backend.close()
+        if small_dispatcher is not None:
+            await small_dispatcher.close()
+            await small_backend.close()
+        await webhook_notifier.close()
+        await rest_scheduler.close()
+        await save_response_cache()
+        if conversation_store is not None:
+            await conversation_store.flush()
+            await asyncio.to_thread(conversation_store.close)
+        await http_pool.close()
+        try:
+            await state_backend.delete(GUILD_COUNT_KEY)
+        except (OSError, asyncio.TimeoutError, RuntimeError) as e:
+            logger.warning(f"⚠️ Could not remove this process's guild count: {e}")
+        await state_backend.close()
+        await metrics_server.close()
+        await loop_monitor.close()
+        await super().close()
+
+bot = AIBot(intents=intents, http_trace=rest_scheduler.trace_config(), **shard_options, **cache_options)
 
 # Configuration
 HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/microsoft/DialoGPT-large"
+# Cheaper model for random interjections and for replies the large model can't make in time; empty disables
+SMALL_MODEL_API_URL = os.getenv('SMALL_MODEL_API_URL',
+                                "https://api-inference.huggingface.co/models/microsoft/DialoGPT-small")
 HUGGINGFACE_TOKEN = os.getenv('HUGGINGFACE_TOKEN')
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Optional webhook for server join notifications
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'remote')  # remote, local or stub
+STREAMING_REPLIES = os.getenv('STREAMING_REPLIES', '0') == '1'  # Send the first sentence early, then edit
 
 # Bot personality and behavior settings
 RANDOM_RESPONSE_CHANCE = 0.12  # 12% chance to randomly respond
+RANDOM_REPLY_COOLDOWN = 120  # Seconds after a bot reply during which random replies are less likely
+BUSY_CHANNEL_RATE = 6  # Messages per minute at which a channel counts as busy
+CROWD_SIZE = 5  # Active speakers beyond which a random interjection gets less likely
 MAX_CONVERSATION_HISTORY = 8
 CONVERSATION_TIMEOUT = 600  # 10 minutes
 MAX_CONCURRENT_RESPONSES = 5  # Handle multiple users simultaneously
+CLEANUP_INTERVAL = int(os.getenv('CLEANUP_INTERVAL', '30'))  # Seconds between expiry sweeps
+CLEANUP_BATCH = 5000  # Expired conversations dropped before yielding to the event loop
+CONVERSATION_MEMORY_BUDGET = int(os.getenv('CONVERSATION_MEMORY_BUDGET', str(64 * 1024 * 1024)))  # Bytes
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '10'))  # Seconds per model call
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', '10'))
+QUEUE_WAIT_TIMEOUT = float(os.getenv('QUEUE_WAIT_TIMEOUT', '10'))  # Max time a reply waits for a worker
+SMALL_MODEL_CONCURRENCY = int(os.getenv('SMALL_MODEL_CONCURRENCY', '3'))  # Workers for the small model
+INFERENCE_BATCHING = os.getenv('INFERENCE_BATCHING', '1') == '1'  # Send list `inputs` when prompts coalesce
 
-# Advanced conversation tracking
-class SmartConversationManager:
-    def __init__(self):
-        self.conversations = {}  # user_id -> conversation data
-        self.channel_contexts = defaultdict(lambda: deque(maxlen=15))  # channel-wide context
-        self.user_personalities = {}  # user_id -> personality traits
-        self.response_queue = asyncio.Queue()
-        self.active_responses = set()
-        
-    def get_conversation(self, user_id, channel_id):
-        key = f"{user_id}_{channel_id}"
-        if key not in self.conversations:
-            self.conversations[key] = {
-                'history': deque(maxlen=MAX_CONVERSATION_HISTORY),
-                'last_activity': datetime.now(),
-                'message_count': 0,
-                'user_name': '',
-                'personality_score': random.uniform(0.7, 1.0),  # How much personality to show
-                'topics': set(),  # Track conversation topics
-            }
-        return self.conversations[key]
-    
-    def add_message(self, user_id, channel_id, username, message, is_bot=False):
-        conv = self.get_conversation(user_id, channel_id)
-        conv['history'].append(f"{'Bot' if is_bot else username}: {message}")
-        conv['last_activity'] = datetime.now()
-        conv['user_name'] = username
-        conv['message_count'] += 1
-        
-        # Add to channel context for awareness of ongoing discussions
-        self.channel_contexts[channel_id].append(f"{username}: {message[:100]}")
-        
-        # Extract topics (simple keyword extraction)
-        words = message.lower().split()
-        topics = [word for word in words if len(word) > 4 and word.isalpha()]
-        conv['topics'].update(topics[:3])  # Keep top 3 topics
-    
-    def cleanup_expired(self):
-        expired = []
-        for key, conv in self.conversations.items():
-            if datetime.now() - conv['last_activity'] > timedelta(seconds=CONVERSATION_TIMEOUT):
-                expired.append(key)
-        
-        for key in expired:
-            del self.conversations[key]
-        
-        return len(expired)
+# Shared HTTP client (created in on_ready, closed on shutdown)
+http_pool = HTTPClientPool()
+
+# Compiled trigger/engagement matchers (per-guild overrides from GUILD_MATCHER_CONFIG)
+message_matchers = MatcherRegistry()
+
+# Cache of model replies for repeated low-value prompts ("hey bot", "hi ai", ...)
+response_cache = ResponseCache()
+
+async def save_response_cache():
+    """Persist the response cache if RESPONSE_CACHE_PATH is set"""
+    if not response_cache.path:
+        return
+    try:
+        await asyncio.to_thread(response_cache.write_snapshot, response_cache.snapshot())
+    except OSError as e:
+        logger.error(f"❌ Failed to save response cache: {e}")
+
+# Server join/leave notifications, queued and sent in batches off the event handlers
+webhook_notifier = WebhookNotifier(http_pool, WEBHOOK_URL, timeout=WEBHOOK_TIMEOUT)
+
+# Optional on-disk conversation state so redeploys don't wipe every conversation. Opened in
+# setup_hook: spawned local-model workers re-import this module and must not open the database too
+conversation_store = None
+
+# State visible to every shard process (STATE_BACKEND=host:port when launched with SHARD_PROCESSES)
+state_backend = create_state_backend()
+
+GUILD_COUNT_KEY = f"guilds:{SHARD_IDS or 'all'}"
+GUILD_COUNT_REFRESH = 600  # Seconds between re-publishing this process's guild count
+GUILD_COUNT_TTL = 3 * GUILD_COUNT_REFRESH  # A process that stops refreshing drops out of the total
+
+async def publish_guild_count():
+    await state_backend.set(GUILD_COUNT_KEY, len(bot.guilds), ttl=GUILD_COUNT_TTL)
+
+async def total_guild_count():
+    """Guilds across all shard processes; falls back to this process's guilds if state is unreachable"""
+    try:
+        await publish_guild_count()
+        return sum((await state_backend.items('guilds:')).values())
+    except (OSError, asyncio.TimeoutError, RuntimeError) as e:
+        logger.warning(f"⚠️ Shared state unavailable: {e}")
+        return len(bot.guilds)
+
+# Older exchanges per conversation, recalled into the prompt when the new message is about them
+long_term_memory = LongTermMemory()
+
+# Message rate, recent speakers and last bot reply per channel, for the random-reply decision
+channel_activity = ActivityTracker()
+
+# Inference budgets per reply class, checked global -> guild -> channel -> user; global is shared across processes
+rate_limiter = RateLimiter.from_env(global_share=SHARD_SHARE, state=state_backend)
 
 # Global conversation manager
-convo_manager = SmartConversationManager()
+convo_manager = SmartConversationManager(
+    history_size=MAX_CONVERSATION_HISTORY,
+    timeout=CONVERSATION_TIMEOUT,
+    memory_budget=CONVERSATION_MEMORY_BUDGET,
+    store=None,  # Set in setup_hook once the conversation store is open
+)
+
+# Pipeline instrumentation, served on /metrics
+metrics_server = MetricsServer()
+STAGE_SECONDS = REGISTRY.histogram('bot_stage_seconds', 'Latency of each message pipeline stage', ('stage',))
+MESSAGES = REGISTRY.counter('bot_messages_total', 'Messages seen, by how the bot decided to handle them',
+                            ('decision',))
+REPLY_OUTCOMES = REGISTRY.counter('bot_reply_outcomes_total', 'Where each reply came from', ('outcome',))
+REGISTRY.collect_stats('bot_conversations', convo_manager.memory_report)
+REGISTRY.collect_stats('bot_response_cache', response_cache.stats)
+REGISTRY.collect_stats('bot_rate_limiter', rate_limiter.stats)
+REGISTRY.collect_stats('bot_channel_activity', channel_activity.stats)
+REGISTRY.collect_stats('bot_long_term_memory', long_term_memory.stats)
+REGISTRY.collect_stats('bot_http', http_pool.stats)
+REGISTRY.collect_stats('bot_state', state_backend.stats)
+REGISTRY.collect_stats('bot_webhooks', webhook_notifier.stats)
+REGISTRY.collect_stats('bot_rest', rest_scheduler.stats)
+REGISTRY.collect_stats('bot_active_responses', lambda: {'count': len(convo_manager.active_responses)})
+
+# Scheduling-delay probe; logs the blocking stack whenever the loop stalls
+loop_monitor = LoopMonitor(histogram=REGISTRY.histogram(
+    'bot_event_loop_lag_seconds', 'How late the event loop ran a timer'))
+REGISTRY.collect_stats('bot_event_loop', loop_monitor.stats)
+
+# On-demand profiler for operators: `!profile [seconds]` in a DM from BOT_OWNER_ID, or
+# GET /debug/profile?seconds=N with `Authorization: Bearer $ADMIN_TOKEN` (only served when set)
+BOT_OWNER_ID = int(os.getenv('BOT_OWNER_ID', '0'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+profiler = SamplingProfiler()
+REGISTRY.collect_stats('bot_profiler', profiler.stats)
+
+async def debug_profile(request):
+    """Profile the event loop for ?seconds=N and return the collapsed stacks as text"""
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}'):
+        return web.Response(status=401, text='unauthorized')
+    try:
+        seconds = float(request.query.get('seconds', '10'))
+    except ValueError:
+        return web.Response(status=400, text='seconds must be a number')
+    try:
+        result = await profiler.profile(seconds)
+    except RuntimeError as e:
+        return web.Response(status=409, text=str(e))
+    paths = await asyncio.to_thread(result.write)
+    logger.info(f"🔬 Profile written to {', '.join(paths)}")
+    return web.Response(text=result.collapsed(), headers={'X-Profile-Files': ', '.join(paths)})
+
+if ADMIN_TOKEN:
+    metrics_server.app.router.add_get('/debug/profile', debug_profile)
+
+# Startup progress, for /ready and the metrics endpoint
+startup = {'started': time.monotonic(), 'seconds_to_ready': None, 'ready_events': 0}
+
+def startup_stats():
+    return {
+        'ready': bot.is_ready() and not bot.is_closed(),
+        'seconds_to_ready': startup['seconds_to_ready'],
+        'ready_events': startup['ready_events'],
+        'guilds': len(bot.guilds),
+    }
+
+async def readiness(request):
+    """200 once the gateway is ready and inference workers are up, 503 until then"""
+    stats = startup_stats()
+    ready = stats['ready'] and inference_dispatcher.running
+    return web.json_response(dict(stats, ready=ready), status=200 if ready else 503)
+
+metrics_server.app.router.add_get('/ready', readiness)
+REGISTRY.collect_stats('bot_startup', startup_stats)
 
 # Fun personality traits and responses
 PERSONALITY_RESPONSES = {
@@ -95,8 +285,22 @@ PERSONALITY_RESPONSES = {
     'humor': ['😄', 'Haha, good one!', 'You\'re funny!', 'That made me chuckle!', 'LOL!'],
 }
 
+def canned_response():
+    """Cheap reply for when a message is over its inference budget"""
+    return random.choice(PERSONALITY_RESPONSES[random.choice(list(PERSONALITY_RESPONSES.keys()))])
+
 EMOJI_REACTIONS = ['🤖', '💭', '✨', '🎯', '💡', '🔥', '👀', '❤️', '😊', '🤔', '💯', '🚀']
 
+async def fetch_guild_members(guild):
+    """The guild's full member list, requested over the gateway (without caching it) unless already cached"""
+    if guild.chunked:
+        return guild.members
+    try:
+        return await asyncio.wait_for(guild.chunk(cache=False), timeout=MEMBER_FETCH_TIMEOUT)
+    except (asyncio.TimeoutError, discord.ClientException) as e:
+        logger.warning(f"⚠️ Could not fetch members of {guild.name}: {e}")
+        return None
+
 async def send_server_join_webhook(guild):
     """Send server join notification to webhook"""
     if not WEBHOOK_URL:
@@ -105,8 +309,15 @@ async def send_server_join_webhook(guild):
     try:
         # Get server statistics
         total_members = guild.member_count
-        bots = sum(1 for member in guild.members if member.bot)
-        humans = total_members - bots
+        members = await fetch_guild_members(guild)
+        if members is not None:
+            # Chunked so a 100k-member guild doesn't hold up replies everywhere else
+            bots = await count_cooperatively(members, lambda member: member.bot)
+            member_summary = f"**{total_members}** total\n👤 {total_members - bots} humans\n🤖 {bots} bots"
+            owner = guild.owner or discord.utils.get(members, id=guild.owner_id)
+        else:
+            member_summary = f"**{total_members}** total"
+            owner = guild.owner
         
         # Get server features
         features = guild.features if guild.features else ["None"]
@@ -145,12 +356,12 @@ async def send_server_join_webhook(guild):
                 },
                 {
                     "name": "👥 Member Count",
-                    "value": f"**{total_members}** total\n👤 {humans} humans\n🤖 {bots} bots",
+                    "value": member_summary,
                     "inline": True
                 },
                 {
                     "name": "👑 Server Owner",
-                    "value": f"{guild.owner.mention if guild.owner else 'Unknown'}\n(`{guild.owner.name}#{guild.owner.discriminator}` - {guild.owner.id})",
+                    "value": f"{owner.mention}\n(`{owner.name}#{owner.discriminator}` - {owner.id})" if owner else f"Unknown\n({guild.owner_id})",
                     "inline": True
                 },
                 {
@@ -180,7 +391,7 @@ async def send_server_join_webhook(guild):
                 }
             ],
             "footer": {
-                "text": f"Bot now in {len(bot.guilds)} servers • {datetime.now().strftime('%m/%d/%Y %I:%M %p')}",
+                "text": f"Bot now in {await total_guild_count()} servers • {datetime.now().strftime('%m/%d/%Y %I:%M %p')}",
                 "icon_url": str(bot.user.avatar.url) if bot.user.avatar else None
             }
         }
@@ -205,35 +416,129 @@ async def send_server_join_webhook(guild):
                 "inline": True
             })
         
-        # Prepare webhook payload
-        webhook_data = {
-            "embeds": [embed_data],
-            "username": "AI Bot Logger",
-            "avatar_url": str(bot.user.avatar.url) if bot.user.avatar else None
-        }
-        
-        # Send webhook
-        async with aiohttp.ClientSession() as session:
-            async with session.post(WEBHOOK_URL, json=webhook_data) as response:
-                if response.status == 204:
-                    logger.info(f"✅ Successfully sent join webhook for {guild.name}")
-                else:
-                    logger.warning(f"⚠️ Webhook failed with status {response.status}")
+        # Queued; the notifier batches it with other events and posts in the background
+        webhook_notifier.notify(embed_data)
                     
     except Exception as e:
-        logger.error(f"❌ Error sending server join webhook: {e}")
+        logger.error(f"❌ Error building server join webhook: {e}")
+
+# Model backend behind generate_ai_response, with retries and a circuit breaker
+inference_backend = ResilientBackend(create_backend(
+    INFERENCE_BACKEND, http_pool, HUGGINGFACE_API_URL, HUGGINGFACE_TOKEN,
+    timeout=INFERENCE_TIMEOUT, batching=INFERENCE_BATCHING
+))
 
-async def generate_ai_response(prompt, context=None, personality_score=0.8, user_name="User"):
-    """Enhanced AI response with personality and context awareness"""
+# Each reply class has a deadline; the router picks the large model, the small one or a template line
+model_router = ModelRouter.from_env()
+
+def inference_handler(backend, tier):
+    """Dispatcher handler: send one prompt, or a coalesced batch, to backend; feeds tier's latency estimate"""
+    async def run_inference_batch(jobs):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for job in jobs:
+            STAGE_SECONDS.observe(started - job.enqueued_at, 'queue_wait')
+        # The call may run until the last caller in the batch stops waiting, and no longer
+        deadlines = [job.deadline for job in jobs]
+        budget = max(deadlines) - started if None not in deadlines else None
+        tokens = max(job.parameters['max_new_tokens'] for job in jobs)
+        try:
+            with STAGE_SECONDS.time('inference'):
+                results = await asyncio.wait_for(_run_inference(backend, jobs, budget), budget)
+        except asyncio.TimeoutError:
+            # Cut off at the deadline: still evidence that the tier is at least this slow
+            model_router.tiers[tier].observe(tokens, loop.time() - started)
+            raise
+        model_router.tiers[tier].observe(tokens, loop.time() - started)
+        return results
+    return run_inference_batch
+
+async def _run_inference(backend, jobs, budget=None):
+    if len(jobs) == 1 and jobs[0].stream is not None:
+        job = jobs[0]
+        chunks = []
+        # Close the stream as soon as we stop reading, not whenever it is garbage collected
+        async with contextlib.aclosing(backend.stream(job.prompt, job.parameters, budget)) as stream:
+            async for chunk in stream:
+                if job.future.done():
+                    break  # Caller timed out; stop editing its message
+                chunks.append(chunk)
+                await job.stream(chunk)
+        return [job.prompt + ''.join(chunks)]
+    
+    parameters = jobs[0].parameters
+    if len(jobs) > 1:
+        # Jobs in a batch share sampling settings; give everyone the longest requested reply
+        parameters = dict(parameters)
+        parameters['max_new_tokens'] = max(job.parameters['max_new_tokens'] for job in jobs)
+    return await backend.generate([job.prompt for job in jobs], parameters, budget)
+
+inference_dispatcher = InferenceDispatcher(
+    convo_manager.response_queue,
+    inference_handler(inference_backend, TIER_LARGE),
+    concurrency=MAX_CONCURRENT_RESPONSES,
+)
+model_router.add_tier(ModelTier(TIER_LARGE, inference_dispatcher, inference_backend))
+
+# The small model has its own workers, so interjections never hold up a mention's worker
+small_backend = None
+small_dispatcher = None
+if SMALL_MODEL_API_URL and INFERENCE_BACKEND != 'local':  # The local backend is already a small model
+    small_backend = ResilientBackend(create_backend(
+        INFERENCE_BACKEND, http_pool, SMALL_MODEL_API_URL, HUGGINGFACE_TOKEN,
+        timeout=INFERENCE_TIMEOUT, batching=INFERENCE_BATCHING
+    ))
+    small_dispatcher = InferenceDispatcher(FairResponseQueue(), inference_handler(small_backend, TIER_SMALL),
+                                           concurrency=SMALL_MODEL_CONCURRENCY)
+    model_router.add_tier(ModelTier(TIER_SMALL, small_dispatcher, small_backend))
+
+# Token-budgeted prompt assembly
+prompt_builder = PromptBuilder()
+
+REGISTRY.collect_stats('bot_dispatcher', inference_dispatcher.stats)
+REGISTRY.collect_stats('bot_inference', inference_backend.stats)
+REGISTRY.collect_stats('bot_router', model_router.stats)
+if small_dispatcher is not None:
+    REGISTRY.collect_stats('bot_small_dispatcher', small_dispatcher.stats)
+    REGISTRY.collect_stats('bot_small_inference', small_backend.stats)
+REGISTRY.collect_stats('bot_prompts', prompt_builder.stats)
+
+def clean_ai_response(text):
+    """Strip the model continuation down to what the bot should say"""
+    ai_response = text.split('AI:')[-1].strip()
+    ai_response = ai_response.split('\nHuman')[0].strip()
+    ai_response = ai_response.replace('Human:', '').strip()
+    return ai_response[:600]
+
+async def generate_ai_response(prompt, context=None, personality_score=0.8, user_name="User",
+                               guild_id=None, reply_class=REPLY_MENTION, on_token=None, channel_summary='',
+                               memories=()):
+    """Enhanced AI response with personality and context awareness
+    
+    History is trimmed by tokens to fit the model window; channel_summary is a
+    one-line digest of what other people in the channel are talking about, and
+    memories are older exchanges recalled from long-term memory.
+    The model router picks the model and reply length that fit the reply class's deadline.
+    Returns (reply, from_model): from_model is True only for text the model just generated, not for
+    cached, canned or error lines. reply is None when a random-chance reply is shed because the queue is full.
+    With on_token, backends that stream call it with each new piece of text.
+    """
+    streamed = []
+    
+    async def forward_token(chunk):
+        streamed.append(chunk)
+        await on_token(chunk)
+    
+    def partial_response():
+        # Whatever already reached the user beats a canned error
+        partial = clean_ai_response(''.join(streamed)) if streamed else ''
+        return partial if len(partial) > 3 else None
+    
+    overloaded = "My circuits are a bit overloaded right now! Try again in a moment? ⚡"
+    cache_key = None
+    route = None
+    
     try:
-        headers = {"Authorization": f"Bearer {HUGGINGFACE_TOKEN}"}
-        
-        # Build smarter context with personality
-        context_prompt = ""
-        if context and len(context) > 0:
-            recent_context = list(context)[-4:]  # Last 4 messages
-            context_prompt = "\n".join(recent_context) + "\n"
-        
         # Add personality based on score
         personality_prefix = ""
         if personality_score > 0.9:
@@ -241,98 +546,199 @@ async def generate_ai_response(prompt, context=None, personality_score=0.8, user
         elif personality_score > 0.8:
             personality_prefix = "You are a helpful and engaging AI. "
         
-        full_prompt = f"{personality_prefix}{context_prompt}Human ({user_name}): {prompt}\nAI:"
-        
-        payload = {
-            "inputs": full_prompt,
-            "parameters": {
-                "max_new_tokens": random.randint(80, 180),  # Vary response length
-                "temperature": min(0.9, personality_score + 0.1),
-                "do_sample": True,
-                "top_p": 0.9,
-                "repetition_penalty": 1.1,
-                "pad_token_id": 50256
-            }
+        route = model_router.route(reply_class)
+        started = time.monotonic()
+        parameters = {
+            # Varied per reply, and cut down to what the chosen model can generate before the deadline
+            "max_new_tokens": route.max_new_tokens or REPLY_TOKENS[1],
+            # Rounded so prompts from different users can share a batch
+            "temperature": round(min(0.9, personality_score + 0.1), 1),
+            "do_sample": True,
+            "top_p": 0.9,
+            "repetition_penalty": 1.1,
+            "pad_token_id": 50256
         }
+        batch_key = (parameters["temperature"], parameters["top_p"], parameters["repetition_penalty"])
         
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            async with session.post(HUGGINGFACE_API_URL, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    if isinstance(result, list) and len(result) > 0:
-                        generated_text = result[0].get('generated_text', '')
-                        
-                        if 'AI:' in generated_text:
-                            ai_response = generated_text.split('AI:')[-1].strip()
-                            # Clean up response
-                            ai_response = ai_response.split('\nHuman')[0].strip()
-                            ai_response = ai_response.replace('Human:', '').strip()
-                            
-                            if ai_response and len(ai_response) > 3:
-                                return ai_response[:600]
-                    
-                    # Fallback responses with personality
-                    fallbacks = [
-                        "I'm still processing that... give me a moment! 🤔",
-                        "That's an interesting point! Let me think...",
-                        "Hmm, my AI brain is spinning on that one! 🧠",
-                        "You've got me thinking deeply about that!",
-                    ]
-                    return random.choice(fallbacks)
-                else:
-                    return "My circuits are a bit overloaded right now! Try again in a moment? ⚡"
-                    
+        # Newest history that fits the model window alongside the reply
+        full_prompt, _ = prompt_builder.build(prompt, context, user_name, parameters["max_new_tokens"],
+                                              prefix=personality_prefix, channel_summary=channel_summary,
+                                              memories=memories)
+        
+        # max_new_tokens is randomized per call, so it is left out of the cache key
+        cache_key = response_cache.make_key(full_prompt, batch_key)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            REPLY_OUTCOMES.inc('cache_hit')
+            return cached_response, False
+        
+        # No model is up, or none can answer in time: anything cached (even stale), else a template line
+        if route.model is None:
+            if not any(tier.backend.available() for tier in model_router.tiers.values()):
+                REPLY_OUTCOMES.inc('circuit_open')
+                if reply_class == REPLY_RANDOM:
+                    return None, False
+                return response_cache.peek(cache_key) or overloaded, False
+            REPLY_OUTCOMES.inc('template')
+            return response_cache.peek(cache_key) or canned_response(), False
+        
+        backend = route.model.backend
+        stream = forward_token if on_token is not None and backend.supports_streaming else None
+        # Wait only as long as the reply class allows; the worker gives up at the same moment
+        remaining = min(route.deadline - (time.monotonic() - started), QUEUE_WAIT_TIMEOUT + RETRY_BUDGET)
+        generated_text = await asyncio.wait_for(
+            route.model.dispatcher.submit(full_prompt, parameters, guild_id, reply_class, batch_key, stream,
+                                          deadline=asyncio.get_running_loop().time() + remaining),
+            timeout=remaining
+        )
+        model_router.record(reply_class, route, time.monotonic() - started)
+        
+        if 'AI:' in generated_text:
+            # Clean up response
+            ai_response = clean_ai_response(generated_text)
+            
+            if ai_response and len(ai_response) > 3:
+                response_cache.put(cache_key, ai_response)
+                REPLY_OUTCOMES.inc('model')
+                return ai_response, True
+        
+        # Fallback responses with personality
+        fallbacks = [
+            "I'm still processing that... give me a moment! 🤔",
+            "That's an interesting point! Let me think...",
+            "Hmm, my AI brain is spinning on that one! 🧠",
+            "You've got me thinking deeply about that!",
+        ]
+        REPLY_OUTCOMES.inc('fallback')
+        return random.choice(fallbacks), False
+    
+    except LoadShed:
+        REPLY_OUTCOMES.inc('shed')
+        if reply_class == REPLY_RANDOM:
+            return None, False
+        return overloaded, False
+    except InferenceError:
+        REPLY_OUTCOMES.inc('inference_error')
+        stale = response_cache.peek(cache_key) if cache_key else None
+        return partial_response() or stale or overloaded, False
     except asyncio.TimeoutError:
-        return "Whoa, that was a complex thought! My response timed out. 🕐"
+        REPLY_OUTCOMES.inc('timeout')
+        if route is not None and route.model is not None:
+            model_router.record(reply_class, route, time.monotonic() - started)
+        stale = response_cache.peek(cache_key) if cache_key else None
+        return partial_response() or stale or "Whoa, that was a complex thought! My response timed out. 🕐", False
     except Exception as e:
+        REPLY_OUTCOMES.inc('error')
         logger.error(f"AI generation error: {e}")
-        return random.choice([
+        return (partial_response() or random.choice([
             "Oops! My AI brain hiccupped! 🤖💫",
             "Something went wonky in my neural networks! Try again?",
             "Error 404: Smart response not found! 😅"
-        ])
+        ])), False
 
-def should_respond_randomly(message, channel_id):
+def should_respond_randomly(content, channel_id, matcher):
     """Enhanced random response logic with channel awareness"""
-    if message.author.bot:
-        return False
-    
-    # Check recent channel activity
-    recent_messages = list(convo_manager.channel_contexts[channel_id])[-5:]
-    bot_recently_active = any("Bot:" in msg for msg in recent_messages)
+    # Precomputed per channel as messages arrive; nothing is rebuilt here
+    activity = channel_activity.features(channel_id)
     
     # Reduce chance if bot was recently active
     base_chance = RANDOM_RESPONSE_CHANCE
-    if bot_recently_active:
+    if activity.seconds_since_bot_reply < RANDOM_REPLY_COOLDOWN:
         base_chance *= 0.3
     
+    # Length bonus for substantial messages
+    length_bonus = min(len(content) / 200, 0.08)
+    
+    # Talk less in fast channels: an interjection scrolls away unread and the model call is wasted
+    load_multiplier = 1.2 / (1 + activity.messages_per_minute / BUSY_CHANNEL_RATE)
+    # A few people chatting is a conversation to join; a crowd isn't
+    if activity.participants > CROWD_SIZE:
+        load_multiplier *= CROWD_SIZE / activity.participants
+    
     # Increase chance for engaging content
-    content = message.content.lower()
-    engagement_keywords = [
-        'what', 'how', 'why', 'think', 'opinion', 'believe', 'feel', 'should',
-        'anyone', 'everybody', 'someone', 'thoughts', '?', 'help', 'advice'
-    ]
+    def chance(engagement):
+        total_chance = (base_chance + engagement * 0.03 + length_bonus) * load_multiplier
+        return min(total_chance, 0.4)  # Cap at 40%
     
-    keyword_matches = sum(1 for word in engagement_keywords if word in content)
-    engagement_bonus = keyword_matches * 0.03
+    # Roll first and only count keywords when the count could change the outcome
+    roll = random.random()
+    if roll < chance(0):
+        return True
+    if roll >= chance(matcher.max_engagement):
+        return False
+    return roll < chance(matcher.engagement_count(content))
+
+def decide_reply(author_id, channel_id, guild_id, content, bot_mentioned, dm_channel):
+    """Reply class for a message from a human, or None to ignore it
     
-    # Length bonus for substantial messages
-    length_bonus = min(len(message.content) / 200, 0.08)
+    Takes only fields the raw gateway payload has, so the gateway filter can decide before the
+    Message is built. It also feeds the channel activity model, so call it once per message.
+    """
+    channel_activity.record_message(channel_id, author_id)
     
-    # Time-based variation (more active during certain hours)
-    hour = datetime.now().hour
-    time_multiplier = 1.2 if 12 <= hour <= 22 else 0.8  # More active during day/evening
+    # Cheapest checks first; the content is only scanned when nothing before it decided
+    matcher = message_matchers.for_guild(guild_id)
     
-    total_chance = (base_chance + engagement_bonus + length_bonus) * time_multiplier
+    # Classify the reply so the dispatcher knows what to drop first under load
+    if dm_channel:
+        return REPLY_DM
+    if bot_mentioned:
+        return REPLY_MENTION
+    if matcher.has_trigger(content):
+        return REPLY_TRIGGER
+    if should_respond_randomly(content, channel_id, matcher):
+        return REPLY_RANDOM
+    return None
+
+# Reply classes decided from raw payloads, picked up by on_message once the Message is built
+raw_decisions = OrderedDict()  # message_id -> reply class
+RAW_DECISIONS_MAX = 1000
+
+def prefilter_message(data):
+    """Gateway fast path: whether a raw MESSAGE_CREATE is worth building into a Message"""
+    started = time.perf_counter()
+    author = data['author']
+    if author.get('bot'):
+        return False
     
-    return random.random() < min(total_chance, 0.4)  # Cap at 40%
+    bot_id = bot._connection.self_id
+    guild_id = int(data['guild_id']) if 'guild_id' in data else None
+    bot_mentioned = any(int(user['id']) == bot_id for user in data.get('mentions', ()))
+    reply_class = decide_reply(int(author['id']), int(data['channel_id']), guild_id, data.get('content', ''),
+                               bot_mentioned, dm_channel=guild_id is None)
+    STAGE_SECONDS.observe(time.perf_counter() - started, 'decide')
+    if reply_class is None:
+        MESSAGES.inc('ignored')
+        return False
+    
+    raw_decisions[int(data['id'])] = reply_class
+    if len(raw_decisions) > RAW_DECISIONS_MAX:
+        raw_decisions.popitem(last=False)
+    return True
+
+gateway_filter = GatewayFilter(prefilter_message)
+REGISTRY.collect_stats('bot_gateway', gateway_filter.stats)
 
 @bot.event
 async def on_ready():
     """Bot startup"""
     print(f'🤖 {bot.user.name} is now online and ready to chat!')
     print(f'📡 Connected to {len(bot.guilds)} servers')
-    print(f'🧠 AI Model: Microsoft DialoGPT-large')
+    if SHARD_COUNT:
+        print(f'🧩 Running shards {sorted(bot.shards)} of {bot.shard_count}')
+    print(f'🧠 AI Model: {inference_backend.describe()}')
+    startup['ready_events'] += 1
+    if startup['seconds_to_ready'] is None:
+        startup['seconds_to_ready'] = time.monotonic() - startup['started']
+        logger.info(f"⏱️ Ready {startup['seconds_to_ready']:.1f}s after start")
+    
+    # Open the shared HTTP pool and inference workers (no-ops if already running)
+    await http_pool.start()
+    inference_dispatcher.start()
+    if small_dispatcher is not None:
+        small_dispatcher.start()
+    webhook_notifier.avatar_url = str(bot.user.avatar.url) if bot.user.avatar else None
+    webhook_notifier.start()
     
     # Set dynamic status
     status_options = [
@@ -344,18 +750,69 @@ async def on_ready():
         type=discord.ActivityType.watching, 
         name=random.choice(status_options)
     )
-    await bot.change_presence(activity=activity, status=discord.Status.online)
+    await rest_scheduler.run(REST_PRESENCE, ('presence', 0), bot.change_presence,
+                             activity=activity, status=discord.Status.online)
     
     # Start background tasks
-    cleanup_conversations.start()
-    rotate_status.start()
+    start_background_tasks()
 
-@tasks.loop(minutes=5)
+def start_background_tasks():
+    """Start each loop once; on_ready fires again whenever the gateway has to re-identify"""
+    loops = [cleanup_conversations, persist_response_cache, rotate_status, refresh_guild_count]
+    if conversation_store is not None:
+        loops += [flush_conversation_store, compact_conversation_store]
+    for loop in loops:
+        if not loop.is_running():
+            loop.start()
+
+@tasks.loop(seconds=CLEANUP_INTERVAL)
 async def cleanup_conversations():
     """Clean up expired conversations"""
-    cleaned = convo_manager.cleanup_expired()
+    cleaned = 0
+    while True:
+        batch = convo_manager.cleanup_expired(max_items=CLEANUP_BATCH)
+        cleaned += batch
+        if batch < CLEANUP_BATCH:
+            break
+        await asyncio.sleep(0)  # Let message handlers run between batches
+    
     if cleaned > 0:
         logger.info(f"🧹 Cleaned up {cleaned} expired conversations")
+        report = convo_manager.memory_report()
+        logger.info(f"🧠 {report['conversations']} conversations, ~{report['bytes_per_conversation']:.0f} bytes each")
+
+@tasks.loop(minutes=5)
+async def persist_response_cache():
+    """Expire and save cached responses"""
+    response_cache.purge_expired()
+    await save_response_cache()
+
+@tasks.loop(seconds=STORAGE_FLUSH_INTERVAL)
+async def flush_conversation_store():
+    """Write-behind: persist conversations changed since the last flush"""
+    try:
+        await conversation_store.flush()
+    except sqlite3.Error as e:
+        logger.error(f"❌ Failed to flush conversation store: {e}")
+
+@tasks.loop(hours=1)
+async def compact_conversation_store():
+    """Drop stored conversations that have expired anyway"""
+    try:
+        removed = await conversation_store.compact(CONVERSATION_TIMEOUT)
+    except sqlite3.Error as e:
+        logger.error(f"❌ Failed to compact conversation store: {e}")
+        return
+    if removed:
+        logger.info(f"🗜️ Compacted {removed} expired conversations from disk")
+
+@tasks.loop(seconds=GUILD_COUNT_REFRESH)
+async def refresh_guild_count():
+    """Keep this process's entry in the cross-shard guild total from expiring"""
+    try:
+        await publish_guild_count()
+    except (OSError, asyncio.TimeoutError, RuntimeError) as e:
+        logger.warning(f"⚠️ Shared state unavailable: {e}")
 
 @tasks.loop(minutes=30)
 async def rotate_status():
@@ -370,13 +827,35 @@ async def rotate_status():
         type=discord.ActivityType.watching,
         name=random.choice(status_options)
     )
-    await bot.change_presence(activity=activity)
+    await rest_scheduler.run(REST_PRESENCE, ('presence', 0), bot.change_presence, activity=activity)
+
+async def handle_profile_command(message):
+    """`!profile [seconds]` from the owner: profile the loop, reply with a summary and the files"""
+    parts = message.content.split()
+    try:
+        seconds = float(parts[1]) if len(parts) > 1 else 10.0
+    except ValueError:
+        await message.channel.send(f"Usage: `!profile [seconds]` (up to {PROFILE_MAX_SECONDS})")
+        return
+    await message.channel.send(f"🔬 Profiling the event loop for {min(seconds, PROFILE_MAX_SECONDS):g}s...")
+    try:
+        result = await profiler.profile(seconds)
+    except RuntimeError as e:
+        await message.channel.send(str(e))
+        return
+    paths = await asyncio.to_thread(result.write)
+    logger.info(f"🔬 Profile written to {', '.join(paths)}")
+    summary = result.summary()
+    if len(summary) > 1900:
+        summary = summary[:1900] + '\n...'
+    await message.channel.send(f"```\n{summary}\n```", files=[discord.File(path) for path in paths])
 
 @bot.event
 async def on_message(message):
     """Enhanced message handling with multi-user support"""
     if message.author == bot.user or message.author.bot:
         return
+    started = time.perf_counter()
     
     user_id = message.author.id
     channel_id = message.channel.id
@@ -385,26 +864,39 @@ async def on_message(message):
     # Check if we should respond
     bot_mentioned = bot.user in message.mentions
     dm_channel = isinstance(message.channel, discord.DMChannel)
-    should_random_respond = should_respond_randomly(message, channel_id)
+    guild_id = message.guild.id if message.guild else None
     
-    # Keywords that trigger responses
-    trigger_phrases = ['ai', 'bot', 'artificial', 'intelligence', 'hey bot', 'robot']
-    contains_trigger = any(phrase in message.content.lower() for phrase in trigger_phrases)
+    if dm_channel and BOT_OWNER_ID and user_id == BOT_OWNER_ID and message.content.startswith('!profile'):
+        raw_decisions.pop(message.id, None)
+        await handle_profile_command(message)
+        return
     
-    should_respond = bot_mentioned or dm_channel or should_random_respond or contains_trigger
+    # Already decided from the raw payload if the gateway filter let this message through
+    reply_class = raw_decisions.pop(message.id, None)
+    if reply_class is None:
+        reply_class = decide_reply(user_id, channel_id, guild_id, message.content, bot_mentioned, dm_channel)
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'decide')
+    MESSAGES.inc(reply_class or 'ignored')
     
-    if should_respond:
+    if reply_class is not None:
         # Prevent spam by limiting concurrent responses per user
-        response_key = f"{user_id}_{channel_id}"
+        response_key = (user_id, channel_id)
         if response_key in convo_manager.active_responses:
             return
         
-        # Add to active responses
+        # Add to active responses (before the budget check, which may wait on shared state)
         convo_manager.active_responses.add(response_key)
         
+        # Over budget: random interjections are skipped, everything else gets a canned line
+        over_budget = not await rate_limiter.acquire(reply_class, guild_id, channel_id, user_id)
+        if over_budget and reply_class == REPLY_RANDOM:
+            convo_manager.active_responses.discard(response_key)
+            MESSAGES.inc('over_budget')
+            return
+        
         try:
             # Show typing indicator
-            async with message.channel.typing():
+            async with rest_scheduler.typing(message.channel):
                 # Get conversation context
                 conv = convo_manager.get_conversation(user_id, channel_id)
                 
@@ -416,43 +908,90 @@ async def on_message(message):
                 if bot_mentioned:
                     clean_content = clean_content.replace(f'<@{bot.user.id}>', '').strip()
                 
-                # Generate AI response with context
-                response = await generate_ai_response(
-                    clean_content,
-                    conv['history'],
-                    conv['personality_score'],
-                    username
-                )
-                
-                # Add bot response to context
-                convo_manager.add_message(user_id, channel_id, username, response, is_bot=True)
-                
                 # Fun random features
                 features = []
                 
-                # Random emoji reaction (20% chance)
-                if random.random() < 0.2:
-                    emoji = random.choice(EMOJI_REACTIONS)
-                    try:
-                        await message.add_reaction(emoji)
-                        features.append("reaction")
-                    except:
-                        pass
-                
+                # Decide presentation up front so a streamed reply can go out mid-generation
                 # Occasional personality responses (15% chance)
-                if random.random() < 0.15:
+                personality_response = ""
+                if random.random() < 0.15 and not over_budget:
                     personality_type = random.choice(list(PERSONALITY_RESPONSES.keys()))
                     personality_response = random.choice(PERSONALITY_RESPONSES[personality_type])
-                    response = f"{personality_response} {response}"
                     features.append("personality")
                 
                 # Reply vs send (vary behavior)
                 mention_author = bot_mentioned and not dm_channel
+                use_reply = random.random() < 0.7  # 70% chance to reply
+                
+                async def send_response(text):
+                    with STAGE_SECONDS.time('send'):
+                        if use_reply:
+                            return await rest_scheduler.run(REST_REPLY, ('send', channel_id), message.reply,
+                                                            text, mention_author=mention_author)
+                        return await rest_scheduler.run(REST_REPLY, ('send', channel_id), message.channel.send, text)
+                
+                async def edit_response(sent, text):
+                    with STAGE_SECONDS.time('send'):
+                        return await rest_scheduler.run(REST_REPLY, ('edit', channel_id), sent.edit, content=text)
                 
-                if random.random() < 0.7:  # 70% chance to reply
-                    await message.reply(response, mention_author=mention_author)
+                streamer = None
+                if STREAMING_REPLIES and inference_backend.supports_streaming and not over_budget:
+                    streamer = StreamingReply(send_response, clean_ai_response, prefix=personality_response,
+                                              edit=edit_response)
+                    features.append("streamed")
+                
+                if over_budget:
+                    response = canned_response()
+                    from_model = False
+                    REPLY_OUTCOMES.inc('canned')
+                    features.append("canned")
                 else:
-                    await message.channel.send(response)
+                    # Older exchanges about the same thing; the ones still in the history are skipped
+                    memories = long_term_memory.recall(response_key, clean_content,
+                                                       skip_recent=len(conv.history) // 2)
+                    # Generate AI response with context
+                    response, from_model = await generate_ai_response(
+                        clean_content,
+                        conv.history,
+                        conv.personality_score,
+                        username,
+                        guild_id=guild_id,
+                        reply_class=reply_class,
+                        on_token=streamer.feed if streamer else None,
+                        channel_summary=convo_manager.channel_summary(channel_id, exclude_speaker=username),
+                        memories=memories
+                    )
+                
+                # Shed under load: skip the interjection entirely
+                if response is None:
+                    return
+                
+                # Add bot response to context
+                convo_manager.add_message(user_id, channel_id, username, response, is_bot=True)
+                # Only real model replies: canned and error lines would come back as "memories"
+                if from_model:
+                    long_term_memory.remember(response_key, f"{clean_content} {response}",
+                                              f"{username}: {clean_content[:200]}\nBot: {response[:200]}")
+                
+                # Random emoji reaction (20% chance)
+                if random.random() < 0.2:
+                    emoji = random.choice(EMOJI_REACTIONS)
+                    try:
+                        # Cosmetic: skipped rather than queued when the channel is busy
+                        if await rest_scheduler.acquire(REST_REACTION, ('reaction', channel_id)):
+                            await message.add_reaction(emoji)
+                            features.append("reaction")
+                    except:
+                        pass
+                
+                if streamer:
+                    await streamer.finish(response)
+                else:
+                    if personality_response:
+                        response = f"{personality_response} {response}"
+                    await send_response(response)
+                channel_activity.record_bot_reply(channel_id)
+                STAGE_SECONDS.observe(time.perf_counter() - started, 'total')
                 
                 # Log interaction
                 logger.info(f"💬 Responded to {username} in {message.guild.name if message.guild else 'DM'} (features: {features})")
@@ -460,7 +999,8 @@ async def on_message(message):
         except Exception as e:
             logger.error(f"Error handling message: {e}")
             try:
-                await message.channel.send("Oops! Something went wrong in my AI brain! 🤖💥")
+                await rest_scheduler.run(REST_REPLY, ('send', channel_id), message.channel.send,
+                                         "Oops! Something went wrong in my AI brain! 🤖💥")
             except:
                 pass
         finally:
@@ -477,7 +1017,8 @@ async def on_reaction_add(reaction, user):
     if random.random() < 0.3:
         reaction_responses = ['👍', '😊', '🤖', '✨', '❤️']
         try:
-            await reaction.message.add_reaction(random.choice(reaction_responses))
+            await rest_scheduler.run(REST_REACTION, ('reaction', reaction.message.channel.id),
+                                     reaction.message.add_reaction, random.choice(reaction_responses))
         except:
             pass
 
@@ -513,7 +1054,8 @@ async def on_guild_join(guild):
             
             # Send welcome message with 5 second delay to avoid seeming too eager
             await asyncio.sleep(5)
-            await welcome_channel.send(random.choice(welcome_messages))
+            await rest_scheduler.run(REST_WELCOME, ('send', welcome_channel.id), welcome_channel.send,
+                                     random.choice(welcome_messages))
             logger.info(f"📨 Sent welcome message to #{welcome_channel.name} in {guild.name}")
             
     except Exception as e:
@@ -540,22 +1082,18 @@ async def on_guild_remove(guild):
                     }
                 ],
                 "footer": {
-                    "text": f"Now in {len(bot.guilds)} servers",
+                    "text": f"Now in {await total_guild_count()} servers",
                     "icon_url": str(bot.user.avatar.url) if bot.user.avatar else None
                 }
             }
             
-            webhook_data = {
-                "embeds": [embed_data],
-                "username": "AI Bot Logger",
-                "avatar_url": str(bot.user.avatar.url) if bot.user.avatar else None
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                await session.post(WEBHOOK_URL, json=webhook_data)
+            webhook_notifier.notify(embed_data)
                 
         except Exception as e:
-            logger.error(f"Error sending leave webhook: {e}")
+            logger.error(f"Error building leave webhook: {e}")
+
+@bot.event
+async def on_member_join(member):
     """Welcome new members with a small chance"""
     if random.random() < 0.1:  # 10% chance to welcome
         try:
@@ -567,15 +1105,11 @@ async def on_guild_remove(guild):
                     f"Hey {member.mention}! Nice to meet you! Feel free to @ me anytime to chat! 👋",
                     f"Welcome to the server, {member.mention}! I'm here if you need an AI friend! ✨"
                 ]
-                await general.send(random.choice(welcome_messages))
+                await rest_scheduler.run(REST_WELCOME, ('send', general.id), general.send,
+                                         random.choice(welcome_messages))
         except:
             pass
 
-@bot.event
-async def on_member_join(member):
-    """Global error handler"""
-    logger.error(f"Discord error in {event}: {args}")
-
 @bot.event
 async def on_error(event, *args, **kwargs):
     """Global error handler"""
@@ -587,7 +1121,7 @@ if __name__ == "__main__":
         print("❌ Error: Please set your DISCORD_TOKEN environment variable!")
         exit(1)
     
-    if not HUGGINGFACE_TOKEN:
+    if INFERENCE_BACKEND == 'remote' and not HUGGINGFACE_TOKEN:
         print("⚠️ Warning: HUGGINGFACE_TOKEN not set. AI responses may be limited!")
     
     if not WEBHOOK_URL:
@@ -596,7 +1130,12 @@ if __name__ == "__main__":
         print("📡 Webhook notifications enabled for server joins!")
     
     try:
-        print("🚀 Starting AI Discord Bot...")
-        bot.run(DISCORD_TOKEN)
+        if SHARD_PROCESSES > 1 and not SHARD_IDS:
+            # Launcher: one worker process per block of shards, sharing a local state server
+            print(f"🚀 Starting AI Discord Bot across {SHARD_PROCESSES} processes...")
+            launch(os.path.abspath(__file__), DISCORD_TOKEN)
+        else:
+            print("🚀 Starting AI Discord Bot...")
+            bot.run(DISCORD_TOKEN)
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
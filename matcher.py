@@ -0,0 +1,112 @@
+"""Precompiled trigger/engagement matcher for the on_message hot path"""
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Words that make the bot answer outright
+DEFAULT_TRIGGER_PHRASES = ['ai', 'bot', 'artificial', 'intelligence', 'hey bot', 'robot']
+
+# Words that make a random interjection more likely
+DEFAULT_ENGAGEMENT_KEYWORDS = [
+    'what', 'how', 'why', 'think', 'opinion', 'believe', 'feel', 'should',
+    'anyone', 'everybody', 'someone', 'thoughts', '?', 'help', 'advice'
+]
+
+# Per-guild overrides: inline JSON or a path to a JSON file, e.g.
+# {"123456789": {"triggers": ["assistant", "bot"], "engagement": ["help", "?"]}}
+GUILD_MATCHER_CONFIG = os.getenv('GUILD_MATCHER_CONFIG')
+
+
+def _keyword_regex(keywords):
+    # Word keywords (optionally plural) need word boundaries; symbols like '?' match anywhere.
+    # The pattern starts with a character class of first letters, which lets the regex engine skip
+    # ahead to candidate positions in C instead of trying every alternative at every position; the
+    # lookbehind then checks the word boundary before the keyword.
+    words = sorted((k for k in keywords if k[0].isalnum() and k[-1].isalnum()), key=len, reverse=True)
+    symbols = sorted((k for k in keywords if not (k[0].isalnum() and k[-1].isalnum())), key=len, reverse=True)
+    parts = []
+    if words:
+        by_first = {}
+        for word in words:
+            by_first.setdefault(word[0], []).append(word[1:])
+        branches = []
+        for first, rests in sorted(by_first.items()):
+            rest = '|'.join(re.escape(r) for r in rests if r)
+            optional = '' in rests
+            if rest:
+                branches.append(f"(?<={re.escape(first)})(?:{rest}){'?' if optional else ''}")
+            else:
+                branches.append(f"(?<={re.escape(first)})")
+        first_chars = ''.join(re.escape(first) for first in sorted(by_first))
+        parts.append(rf"[{first_chars}](?<!\w.)(?:{'|'.join(branches)})s?\b")
+    if symbols:
+        parts.append('|'.join(map(re.escape, symbols)))
+    return re.compile('|'.join(parts) or r'(?!)')
+
+
+class MessageMatcher:
+    """Compiled regexes over the lowercased message: one for triggers, one for engagement keywords
+
+    decide_reply only needs to know whether any trigger is present, so has_trigger() stops at the
+    first match. The engagement count is only needed for the random-reply roll, and only when the
+    roll is close enough for it to matter.
+    """
+
+    def __init__(self, triggers=DEFAULT_TRIGGER_PHRASES, engagement=DEFAULT_ENGAGEMENT_KEYWORDS):
+        self.triggers = tuple(triggers)
+        self.engagement = tuple(engagement)
+        triggers = {' '.join(t.lower().split()) for t in self.triggers if t.strip()}
+        engagement = {' '.join(k.lower().split()) for k in self.engagement if k.strip()}
+        self._trigger_pattern = _keyword_regex(triggers)
+        self._engagement_pattern = _keyword_regex(engagement)
+        # Most distinct matches engagement_count() can return: every keyword, singular and plural
+        self.max_engagement = len(engagement | {k + 's' for k in engagement if k[-1].isalnum()})
+
+    def has_trigger(self, content):
+        return self._trigger_pattern.search(content.lower()) is not None
+
+    def engagement_count(self, content):
+        """Number of distinct engagement keywords in content"""
+        return len(set(self._engagement_pattern.findall(content.lower())))
+
+
+class MatcherRegistry:
+    """Default matcher plus compiled per-guild overrides"""
+
+    def __init__(self, default=None):
+        self.default = default or MessageMatcher()
+        self._guilds = {}  # guild_id -> MessageMatcher
+
+    def configure_guild(self, guild_id, triggers=None, engagement=None):
+        self._guilds[guild_id] = MessageMatcher(
+            triggers if triggers is not None else self.default.triggers,
+            engagement if engagement is not None else self.default.engagement,
+        )
+
+    def reset_guild(self, guild_id):
+        self._guilds.pop(guild_id, None)
+
+    def for_guild(self, guild_id):
+        return self._guilds.get(guild_id, self.default)
+
+    def load_config(self, config=GUILD_MATCHER_CONFIG):
+        """Load per-guild overrides from inline JSON or a JSON file"""
+        if not config:
+            return 0
+        try:
+            if os.path.exists(config):
+                with open(config, encoding='utf-8') as f:
+                    overrides = json.load(f)
+            else:
+                overrides = json.loads(config)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Invalid GUILD_MATCHER_CONFIG: {e}")
+            return 0
+
+        for guild_id, settings in overrides.items():
+            self.configure_guild(int(guild_id), settings.get('triggers'), settings.get('engagement'))
+        logger.info(f"🎯 Loaded trigger overrides for {len(overrides)} guilds")
+        return len(overrides)
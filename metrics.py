@@ -0,0 +1,255 @@
+"""Low-overhead counters, gauges and histograms with a Prometheus text endpoint"""
+import logging
+import math
+import os
+import resource
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv('PORT', os.getenv('METRICS_PORT', '0')))  # 0 disables the HTTP server
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+
+# Seconds; covers a few ms of decide work up to a slow model call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination; inc() is a dict update"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge:
+    """Last value per label combination, or a callback read at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values = {}
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def samples(self):
+        if self.fn is not None:
+            yield self.name, '', self.fn()
+            return
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Histogram:
+    """Fixed buckets per label combination: observe() is one bisect and three additions"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels):
+        """with histogram.time('stage'): ... records the block's duration"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), count
+
+
+class Registry:
+    """Holds metrics plus stats() callbacks that are exported as gauges when scraped"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []  # (prefix, callable returning a dict)
+        self._clashes = set()  # Stats names already warned about for shadowing another family
+
+    def register(self, metric):
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self.register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collect_stats(self, prefix, fn):
+        """Export every numeric value of fn()'s dict as {prefix}_{key}; nested dicts become labels"""
+        self._collectors.append((prefix, fn))
+
+    def _stats_lines(self, families):
+        lines = []
+        for prefix, fn in self._collectors:
+            try:
+                stats = fn()
+            except Exception as e:
+                logger.warning(f"⚠️ Metrics collector {prefix} failed: {e}")
+                continue
+            for key, value in stats.items():
+                name = f"{prefix}_{key}"
+                if isinstance(value, dict):
+                    samples = [(f'{{key="{_escape(sub)}"}}', v) for sub, v in value.items() if _numeric(v)]
+                elif _numeric(value):
+                    samples = [('', value)]
+                else:
+                    continue
+                if samples:
+                    if name in families:
+                        # A second TYPE line for one family makes Prometheus reject the whole scrape
+                        if name not in self._clashes:
+                            self._clashes.add(name)
+                            logger.warning(f"⚠️ Metrics collector {prefix} key {key} clashes with {name}; skipped")
+                        continue
+                    families.add(name)
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.extend(f"{name}{labels} {_format_value(v)}" for labels, v in samples)
+        return lines
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        families = {metric.name for metric in self._metrics}
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        lines.extend(self._stats_lines(families))
+        return '\n'.join(lines) + '\n'
+
+
+def _numeric(value):
+    return isinstance(value, (int, float)) and not (isinstance(value, float) and math.isnan(value))
+
+
+def max_rss_bytes():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def rss_bytes():
+    """Current resident set size (falls back to the peak where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return max_rss_bytes()
+
+
+REGISTRY = Registry()
+REGISTRY.gauge('process_resident_memory_bytes', 'Resident memory size in bytes', fn=rss_bytes)
+REGISTRY.gauge('process_max_resident_memory_bytes', 'Peak resident memory size in bytes', fn=max_rss_bytes)
+_started = time.time()
+REGISTRY.gauge('process_start_time_seconds', 'Start time of the process since the epoch', fn=lambda: _started)
+
+
+class MetricsServer:
+    """aiohttp server for `/` (health) and `/metrics`; other modules may add routes to .app before start()"""
+
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.app = web.Application()
+        self.app.router.add_get('/', self.health)
+        self.app.router.add_get('/metrics', self.metrics)
+        self._runner = None
+        self.scrapes = 0
+
+    async def health(self, request):
+        return web.json_response({'status': 'ok', 'uptime': time.time() - _started})
+
+    async def metrics(self, request):
+        self.scrapes += 1
+        return web.Response(body=self.registry.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def start(self):
+        if self._runner is not None or not self.port:
+            return
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"📈 Metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
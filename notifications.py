@@ -0,0 +1,222 @@
+"""Background webhook pipeline: queued embeds, coalesced into multi-embed posts within Discord's rate limits"""
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import deque
+
+import aiohttp
+
+from http_client import float_header
+from sharding import SHARD_IDS
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '500'))  # Embeds held in memory before spilling
+# Overflow file; empty disables. Shard processes share a working directory, so each gets its own by default.
+WEBHOOK_SPILL_PATH = os.getenv('WEBHOOK_SPILL_PATH', f"webhook_spill-{SHARD_IDS.replace(',', '_')}.jsonl"
+                               if SHARD_IDS else 'webhook_spill.jsonl')
+WEBHOOK_BATCH_WINDOW = float(os.getenv('WEBHOOK_BATCH_WINDOW', '2'))  # Seconds to gather embeds into one post
+WEBHOOK_MAX_EMBEDS = 10  # Discord's limit per message
+WEBHOOK_MAX_ATTEMPTS = 5  # Per batch, for 429/5xx/network errors
+
+
+class WebhookNotifier:
+    """notify() never waits on I/O; one worker posts up to 10 embeds per request, paced by X-RateLimit-*"""
+
+    def __init__(self, http_pool, url, timeout, username="AI Bot Logger", max_queue=WEBHOOK_QUEUE_SIZE,
+                 spill_path=WEBHOOK_SPILL_PATH, batch_window=WEBHOOK_BATCH_WINDOW):
+        self.http_pool = http_pool
+        self.url = url
+        self.timeout = timeout
+        self.username = username
+        self.avatar_url = None  # Filled in once the bot user is known
+        self.max_queue = max_queue
+        self.spill_path = spill_path or None
+        self.batch_window = batch_window
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._spilled = 0  # Embeds currently in the spill file
+        self._blocked_until = 0.0  # loop.time() before which we must not post
+        self._sending = []  # Batch currently being delivered
+        self.queued = 0
+        self.posts = 0
+        self.embeds_sent = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self.spill_writes = 0
+        if self.spill_path and os.path.exists(self.spill_path):
+            with open(self.spill_path, encoding='utf-8') as f:
+                self._spilled = sum(1 for line in f if line.strip())
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if self.enabled and not self.running:
+            self._worker = asyncio.create_task(self._run(), name='webhook-notifier')
+            if self._spilled:
+                self._wakeup.set()
+
+    def notify(self, embed):
+        """Queue one embed; spills to disk when the in-memory queue is full"""
+        if not self.enabled:
+            return
+        self.queued += 1
+        if len(self._queue) >= self.max_queue:
+            self._spill([embed])
+        else:
+            self._queue.append(embed)
+        self._wakeup.set()
+
+    def _spill(self, embeds):
+        if not self.spill_path:
+            self.dropped += len(embeds)
+            return
+        try:
+            # One short append; far cheaper than the post it stands in for
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(embed) + '\n' for embed in embeds)
+            self._spilled += len(embeds)
+            self.spill_writes += 1
+        except OSError as e:
+            self.dropped += len(embeds)
+            logger.error(f"❌ Webhook spill failed, dropped {len(embeds)} notifications: {e}")
+
+    def _read_spill(self):
+        embeds = []
+        skipped = 0
+        with open(self.spill_path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                # A crash mid-append leaves a torn last line; it must not strand the embeds before it
+                try:
+                    embeds.append(json.loads(line))
+                except ValueError:
+                    skipped += 1
+        os.remove(self.spill_path)
+        if skipped:
+            self.dropped += skipped
+            logger.warning(f"⚠️ Skipped {skipped} malformed lines in the webhook spill file")
+        return embeds
+
+    async def _refill_from_spill(self):
+        """Move spilled embeds back once the in-memory queue has drained"""
+        if not self._spilled or self._queue:
+            return
+        try:
+            embeds = await asyncio.to_thread(self._read_spill)
+        except OSError as e:
+            logger.error(f"❌ Could not read webhook spill file: {e}")
+            self._spilled = 0
+            return
+        self._spilled = 0
+        overflow = embeds[self.max_queue:]
+        self._queue.extend(embeds[:self.max_queue])
+        if overflow:
+            self._spill(overflow)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._refill_from_spill()
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Give a burst (reconnect, mass invite) a moment to fill the batch
+            if len(self._queue) < WEBHOOK_MAX_EMBEDS:
+                await asyncio.sleep(self.batch_window)
+            wait = self._blocked_until - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            self._sending = [self._queue.popleft() for _ in range(min(WEBHOOK_MAX_EMBEDS, len(self._queue)))]
+            await self._deliver(self._sending)
+            self._sending = []
+
+    async def _deliver(self, batch):
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+            try:
+                status, retry_after = await self._post(batch)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, retry_after = None, None
+                logger.warning(f"⚠️ Webhook post failed: {e}")
+
+            if status is not None and status < 300:
+                self.posts += 1
+                self.embeds_sent += len(batch)
+                return
+            if status is not None and status != 429 and status < 500:
+                self.dropped += len(batch)
+                logger.error(f"❌ Webhook rejected {len(batch)} notifications with status {status}")
+                return
+            if status == 429:
+                self.rate_limited += 1
+            delay = retry_after if retry_after is not None else min(30.0, 2 ** attempt * random.uniform(0.5, 1.0))
+            self._blocked_until = max(self._blocked_until, loop.time() + delay)
+            await asyncio.sleep(delay)
+
+        # Keep them for later rather than hammering a failing endpoint
+        logger.error(f"❌ Webhook still failing after {WEBHOOK_MAX_ATTEMPTS} attempts; spilling {len(batch)}")
+        self._spill(batch)
+
+    async def _post(self, batch):
+        """POST one multi-embed message; returns (status, seconds to wait or None)"""
+        payload = {"embeds": batch, "username": self.username, "avatar_url": self.avatar_url}
+        async with self.http_pool.session.post(self.url, json=payload,
+                                               timeout=self.http_pool.timeout(self.timeout)) as response:
+            headers = response.headers
+            retry_after = None
+            if response.status == 429:
+                try:
+                    retry_after = float((await response.json(content_type=None)).get('retry_after'))
+                except (TypeError, ValueError, AttributeError, aiohttp.ContentTypeError):
+                    retry_after = float_header(headers, 'Retry-After')
+            # Pace the next post by the bucket's own numbers instead of discovering the limit with a 429
+            if headers.get('X-RateLimit-Remaining') == '0':
+                reset_after = float_header(headers, 'X-RateLimit-Reset-After')
+                if reset_after is not None:
+                    loop = asyncio.get_running_loop()
+                    self._blocked_until = max(self._blocked_until, loop.time() + reset_after)
+            return response.status, retry_after
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._queue),
+            'spilled': self._spilled,
+            'queued': self.queued,
+            'posts': self.posts,
+            'embeds_sent': self.embeds_sent,
+            'rate_limited': self.rate_limited,
+            'dropped': self.dropped,
+        }
+
+    async def close(self, drain_timeout=5.0):
+        """Try to send what's queued, then spill whatever is left so it goes out after restart"""
+        if self._worker is None:
+            return
+        if self._queue:
+            deadline = asyncio.get_running_loop().time() + drain_timeout
+            self.batch_window = 0
+            self._wakeup.set()
+            while self._queue and asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.05)
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+        unsent = self._sending + list(self._queue)
+        self._sending = []
+        self._queue.clear()
+        if unsent:
+            self._spill(unsent)
@@ -0,0 +1,163 @@
+"""On-demand sampling profiler for the event-loop thread plus a tracemalloc diff; nothing runs while idle"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))  # Seconds between stack samples
+PROFILE_MAX_SECONDS = 120
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')  # Where .collapsed and allocation reports are written
+PROFILE_TOP_ALLOCATIONS = 30  # Lines of the allocation diff kept
+
+
+_LOOP_CODE = (asyncio.Handle._run.__code__, asyncio.BaseEventLoop._run_once.__code__)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileResult:
+    """Collapsed stacks (one `root;...;leaf count` line each, as flamegraph.pl and speedscope read them)"""
+
+    def __init__(self, stacks, seconds, interval, allocations):
+        self.stacks = stacks  # Counter of ';'-joined stacks, task name first
+        self.seconds = seconds
+        self.interval = interval
+        self.allocations = allocations  # tracemalloc StatisticDiffs, largest growth first
+        self.created = time.strftime('%Y%m%d-%H%M%S')
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_tasks(self, limit=5):
+        tasks = Counter()
+        for stack, count in self.stacks.items():
+            tasks[stack.partition(';')[0]] += count
+        return tasks.most_common(limit)
+
+    def top_functions(self, limit=10):
+        """Functions by inclusive share of samples, counting each at most once per stack"""
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack.split(';')[1:]):
+                functions[label] += count
+        return functions.most_common(limit)
+
+    def allocation_report(self):
+        lines = [f"# tracemalloc growth by source line over {self.seconds:g}s, largest first"]
+        lines.extend(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks, {stat.size / 1024:.1f} KiB live) "
+                     f"{stat.traceback[0]}" for stat in self.allocations)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=8):
+        samples = self.samples or 1
+        lines = [f"{self.samples} samples over {self.seconds:g}s every {self.interval * 1000:g}ms"]
+        lines.append("Tasks: " + ', '.join(f"{task} {count / samples:.0%}" for task, count in self.top_tasks()))
+        lines.extend(f"{count / samples:6.1%}  {label}" for label, count in self.top_functions(limit))
+        if self.allocations:
+            top = self.allocations[0]
+            lines.append(f"Top allocation growth: {top.size_diff / 1024:+.1f} KiB at {top.traceback[0]}")
+        return '\n'.join(lines)
+
+    def write(self, directory=PROFILE_DIR):
+        """Write <stamp>.collapsed and <stamp>-alloc.txt; returns their paths"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"profile-{self.created}")
+        paths = [f"{base}.collapsed"]
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        if self.allocations:
+            paths.append(f"{base}-alloc.txt")
+            with open(paths[1], 'w', encoding='utf-8') as f:
+                f.write(self.allocation_report())
+        return paths
+
+
+class SamplingProfiler:
+    """Samples the event-loop thread's stack from a helper thread for a fixed window
+
+    Each sample is the stack that is running on the loop at that moment. The stack is rooted at
+    the name of the current asyncio task, so time lands on `discord.py: on_message`, an inference
+    worker, and so on. Samples taken while the loop waits in select show up under `idle`. The
+    helper thread and tracemalloc exist only during profile(). While idle the profiler costs nothing.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, trace_allocations=True):
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self.running = False
+        self.profiles = 0
+
+    async def profile(self, seconds):
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        self.running = True
+        loop = asyncio.get_running_loop()
+        stacks = Counter()
+        stop = threading.Event()
+        tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        try:
+            if tracing:
+                tracemalloc.start()
+                before = await asyncio.to_thread(tracemalloc.take_snapshot)
+            sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), loop, stacks, stop),
+                                       name='profiler', daemon=True)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            allocations = []
+            if tracing:
+                after = await asyncio.to_thread(tracemalloc.take_snapshot)
+                allocations = await asyncio.to_thread(self._diff, before, after)
+        finally:
+            if tracing:
+                tracemalloc.stop()
+            self.running = False
+        self.profiles += 1
+        logger.info(f"🔬 Profiled the event loop for {seconds:g}s ({sum(stacks.values())} samples)")
+        return ProfileResult(stacks, seconds, self.interval, allocations)
+
+    def _sample(self, thread_id, loop, stacks, stop):
+        # What asyncio.current_task() reads; safe to look at under the GIL
+        current_tasks = getattr(asyncio.tasks, '_current_tasks', {})
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            labels = []
+            # The loop's own frames (run_forever, _run_once, ...) are the same in every sample, so the
+            # stack starts at the callback the loop is running; the task name stands in for them
+            while frame is not None and frame.f_code not in _LOOP_CODE:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            task = current_tasks.get(loop)
+            labels.append(task.get_name() if task is not None else 'idle')
+            stacks[';'.join(reversed(labels))] += 1
+
+    @staticmethod
+    def _diff(before, after):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+        after = after.filter_traces(ignore)
+        before = before.filter_traces(ignore)
+        stats = after.compare_to(before, 'lineno')
+        stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+        return stats[:PROFILE_TOP_ALLOCATIONS]
+
+    def stats(self):
+        return {'running': self.running, 'profiles': self.profiles}
@@ -0,0 +1,191 @@
+"""Token-aware prompt assembly from incrementally maintained context buffers"""
+import importlib.util
+import logging
+import os
+import re
+from collections import Counter, deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+MODEL_CONTEXT_WINDOW = int(os.getenv('MODEL_CONTEXT_WINDOW', '1024'))  # DialoGPT's GPT-2 window
+PROMPT_CONTEXT_TOKENS = int(os.getenv('PROMPT_CONTEXT_TOKENS', '192'))  # Most history we ever send
+PROMPT_SUMMARY_TOKENS = int(os.getenv('PROMPT_SUMMARY_TOKENS', '32'))  # Cap for the channel summary
+PROMPT_MEMORY_TOKENS = int(os.getenv('PROMPT_MEMORY_TOKENS', '64'))  # Recalled memories; taken from the history budget
+PROMPT_TOKENIZER = os.getenv('PROMPT_TOKENIZER')  # e.g. "gpt2"; falls back to an estimate if unavailable
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+_tokenizer = None
+
+
+def load_tokenizer(name=PROMPT_TOKENIZER):
+    """Load a real tokenizer once if one is configured and transformers is installed"""
+    global _tokenizer
+    if not name or _tokenizer is not None:
+        return _tokenizer
+    if importlib.util.find_spec('transformers') is None:
+        logger.warning(f"⚠️ PROMPT_TOKENIZER={name} needs transformers; using the token estimate")
+        return None
+    from transformers import AutoTokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(name)
+    count_tokens.cache_clear()
+    return _tokenizer
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """Token count for text: exact with a loaded tokenizer, otherwise a GPT-2-like estimate"""
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text))
+    # BPE keeps common short words whole and splits long or non-ASCII ones
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece.isascii():
+            tokens += 1 + len(piece) // 6
+        else:
+            tokens += max(1, len(piece.encode('utf-8')) // 2)
+    return tokens
+
+
+class ContextBuffer:
+    """Rolling conversation lines with their token counts, rendered on demand and cached"""
+    __slots__ = ('lines', 'tokens', 'total_tokens', '_rendered')
+
+    def __init__(self, maxlen):
+        self.lines = deque(maxlen=maxlen)
+        self.tokens = deque(maxlen=maxlen)
+        self.total_tokens = 0
+        self._rendered = None  # (token_budget, text) for the last render
+
+    @property
+    def maxlen(self):
+        return self.lines.maxlen
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index]
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.total_tokens -= self.tokens[0]
+        # Count the trailing newline the line will carry in the prompt
+        line_tokens = count_tokens(line) + 1
+        self.lines.append(line)
+        self.tokens.append(line_tokens)
+        self.total_tokens += line_tokens
+        self._rendered = None
+
+    def render(self, token_budget):
+        """Newest lines that fit in token_budget, oldest first, each ending in a newline"""
+        if self._rendered is not None and self._rendered[0] == token_budget:
+            return self._rendered[1]
+
+        if self.total_tokens <= token_budget:
+            text = ''.join(f"{line}\n" for line in self.lines)
+        else:
+            used = 0
+            keep = 0
+            for line_tokens in reversed(self.tokens):
+                if used + line_tokens > token_budget:
+                    break
+                used += line_tokens
+                keep += 1
+            text = ''.join(f"{line}\n" for line in list(self.lines)[len(self.lines) - keep:]) if keep else ''
+
+        self._rendered = (token_budget, text)
+        return text
+
+
+def summarize_channel(lines, exclude_speaker=None, max_speakers=4, max_topics=3):
+    """One compact line about who else is talking in the channel and about what"""
+    speakers = []
+    words = Counter()
+    for line in lines:
+        speaker, _, text = line.partition(': ')
+        if speaker == exclude_speaker or speaker == 'Bot':
+            continue
+        if speaker not in speakers:
+            speakers.append(speaker)
+        words.update(word for word in text.lower().split() if len(word) > 4 and word.isalpha())
+
+    if not speakers:
+        return ''
+    summary = f"(Also chatting: {', '.join(speakers[-max_speakers:])}"
+    topics = [word for word, _ in words.most_common(max_topics)]
+    if topics:
+        summary += f"; topics: {', '.join(topics)}"
+    return summary + ")"
+
+
+class PromptBuilder:
+    """Assembles prompts that fit the model window, trimming history by tokens rather than lines"""
+
+    def __init__(self, window=MODEL_CONTEXT_WINDOW, context_tokens=PROMPT_CONTEXT_TOKENS,
+                 summary_tokens=PROMPT_SUMMARY_TOKENS, memory_tokens=PROMPT_MEMORY_TOKENS):
+        self.window = window
+        self.context_tokens = context_tokens
+        self.summary_tokens = summary_tokens
+        self.memory_tokens = memory_tokens
+        self.built = 0
+        self.trimmed = 0
+        self.with_memories = 0
+
+    def build(self, prompt, context, user_name, max_new_tokens, prefix='', channel_summary='', memories=()):
+        """Return (full_prompt, prompt_tokens) for a reply of up to max_new_tokens
+
+        memories are recalled older exchanges. They go ahead of the recent history and share its
+        budget, so recalling them never makes the prompt longer.
+        """
+        question = f"Human ({user_name}): {prompt}\nAI:"
+        fixed_tokens = count_tokens(prefix) + count_tokens(question)
+
+        summary = ''
+        summary_tokens = 0
+        if channel_summary:
+            summary_tokens = count_tokens(channel_summary) + 1
+            if summary_tokens <= self.summary_tokens:
+                summary = f"{channel_summary}\n"
+            else:
+                summary_tokens = 0
+
+        # History gets whatever the window leaves after the reply, capped so prompts stay short
+        room = self.window - max_new_tokens - fixed_tokens - summary_tokens
+        budget = max(0, min(self.context_tokens, room))
+
+        memory_prompt = ''
+        memory_tokens = 0
+        for memory in memories:
+            tokens = count_tokens(memory) + 1
+            if memory_tokens + tokens > min(self.memory_tokens, budget):
+                break
+            memory_prompt += f"{memory}\n"
+            memory_tokens += tokens
+        if memory_prompt:
+            budget -= memory_tokens
+            self.with_memories += 1
+
+        context_prompt = ''
+        context_tokens = 0
+        if context is not None and len(context) > 0:
+            if not isinstance(context, ContextBuffer):
+                buffer = ContextBuffer(maxlen=len(context))
+                for line in context:
+                    buffer.append(line)
+                context = buffer
+            context_prompt = context.render(budget)
+            context_tokens = min(context.total_tokens, budget)
+            if context.total_tokens > budget:
+                self.trimmed += 1
+
+        self.built += 1
+        full_prompt = f"{prefix}{summary}{memory_prompt}{context_prompt}{question}"
+        return full_prompt, fixed_tokens + summary_tokens + memory_tokens + context_tokens
+
+    def stats(self):
+        return {'built': self.built, 'trimmed': self.trimmed, 'with_memories': self.with_memories,
+                'token_cache': count_tokens.cache_info()._asdict()}
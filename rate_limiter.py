@@ -0,0 +1,190 @@
+"""Hierarchical token buckets (global -> guild -> channel -> user) with a budget per reply class"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from dispatcher import REPLY_DM, REPLY_MENTION, REPLY_RANDOM, REPLY_TRIGGER
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ('global', 'guild', 'channel', 'user')
+
+# (tokens per second, burst) per level; one token is one model call
+DEFAULT_RATE_LIMITS = {
+    REPLY_RANDOM: {'global': (0.5, 10), 'guild': (1 / 60, 3), 'channel': (1 / 120, 2), 'user': (1 / 300, 1)},
+    REPLY_TRIGGER: {'global': (2.0, 30), 'guild': (0.1, 10), 'channel': (1 / 20, 5), 'user': (1 / 30, 3)},
+    REPLY_MENTION: {'global': (5.0, 60), 'guild': (0.5, 20), 'channel': (0.25, 10), 'user': (0.1, 5)},
+    REPLY_DM: {'global': (2.0, 30), 'user': (0.1, 5)},
+}
+RATE_LIMITS = os.getenv('RATE_LIMITS')  # JSON overriding DEFAULT_RATE_LIMITS, e.g. {"trigger": {"channel": [0.1, 5]}}
+MAX_RATE_BUCKETS = int(os.getenv('MAX_RATE_BUCKETS', '100000'))  # Live buckets before the least recent is dropped
+
+
+class TokenBucket:
+    """Token bucket refilled lazily on use; shared with the REST scheduler's route buckets"""
+    __slots__ = ('tokens', 'updated', 'rate', 'burst')
+
+    def __init__(self, rate, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.rate = rate
+        self.burst = burst
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Allows a reply only if every level of its class still has a token; O(levels) per check
+
+    Buckets are created on first use and kept in least-recently-used order. A bucket that has
+    refilled completely is the same as a new one, so it can be dropped at no cost. Every check
+    drops a couple of such buckets from the front, and MAX_RATE_BUCKETS caps the rest.
+
+    With a shared state backend, acquire() takes the global level from one bucket there, so every
+    shard process draws on the same budget. Guild, channel and user levels stay local: Discord
+    delivers a guild's events on one shard. When the state backend can't be reached, the global
+    level falls back to a local bucket holding this process's global_share.
+    """
+
+    def __init__(self, limits=None, max_buckets=MAX_RATE_BUCKETS, global_share=1.0, state=None):
+        self.limits = {reply_class: dict(levels) for reply_class, levels in DEFAULT_RATE_LIMITS.items()}
+        for reply_class, levels in (limits or {}).items():
+            self.limits.setdefault(reply_class, {}).update({level: tuple(limit) for level, limit in levels.items()})
+        self.global_share = global_share
+        self.state = state
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # (reply_class, level, id) -> TokenBucket
+        self.allowed = {reply_class: 0 for reply_class in self.limits}
+        self.denied = {(reply_class, level): 0 for reply_class, levels in self.limits.items() for level in levels}
+        self.evictions = 0
+        self.state_errors = 0
+
+    @classmethod
+    def from_env(cls, config=RATE_LIMITS, **kwargs):
+        limits = None
+        if config:
+            try:
+                limits = json.loads(config)
+            except ValueError as e:
+                logger.error(f"❌ Invalid RATE_LIMITS, using defaults: {e}")
+        return cls(limits, **kwargs)
+
+    def _bucket(self, key, rate, burst, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def _evict_idle(self, now, limit=2):
+        buckets = self._buckets
+        for _ in range(limit):
+            if not buckets:
+                return
+            key = next(iter(buckets))
+            bucket = buckets[key]
+            if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.burst:
+                return
+            del buckets[key]
+            self.evictions += 1
+
+    def _reserve(self, reply_class, levels, ids, cost, now):
+        """Buckets for the given levels if all have cost tokens, else the first level that is short"""
+        buckets = []
+        for level in levels:
+            limit = self.limits[reply_class].get(level)
+            if limit is None or ids[level] is None:
+                continue
+            rate, burst = limit
+            if level == 'global':
+                rate, burst = rate * self.global_share, max(1, burst * self.global_share)
+            bucket = self._bucket((reply_class, level, ids[level]), rate, burst, now)
+            if bucket.tokens < cost:
+                self.denied[(reply_class, level)] += 1
+                return None, level
+            buckets.append(bucket)
+        return buckets, None
+
+    @staticmethod
+    def _spend(buckets, cost):
+        # Only spend once every level has agreed, so a denial doesn't drain the levels above it
+        for bucket in buckets:
+            bucket.tokens -= cost
+
+    @staticmethod
+    def _refund(buckets, cost):
+        for bucket in buckets:
+            bucket.tokens = min(bucket.burst, bucket.tokens + cost)
+
+    def check(self, reply_class, guild_id, channel_id, user_id, cost=1):
+        """Take cost tokens at every level and return None, or return the first level that is short"""
+        if not self.limits.get(reply_class):
+            return None
+        now = time.monotonic()
+        self._evict_idle(now)
+        ids = {'global': 0, 'guild': guild_id, 'channel': channel_id, 'user': user_id}
+        buckets, level = self._reserve(reply_class, LEVELS, ids, cost, now)
+        if level is not None:
+            return level
+        self._spend(buckets, cost)
+        self.allowed[reply_class] += 1
+        return None
+
+    def allow(self, reply_class, guild_id, channel_id, user_id, cost=1):
+        return self.check(reply_class, guild_id, channel_id, user_id, cost) is None
+
+    async def acquire(self, reply_class, guild_id, channel_id, user_id, cost=1):
+        """allow(), with the global level drawn from the shared state backend when there is one"""
+        levels = self.limits.get(reply_class)
+        if self.state is None or not levels or 'global' not in levels:
+            return self.allow(reply_class, guild_id, channel_id, user_id, cost)
+        now = time.monotonic()
+        self._evict_idle(now)
+        ids = {'global': 0, 'guild': guild_id, 'channel': channel_id, 'user': user_id}
+        # Local levels first, so a message that is over its channel budget costs no round trip
+        buckets, level = self._reserve(reply_class, LEVELS[1:], ids, cost, now)
+        if level is not None:
+            return False
+        # Spent before the round trip so concurrent messages in the channel see the tokens gone;
+        # given back if the global level says no
+        self._spend(buckets, cost)
+        rate, burst = levels['global']
+        try:
+            allowed = await self.state.acquire(f"rate:{reply_class}", rate, burst, cost)
+        except (OSError, asyncio.TimeoutError, RuntimeError) as e:
+            self.state_errors += 1
+            logger.debug(f"Shared rate limit unavailable, using this process's share: {e}")
+            shared, level = self._reserve(reply_class, ('global',), ids, cost, time.monotonic())
+            allowed = level is None
+            if allowed:
+                self._spend(shared, cost)
+        except BaseException:
+            self._refund(buckets, cost)
+            raise
+        else:
+            if not allowed:
+                self.denied[(reply_class, 'global')] += 1
+        if not allowed:
+            self._refund(buckets, cost)
+            return False
+        self.allowed[reply_class] += 1
+        return True
+
+    def stats(self):
+        return {
+            'buckets': len(self._buckets),
+            'evictions': self.evictions,
+            'state_errors': self.state_errors,
+            'allowed': dict(self.allowed),
+            'denied': {f"{reply_class}/{level}": count for (reply_class, level), count in self.denied.items() if count},
+        }
@@ -0,0 +1,285 @@
+"""Retry, circuit breaker and hedged requests around an inference backend"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from backends import InferenceBackend, InferenceError
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', '3'))  # Total tries per request
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '8'))
+RETRY_BUDGET = float(os.getenv('RETRY_BUDGET', '20'))  # Seconds one call may spend across all attempts
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # Consecutive failures
+BREAKER_RECOVERY_TIME = float(os.getenv('BREAKER_RECOVERY_TIME', '30'))  # Seconds before a probe
+HEDGE_DELAY = float(os.getenv('HEDGE_DELAY', '0'))  # Seconds before a duplicate request; 0 disables
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(InferenceError):
+    """Raised without calling the backend while the circuit breaker is open"""
+
+    def __init__(self, retry_in):
+        super().__init__(503, f"circuit open, retry in {retry_in:.1f}s", retry_after=retry_in)
+
+
+def is_retryable(error):
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, InferenceError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class RetryPolicy:
+    """Jittered exponential backoff that defers to the server's own wait hints"""
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 budget=RETRY_BUDGET):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def delay(self, attempt, error):
+        """Seconds to wait before retry number `attempt` (1-based)"""
+        hint = None
+        if isinstance(error, InferenceError):
+            # A loading model tells us how long it needs; Retry-After is authoritative for 429/503
+            hint = error.estimated_time or error.retry_after
+        if hint:
+            return hint * random.uniform(1.0, 1.1)
+        # "Full jitter" keeps a burst of failed callers from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open probe after a cool-down"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_time=BREAKER_RECOVERY_TIME):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def retry_in(self):
+        return max(0.0, self.opened_at + self.recovery_time - time.monotonic())
+
+    def is_open(self):
+        """True while calls would be rejected (doesn't claim the half-open probe)"""
+        if self.state == self.OPEN:
+            return self.retry_in() > 0
+        return self.state == self.HALF_OPEN and self._probe_in_flight
+
+    def allow(self):
+        """Claim permission for one call"""
+        if self.state == self.OPEN and self.retry_in() <= 0:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self):
+        """Give back a claimed call with no verdict on the backend, e.g. when the caller went away"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ Inference circuit closed again")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"⚡ Inference circuit opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ResilientBackend(InferenceBackend):
+    """Wraps another backend with retries, a circuit breaker and optional hedging"""
+
+    def __init__(self, backend, retry=None, breaker=None, hedge_delay=HEDGE_DELAY):
+        self.backend = backend
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_delay = hedge_delay
+        self.name = backend.name
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def supports_batching(self):
+        return self.backend.supports_batching
+
+    @property
+    def supports_streaming(self):
+        return self.backend.supports_streaming
+
+    def describe(self):
+        return self.backend.describe()
+
+    def available(self):
+        """False while the breaker is rejecting calls, so callers can skip queueing"""
+        return not self.breaker.is_open()
+
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def generate(self, prompts, parameters, budget=None):
+        """budget: seconds the caller will wait, if less than the retry policy's own budget"""
+        return await self._call(lambda: self._hedged(prompts, parameters), budget)
+
+    async def stream(self, prompt, parameters, budget=None):
+        # Retry only until the first chunk arrives; after that the user has seen text
+        deadline = self._deadline(budget)
+        attempt = 0
+        while True:
+            self._admit()
+            attempt += 1
+            self.calls += 1
+            yielded = False
+            try:
+                async for chunk in self.backend.stream(prompt, parameters):
+                    yielded = True
+                    yield chunk
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None or yielded:
+                    raise
+                error = e
+            except BaseException:
+                # Closed by a consumer that stopped reading, or cancelled: says nothing about the backend
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                return
+            await self._backoff(attempt, delay, error)
+
+    async def _call(self, attempt_fn, budget=None):
+        deadline = self._deadline(budget)
+        attempt = 0
+        while True:
+            self._admit()
+            attempt += 1
+            self.calls += 1
+            try:
+                result = await attempt_fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                error = e
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+            await self._backoff(attempt, delay, error)
+
+    def _deadline(self, budget):
+        return time.monotonic() + (self.retry.budget if budget is None else min(budget, self.retry.budget))
+
+    def _admit(self):
+        if not self.breaker.allow():
+            raise CircuitOpen(self.breaker.retry_in())
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Record the failure and return how long to wait before retrying, or None to give up"""
+        if not is_retryable(error):
+            if isinstance(error, CircuitOpen):
+                self.breaker.release()
+            elif isinstance(error, InferenceError):
+                # 4xx means our request was bad, not that the backend is unhealthy
+                self.breaker.record_success()
+            else:
+                # Anything unexpected, like a body that isn't JSON, counts against the backend
+                self.failures += 1
+                self.breaker.record_failure()
+            return None
+        self.failures += 1
+        self.breaker.record_failure()
+        if attempt >= self.retry.attempts or self.breaker.state == CircuitBreaker.OPEN:
+            return None
+        delay = self.retry.delay(attempt, error)
+        # Don't sleep past the caller's budget just to fail anyway
+        return delay if time.monotonic() + delay < deadline else None
+
+    async def _backoff(self, attempt, delay, error):
+        self.retries += 1
+        logger.info(f"🔁 Inference retry {attempt} in {delay:.1f}s ({error})")
+        await asyncio.sleep(delay)
+
+    async def _hedged(self, prompts, parameters):
+        if not self.hedge_delay:
+            return await self.backend.generate(prompts, parameters)
+
+        primary = asyncio.ensure_future(self.backend.generate(prompts, parameters))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if done:
+                return primary.result()
+
+            # Slow tail: race a duplicate request and keep whichever finishes first successfully
+            self.hedges += 1
+            hedge = asyncio.ensure_future(self.backend.generate(prompts, parameters))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also reached when our caller is cancelled or hits its deadline while we wait
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            'circuit_state': self.breaker.state,
+            'circuit_opened': self.breaker.times_opened,
+            'short_circuited': self.breaker.rejected,
+            'calls': self.calls,
+            'retries': self.retries,
+            'failures': self.failures,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            **self.backend.stats(),
+        }
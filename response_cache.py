@@ -0,0 +1,177 @@
+"""LRU + TTL cache of model replies keyed on a normalized prompt"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2048'))  # Distinct prompts kept
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # Seconds
+# Seconds an expired reply is still kept as a fallback for when the model is down or too slow
+RESPONSE_CACHE_STALE_TTL = float(os.getenv('RESPONSE_CACHE_STALE_TTL', '21600'))
+RESPONSE_CACHE_VARIANTS = int(os.getenv('RESPONSE_CACHE_VARIANTS', '3'))  # Replies stored per prompt
+RESPONSE_CACHE_VARIABILITY = float(os.getenv('RESPONSE_CACHE_VARIABILITY', '0.25'))  # Chance to skip a hit
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH')  # Optional file so the cache survives restarts
+
+_MENTION_RE = re.compile(r'<@[!&]?\d+>')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+
+def normalize_prompt(text):
+    """Lowercase, drop mentions/punctuation/emoji and collapse whitespace"""
+    text = _MENTION_RE.sub(' ', text.lower())
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return ' '.join(text.split())
+
+
+class _CacheEntry:
+    __slots__ = ('variants', 'expires_at')
+
+    def __init__(self, expires_at):
+        self.variants = []
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """Size-bounded LRU with per-entry TTL and a few reply variants per prompt
+
+    get() only serves entries within their TTL. An expired entry is kept for another stale_ttl
+    seconds so peek() can still return it when the model can't answer.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 stale_ttl=RESPONSE_CACHE_STALE_TTL, max_variants=RESPONSE_CACHE_VARIANTS, variability=RESPONSE_CACHE_VARIABILITY,
+                 path=RESPONSE_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_variants = max(1, max_variants)
+        self.variability = variability
+        self.path = path
+        self._entries = OrderedDict()  # key -> _CacheEntry, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(prompt, sampling=()):
+        """Hash the normalized prompt together with the sampling settings that shape the reply"""
+        raw = normalize_prompt(prompt) + '\x1f' + repr(tuple(sampling))
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """Return a cached reply, or None on a miss (or when variability asks for a fresh one)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            self.misses += 1  # Left in place for peek(); purge_expired() drops it later
+            return None
+
+        # Occasionally regenerate so repeated prompts don't get word-for-word answers
+        if random.random() < self.variability:
+            self.bypasses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(entry.variants)
+
+    def peek(self, key):
+        """Return a stored reply for key, even if expired but within stale_ttl, without touching counters"""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at + self.stale_ttl <= time.monotonic():
+            return None
+        return random.choice(entry.variants)
+
+    def put(self, key, response):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= now:
+            entry = self._entries[key] = _CacheEntry(now + self.ttl)
+        if response not in entry.variants:
+            entry.variants.append(response)
+            if len(entry.variants) > self.max_variants:
+                entry.variants.pop(0)  # Keep the freshest variants
+        entry.expires_at = now + self.ttl
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def purge_expired(self):
+        """Drop entries past their stale horizon; returns how many"""
+        horizon = time.monotonic() - self.stale_ttl
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= horizon]
+        for key in expired:
+            del self._entries[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.bypasses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def snapshot(self):
+        """Serializable copy of kept entries (wall-clock expiry, since monotonic time resets)"""
+        now_mono = time.monotonic()
+        now_wall = time.time()
+        return [
+            [key, entry.variants[:], now_wall + (entry.expires_at - now_mono)]
+            for key, entry in self._entries.items()
+            if entry.expires_at + self.stale_ttl > now_mono
+        ]
+
+    def write_snapshot(self, snapshot):
+        """Write a snapshot to `path` atomically; safe to run in a worker thread"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Load a previous snapshot from `path`, skipping anything past its stale horizon"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not load response cache from {self.path}: {e}")
+            return 0
+
+        now_mono = time.monotonic()
+        now_wall = time.time()
+        loaded = 0
+        for key, variants, expires_wall in snapshot[-self.max_entries:]:
+            if expires_wall + self.stale_ttl <= now_wall or not variants:
+                continue
+            entry = _CacheEntry(now_mono + (expires_wall - now_wall))
+            entry.variants = variants[-self.max_variants:]
+            self._entries[key] = entry
+            loaded += 1
+        logger.info(f"💾 Loaded {loaded} cached responses from {self.path}")
+        return loaded
@@ -0,0 +1,307 @@
+"""Priority scheduling of outbound Discord calls against per-route buckets tracked ahead of Discord's own"""
+import asyncio
+import contextlib
+import logging
+import os
+import re
+from collections import OrderedDict, deque
+
+import aiohttp
+
+from http_client import float_header
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Outbound call classes, most important first. Cosmetic ones never wait: they go out right away or not at all.
+REST_REPLY = 'reply'
+REST_WELCOME = 'welcome'
+REST_TYPING = 'typing'
+REST_REACTION = 'reaction'
+REST_PRESENCE = 'presence'
+REST_PRIORITY = {REST_REPLY: 0, REST_WELCOME: 1, REST_TYPING: 2, REST_REACTION: 3, REST_PRESENCE: 4}
+COSMETIC = frozenset({REST_TYPING, REST_REACTION, REST_PRESENCE})
+
+# (requests per second, burst) per route and major id, from Discord's documented limits. These only
+# apply until the route's first response: from then on its X-RateLimit-* headers say what is left.
+DEFAULT_ROUTE_LIMITS = {
+    'send': (1.0, 5),  # POST /channels/{id}/messages: 5 per 5s per channel
+    'edit': (1.0, 5),  # PATCH /channels/{id}/messages/{id}
+    'reaction': (4.0, 1),  # PUT .../reactions/{emoji}/@me: 1 per 0.25s per channel
+    'typing': (1.0, 5),  # POST /channels/{id}/typing
+    'presence': (1 / 12, 5),  # Gateway presence update: 5 per minute
+}
+GATEWAY_ROUTES = frozenset({'presence'})  # Sent over the websocket, so outside the REST global limit
+# Discord allows 50 requests per second per bot token, with no headers to track it by. A bucket lets
+# through at most burst + rate requests in any second, so this never goes over.
+REST_GLOBAL_LIMIT = (45.0, 5)
+REST_GLOBAL_RESERVE = int(os.getenv('REST_GLOBAL_RESERVE', '2'))  # Global tokens cosmetic calls must leave alone
+MAX_REST_BUCKETS = 10000  # Live route buckets before the least recent is dropped
+
+# Discord REST paths -> our route names; the captured id is the route's major parameter
+_ROUTE_PATTERNS = (
+    ('PUT', re.compile(r'/channels/(\d+)/messages/\d+/reactions/[^/]+/@me$'), 'reaction'),
+    ('DELETE', re.compile(r'/channels/(\d+)/messages/\d+/reactions/[^/]+/@me$'), 'reaction'),
+    ('PATCH', re.compile(r'/channels/(\d+)/messages/\d+$'), 'edit'),
+    ('POST', re.compile(r'/channels/(\d+)/messages$'), 'send'),
+    ('POST', re.compile(r'/channels/(\d+)/typing$'), 'typing'),
+)
+
+
+def route_for(method, path):
+    """Our (route, major id) for a Discord REST request, or None for routes the scheduler doesn't track"""
+    for route_method, pattern, name in _ROUTE_PATTERNS:
+        if method == route_method:
+            match = pattern.search(path)
+            if match:
+                return name, int(match.group(1))
+    return None
+
+
+class _WindowBucket(TokenBucket):
+    """Token bucket until Discord reports on it, then Discord's fixed window: nothing back until reset_at"""
+    __slots__ = ('reset_at',)
+
+    def __init__(self, rate, burst, now):
+        super().__init__(rate, burst, now)
+        self.reset_at = None
+
+    def refill(self, now):
+        if self.reset_at is None:
+            super().refill(now)
+            return
+        if now < self.reset_at:
+            return
+        self.tokens = self.burst
+        self.reset_at = None
+        self.updated = now
+
+    def ready_at(self, now, reserve=0):
+        """Earliest loop time at which one token above reserve is available"""
+        self.refill(now)
+        short = reserve + 1 - self.tokens
+        if short <= 0:
+            return now
+        return self.reset_at if self.reset_at is not None else now + short / self.rate
+
+    def window(self, remaining, reset_at):
+        # Discord's count leaves out our requests still in flight, so it may only lower ours
+        self.tokens = min(self.tokens, remaining)
+        self.reset_at = reset_at
+
+
+class _Request:
+    __slots__ = ('kind', 'priority', 'route', 'future', 'enqueued_at')
+
+    def __init__(self, kind, route, loop):
+        self.kind = kind
+        self.priority = REST_PRIORITY[kind]
+        self.route = route
+        self.future = loop.create_future()
+        self.enqueued_at = loop.time()
+
+
+class RestScheduler:
+    """Grants outbound Discord calls a slot in their route bucket and the global bucket, best class first
+
+    Callers wrap the call itself: `await scheduler.run(REST_REPLY, ('send', channel_id), channel.send, text)`.
+    The call only starts once both buckets have a token, so discord.py's own limiter never has to
+    wait and we don't find the limit by hitting a 429. Replies and welcome messages queue. A cosmetic
+    call is dropped (run() returns None) in three cases: its route has no token, something more
+    important is waiting for that route, or the global bucket is down to the reserve kept for
+    replies. The trace_config() hook learns from every discord.py response's X-RateLimit-* headers.
+    """
+
+    def __init__(self, limits=None, global_limit=REST_GLOBAL_LIMIT, global_share=1.0,
+                 global_reserve=REST_GLOBAL_RESERVE, max_buckets=MAX_REST_BUCKETS, histogram=None):
+        self.limits = dict(DEFAULT_ROUTE_LIMITS, **(limits or {}))
+        # The 50/s limit is per bot token, so shard processes split it between them
+        self.global_limit = (global_limit[0] * global_share, max(1, global_limit[1] * global_share))
+        self.global_reserve = min(global_reserve, self.global_limit[1] - 1)
+        self.max_buckets = max_buckets
+        self.histogram = histogram  # Optional metrics.Histogram of queueing delay, labelled by class
+        self._global = None
+        self._buckets = OrderedDict()  # (route, major id) -> _WindowBucket
+        self._queue = deque()  # Waiting _Requests, in arrival order
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.granted = {kind: 0 for kind in REST_PRIORITY}
+        self.dropped = {kind: 0 for kind in COSMETIC}
+        self.queue_seconds_total = {kind: 0.0 for kind in REST_PRIORITY}
+        self.max_queue_depth = 0
+        self.header_updates = 0
+        self.rate_limited = 0  # 429s seen anyway; should stay at 0
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if not self.running:
+            self._worker = asyncio.create_task(self._run(), name='rest-scheduler')
+
+    def _bucket(self, route, now):
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            rate, burst = self.limits.get(route[0], self.global_limit)
+            bucket = self._buckets[route] = _WindowBucket(rate, burst, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(route)
+        return bucket
+
+    def _global_bucket(self, now):
+        if self._global is None:
+            self._global = _WindowBucket(*self.global_limit, now)
+        return self._global
+
+    def _take(self, kind, route, now):
+        self._bucket(route, now).tokens -= 1
+        if route[0] not in GATEWAY_ROUTES:
+            self._global_bucket(now).tokens -= 1
+        self.granted[kind] += 1
+
+    async def run(self, kind, route, call, *args, **kwargs):
+        """Await call(*args, **kwargs) once the buckets allow it; None if a cosmetic call was dropped"""
+        if not await self.acquire(kind, route):
+            return None
+        return await call(*args, **kwargs)
+
+    async def acquire(self, kind, route):
+        """Wait for a slot (or, for a cosmetic class, take one now); False if the call should be skipped"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if kind in COSMETIC:
+            if (self._bucket(route, now).ready_at(now) > now
+                    or (route[0] not in GATEWAY_ROUTES
+                        and self._global_bucket(now).ready_at(now, self.global_reserve) > now)
+                    or any(request.route == route for request in self._queue)):
+                self.dropped[kind] += 1
+                return False
+            self._take(kind, route, now)
+            self._observe(kind, 0.0)
+            return True
+
+        self.start()
+        request = _Request(kind, route, loop)
+        self._queue.append(request)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._wakeup.set()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request in self._queue:
+                self._queue.remove(request)
+            raise
+        return True
+
+    @contextlib.asynccontextmanager
+    async def typing(self, channel):
+        """channel.typing() when the channel's typing route has room, otherwise just run the block"""
+        if await self.acquire(REST_TYPING, ('typing', channel.id)):
+            async with channel.typing():
+                yield
+        else:
+            yield
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = loop.time()
+            global_ready = self._global_bucket(now).ready_at(now)
+            request, wake_at = self._next_ready(now, global_ready)
+            if request is None:
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), wake_at - now)
+                continue
+            self._queue.remove(request)
+            self._take(request.kind, request.route, now)
+            self._observe(request.kind, now - request.enqueued_at)
+            request.future.set_result(None)
+            # Let the granted caller start its request before the next grant
+            await asyncio.sleep(0)
+
+    def _next_ready(self, now, global_ready):
+        """Best waiting request whose route has a token, else (None, when the next one will)"""
+        heads = {}  # route -> its most important waiting request
+        for request in self._queue:
+            head = heads.get(request.route)
+            if head is None or request.priority < head.priority:
+                heads[request.route] = request
+        best = None
+        wake_at = None
+        for route, request in heads.items():
+            ready = max(global_ready, self._bucket(route, now).ready_at(now))
+            if ready > now:
+                wake_at = ready if wake_at is None else min(wake_at, ready)
+            elif best is None or (request.priority, request.enqueued_at) < (best.priority, best.enqueued_at):
+                best = request
+        return best, wake_at
+
+    def _observe(self, kind, seconds):
+        self.queue_seconds_total[kind] += seconds
+        if self.histogram is not None:
+            self.histogram.observe(seconds, kind)
+
+    def trace_config(self):
+        """aiohttp TraceConfig for discord.Client(http_trace=...): keeps the buckets in line with Discord's"""
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self._on_request_end)
+        return trace
+
+    async def _on_request_end(self, session, context, params):
+        route = route_for(params.method, params.url.path)
+        headers = params.response.headers
+        now = asyncio.get_running_loop().time()
+        if params.response.status == 429:
+            self.rate_limited += 1
+            retry_after = float_header(headers, 'Retry-After') or 1.0
+            bucket = self._global_bucket(now) if headers.get('X-RateLimit-Global') else (
+                self._bucket(route, now) if route else None)
+            if bucket is not None:
+                bucket.refill(now)
+                bucket.window(0, now + retry_after)
+                self._wakeup.set()
+            return
+        if route is None:
+            return
+        remaining = float_header(headers, 'X-RateLimit-Remaining')
+        reset_after = float_header(headers, 'X-RateLimit-Reset-After')
+        if remaining is None or reset_after is None:
+            return
+        bucket = self._bucket(route, now)
+        bucket.refill(now)
+        limit = float_header(headers, 'X-RateLimit-Limit')
+        if limit is not None:
+            bucket.burst = limit
+        bucket.window(remaining, now + reset_after)
+        self.header_updates += 1
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._queue),
+            'max_queue_depth': self.max_queue_depth,
+            'buckets': len(self._buckets),
+            'granted': dict(self.granted),
+            'dropped': dict(self.dropped),
+            'queue_seconds_total': dict(self.queue_seconds_total),
+            'header_updates': self.header_updates,
+            'rate_limited': self.rate_limited,
+        }
+
+    async def close(self):
+        """Let anything still queued go straight to discord.py, then stop the worker"""
+        for request in self._queue:
+            if not request.future.done():
+                request.future.set_result(None)
+        self._queue.clear()
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
@@ -0,0 +1,187 @@
+"""Deadline-based model routing: each reply class gets a latency target, a tier that can meet it, and a token budget"""
+import json
+import logging
+import os
+import random
+import time
+from collections import namedtuple
+
+from dispatcher import REPLY_DM, REPLY_MENTION, REPLY_RANDOM, REPLY_TRIGGER
+
+logger = logging.getLogger(__name__)
+
+TIER_LARGE = 'large'
+TIER_SMALL = 'small'
+TIER_TEMPLATE = 'template'  # A line from PERSONALITY_RESPONSES; no model call
+
+# Seconds from routing to the reply being generated, per reply class
+DEFAULT_DEADLINES = {REPLY_DM: 8.0, REPLY_MENTION: 6.0, REPLY_TRIGGER: 5.0, REPLY_RANDOM: 3.0}
+REPLY_DEADLINES = os.getenv('REPLY_DEADLINES')  # JSON overriding DEFAULT_DEADLINES, e.g. {"random": 2}
+
+# Tiers to try per class, best first; the first one that fits the deadline wins
+TIER_PREFERENCES = {
+    REPLY_DM: (TIER_LARGE, TIER_SMALL, TIER_TEMPLATE),
+    REPLY_MENTION: (TIER_LARGE, TIER_SMALL, TIER_TEMPLATE),
+    REPLY_TRIGGER: (TIER_LARGE, TIER_SMALL, TIER_TEMPLATE),
+    REPLY_RANDOM: (TIER_SMALL, TIER_TEMPLATE),  # An interjection never needs the big model
+}
+
+REPLY_TOKENS = (80, 180)  # max_new_tokens is drawn from this range, then cut to what the deadline allows
+MIN_REPLY_TOKENS = 24  # A budget below this isn't worth a model call
+LATENCY_ALPHA = 0.1  # Weight of each new call in a tier's latency estimate
+TIER_PROBE_INTERVAL = 60.0  # Seconds without a call after which a tier ruled out by its estimate gets one anyway
+# Starting (seconds per call, seconds per token) until a tier's own calls say otherwise
+TIER_PRIORS = {TIER_LARGE: (1.5, 0.02), TIER_SMALL: (0.5, 0.006)}
+
+RouteDecision = namedtuple('RouteDecision', 'tier model max_new_tokens deadline predicted')
+
+
+class ModelTier:
+    """One model behind its own dispatcher, with latency estimated as base + per-token cost
+
+    The estimate is an exponentially weighted least-squares fit of call seconds against
+    max_new_tokens. The configured prior counts as one call: the first calls are averaged with it
+    and later ones weighted by alpha, so a wrong prior is outvoted quickly. Only calls update it,
+    so a tier the estimate rules out would never get the chance to prove it wrong. probe() lets
+    one reply through per TIER_PROBE_INTERVAL without recent calls, starting with the first.
+    """
+
+    def __init__(self, name, dispatcher, backend, prior=None, alpha=LATENCY_ALPHA):
+        base_seconds, seconds_per_token = prior or TIER_PRIORS[name]
+        self.name = name
+        self.dispatcher = dispatcher
+        self.backend = backend
+        self.alpha = alpha
+        tokens = sum(REPLY_TOKENS) / 2
+        spread = (REPLY_TOKENS[1] - REPLY_TOKENS[0]) ** 2 / 12
+        self._tokens = tokens
+        self._seconds = base_seconds + seconds_per_token * tokens
+        self._variance = spread
+        self._covariance = seconds_per_token * spread
+        self.calls = 0
+        self.probes = 0
+        self._last_sample = None  # time.monotonic() of the last call, or of the last probe sent
+
+    @property
+    def seconds_per_token(self):
+        return max(0.0, self._covariance / self._variance) if self._variance > 1e-9 else 0.0
+
+    @property
+    def base_seconds(self):
+        return max(0.0, self._seconds - self.seconds_per_token * self._tokens)
+
+    def predict(self, tokens):
+        return self.base_seconds + self.seconds_per_token * tokens
+
+    def observe(self, tokens, seconds):
+        a = max(self.alpha, 1 / (self.calls + 2))
+        dt = tokens - self._tokens
+        ds = seconds - self._seconds
+        self._tokens += a * dt
+        self._seconds += a * ds
+        # Incremental EW (co)variance
+        self._variance = (1 - a) * (self._variance + a * dt * dt)
+        self._covariance = (1 - a) * (self._covariance + a * dt * ds)
+        self.calls += 1
+        self._last_sample = time.monotonic()
+
+    def probe(self):
+        """True, at most once per TIER_PROBE_INTERVAL without calls, to try a tier the estimate rules out"""
+        now = time.monotonic()
+        if self._last_sample is not None and now - self._last_sample < TIER_PROBE_INTERVAL:
+            return False
+        self._last_sample = now
+        self.probes += 1
+        return True
+
+    def queue_wait(self):
+        """Expected seconds before a new job starts: the backlog beyond free workers, in rounds of calls"""
+        dispatcher = self.dispatcher
+        backlog = dispatcher.queue.qsize() + dispatcher.in_flight - dispatcher.concurrency + 1
+        return max(0, backlog) / dispatcher.concurrency * self._seconds
+
+    def affordable_tokens(self, seconds):
+        spare = seconds - self.base_seconds
+        if spare <= 0:
+            return 0
+        return int(spare / self.seconds_per_token) if self.seconds_per_token else REPLY_TOKENS[1]
+
+    def available(self):
+        return self.dispatcher.running and self.backend.available()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'probes': self.probes,
+            'base_seconds': self.base_seconds,
+            'seconds_per_token': self.seconds_per_token,
+            'queue_wait': self.queue_wait(),
+        }
+
+
+class ModelRouter:
+    """Picks a tier and token budget per reply from its deadline, each tier's latency and its queue"""
+
+    def __init__(self, deadlines=None, preferences=TIER_PREFERENCES, rng=random):
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.preferences = preferences
+        self.rng = rng
+        self.tiers = {}
+        self.routed = {}  # (reply class, tier) -> count
+        self.deadline_met = {reply_class: 0 for reply_class in self.deadlines}
+        self.deadline_missed = {reply_class: 0 for reply_class in self.deadlines}
+
+    @classmethod
+    def from_env(cls, config=REPLY_DEADLINES, **kwargs):
+        deadlines = None
+        if config:
+            try:
+                deadlines = {reply_class: float(seconds) for reply_class, seconds in json.loads(config).items()}
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error(f"❌ Invalid REPLY_DEADLINES, using defaults: {e}")
+        return cls(deadlines, **kwargs)
+
+    def add_tier(self, tier):
+        self.tiers[tier.name] = tier
+
+    def route(self, reply_class):
+        deadline = self.deadlines.get(reply_class, DEFAULT_DEADLINES[REPLY_MENTION])
+        wanted = self.rng.randint(*REPLY_TOKENS)  # Vary response length
+        decision = RouteDecision(TIER_TEMPLATE, None, 0, deadline, 0.0)
+        preferred = self.preferences.get(reply_class, TIER_PREFERENCES[REPLY_MENTION])
+        if not any(name in self.tiers for name in preferred):
+            # None of this class's models is configured (the local backend has no small model)
+            preferred = TIER_PREFERENCES[REPLY_MENTION]
+        for name in preferred:
+            tier = self.tiers.get(name)
+            if tier is None or not tier.available():
+                continue
+            wait = tier.queue_wait()
+            tokens = min(wanted, tier.affordable_tokens(deadline - wait))
+            if tokens < MIN_REPLY_TOKENS and tier.probe():
+                tokens = MIN_REPLY_TOKENS
+            if tokens >= MIN_REPLY_TOKENS:
+                decision = RouteDecision(name, tier, tokens, deadline, wait + tier.predict(tokens))
+                break
+        key = (reply_class, decision.tier)
+        self.routed[key] = self.routed.get(key, 0) + 1
+        return decision
+
+    def record(self, reply_class, decision, seconds):
+        """How long the routed reply actually took, against its deadline"""
+        if reply_class not in self.deadline_met:
+            return
+        if seconds <= decision.deadline:
+            self.deadline_met[reply_class] += 1
+        else:
+            self.deadline_missed[reply_class] += 1
+
+    def stats(self):
+        stats = {
+            'routed': {f"{reply_class}/{tier}": count for (reply_class, tier), count in self.routed.items()},
+            'deadline_met': dict(self.deadline_met),
+            'deadline_missed': dict(self.deadline_missed),
+        }
+        for name, tier in self.tiers.items():
+            stats[name] = tier.stats()
+        return stats
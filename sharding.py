@@ -0,0 +1,422 @@
+"""Shard assignment, a multi-process launcher, and state shared between shard processes
+
+A guild's messages always arrive on the same shard, so conversations partition cleanly by
+process. The state backend is for whatever has to be seen bot-wide: budgets, counters and
+totals such as the guild count.
+
+Usage (standalone state server for shards on several hosts):
+    python sharding.py --state-server --host 0.0.0.0 --port 7379
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))  # 0 = unsharded, or Discord's recommendation when launching
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', '1'))  # Worker processes main.py launches
+SHARD_IDS = os.getenv('SHARD_IDS')  # "0,1,2": shards this process runs (set by the launcher or per host)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')  # memory, or host:port of a state server
+STATE_SERVER_PORT = int(os.getenv('STATE_SERVER_PORT', '0'))  # Launcher's state server; 0 picks a free port
+STATE_TIMEOUT = float(os.getenv('STATE_TIMEOUT', '1'))  # Seconds per state call before giving up
+SHARD_RESTART_DELAY = 5.0  # Seconds before the launcher restarts a crashed worker
+
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+def parse_shard_ids(value):
+    """"0,1,2" or "0-3" -> list of shard ids; None when unset"""
+    if not value:
+        return None
+    shard_ids = []
+    for part in value.split(','):
+        first, _, last = part.strip().partition('-')
+        shard_ids.extend(range(int(first), int(last or first) + 1))
+    return shard_ids
+
+
+def assign_shards(shard_count, processes):
+    """Split shards into contiguous blocks, one per process"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    plan = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        plan.append(list(range(start, end)))
+        start = end
+    return plan
+
+
+def shard_for_guild(guild_id, shard_count):
+    """The shard Discord delivers a guild's events on"""
+    return (guild_id >> 22) % shard_count
+
+
+async def recommended_shard_count(token):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(DISCORD_GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+# --- Shared state ---
+
+class StateBackend:
+    """Interface: small key/value store plus atomic counters and token buckets
+
+    Values must be JSON-serializable. ttl is in seconds; None keeps the key until deleted.
+    """
+    name = 'base'
+
+    async def start(self):
+        pass
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def incr(self, key, amount=1, ttl=None):
+        """Add amount to a numeric key (0 if missing) and return the new value"""
+        raise NotImplementedError
+
+    async def acquire(self, key, rate, capacity, cost=1):
+        """Take cost tokens from a bucket refilled at rate/second up to capacity; False if short"""
+        raise NotImplementedError
+
+    async def items(self, prefix):
+        """{key: value} for every live key starting with prefix"""
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    async def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """Process-local state; also what the state server keeps behind its socket"""
+    name = 'memory'
+
+    OPS = ('get', 'set', 'delete', 'incr', 'acquire', 'items')
+    SWEEP_EVERY = 10000  # acquire() calls between sweeps of idle buckets
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at or None)
+        self._buckets = {}  # key -> [tokens, last_refill, rate, capacity]
+        self._acquires = 0
+        self.calls = 0
+
+    def apply(self, op, args):
+        """Run one operation synchronously (the state server's dispatch)"""
+        if op not in self.OPS:
+            raise ValueError(f"unknown state operation {op!r}")
+        self.calls += 1
+        return getattr(self, f'_{op}')(*args)
+
+    def _live(self, key, now):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._values[key]
+            return None
+        return entry
+
+    def _get(self, key):
+        entry = self._live(key, time.monotonic())
+        return entry[0] if entry is not None else None
+
+    def _set(self, key, value, ttl=None):
+        self._values[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+
+    def _delete(self, key):
+        self._values.pop(key, None)
+        self._buckets.pop(key, None)
+
+    def _incr(self, key, amount=1, ttl=None):
+        now = time.monotonic()
+        entry = self._live(key, now)
+        if entry is None:
+            # The ttl starts with the first increment, giving a fixed window
+            entry = (0, now + ttl if ttl is not None else None)
+        value = entry[0] + amount
+        self._values[key] = (value, entry[1])
+        return value
+
+    def _acquire(self, key, rate, capacity, cost=1):
+        now = time.monotonic()
+        self._acquires += 1
+        if self._acquires % self.SWEEP_EVERY == 0:
+            self._sweep_buckets(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now, rate, capacity]
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        bucket[2] = rate
+        bucket[3] = capacity
+        if bucket[0] < cost:
+            return False
+        bucket[0] -= cost
+        return True
+
+    def _sweep_buckets(self, now):
+        # A bucket that would have refilled completely is indistinguishable from a new one
+        idle = [key for key, (tokens, last, rate, capacity) in self._buckets.items()
+                if rate and tokens + (now - last) * rate >= capacity]
+        for key in idle:
+            del self._buckets[key]
+
+    def _items(self, prefix):
+        now = time.monotonic()
+        return {key: entry[0] for key in [k for k in self._values if k.startswith(prefix)]
+                if (entry := self._live(key, now)) is not None}
+
+    async def get(self, key):
+        return self.apply('get', (key,))
+
+    async def set(self, key, value, ttl=None):
+        return self.apply('set', (key, value, ttl))
+
+    async def delete(self, key):
+        return self.apply('delete', (key,))
+
+    async def incr(self, key, amount=1, ttl=None):
+        return self.apply('incr', (key, amount, ttl))
+
+    async def acquire(self, key, rate, capacity, cost=1):
+        return self.apply('acquire', (key, rate, capacity, cost))
+
+    async def items(self, prefix):
+        return self.apply('items', (prefix,))
+
+    def stats(self):
+        return {'keys': len(self._values), 'buckets': len(self._buckets), 'calls': self.calls}
+
+
+class SocketStateBackend(StateBackend):
+    """Client for a StateServer: newline-delimited JSON requests, pipelined over one connection"""
+    name = 'socket'
+
+    def __init__(self, host, port, timeout=STATE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = {}  # request id -> Future
+        self._ids = itertools.count()
+        self._connect_lock = asyncio.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.reconnects = 0
+
+    async def start(self):
+        await self._connect()
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout=self.timeout)
+            self._read_task = asyncio.create_task(self._read_responses(self._reader, self._writer))
+            self.reconnects += 1
+
+    async def _read_responses(self, reader, writer):
+        error = ConnectionError("state server closed the connection")
+        try:
+            async for line in reader:
+                response = json.loads(line)
+                future = self._pending.pop(response['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in response:
+                    future.set_exception(RuntimeError(response['error']))
+                else:
+                    future.set_result(response['result'])
+        except (OSError, ValueError) as e:
+            error = ConnectionError(f"state connection failed: {e}")
+        finally:
+            # Anything still waiting will never get an answer on this connection
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            writer.close()
+
+    async def _call(self, op, *args):
+        self.calls += 1
+        try:
+            await self._connect()
+            request_id = next(self._ids)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = future
+            self._writer.write(json.dumps({'id': request_id, 'op': op, 'args': args}).encode() + b'\n')
+            return await asyncio.wait_for(future, timeout=self.timeout)
+        except Exception:
+            self.errors += 1
+            raise
+
+    async def get(self, key):
+        return await self._call('get', key)
+
+    async def set(self, key, value, ttl=None):
+        return await self._call('set', key, value, ttl)
+
+    async def delete(self, key):
+        return await self._call('delete', key)
+
+    async def incr(self, key, amount=1, ttl=None):
+        return await self._call('incr', key, amount, ttl)
+
+    async def acquire(self, key, rate, capacity, cost=1):
+        return await self._call('acquire', key, rate, capacity, cost)
+
+    async def items(self, prefix):
+        return await self._call('items', prefix)
+
+    def stats(self):
+        return {'calls': self.calls, 'errors': self.errors, 'connections': self.reconnects,
+                'in_flight': len(self._pending)}
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            await asyncio.gather(self._read_task, return_exceptions=True)
+
+
+class StateServer:
+    """Serves a MemoryStateBackend to shard processes over TCP"""
+
+    def __init__(self, backend=None, host='127.0.0.1', port=0):
+        self.backend = backend or MemoryStateBackend()
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"🗄️ State server listening on {self.address}")
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    async def _serve(self, reader, writer):
+        try:
+            async for line in reader:
+                request = json.loads(line)
+                try:
+                    response = {'id': request['id'], 'result': self.backend.apply(request['op'], request['args'])}
+                except Exception as e:
+                    response = {'id': request['id'], 'error': str(e)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ State client dropped: {e}")
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+def create_state_backend(spec=STATE_BACKEND):
+    """Build the backend selected by STATE_BACKEND"""
+    if spec == 'memory':
+        return MemoryStateBackend()
+    host, _, port = spec.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"unknown state backend {spec!r} (expected memory or host:port)")
+    return SocketStateBackend(host, int(port))
+
+
+# --- Launcher ---
+
+async def run_cluster(script, token, processes=SHARD_PROCESSES, shard_count=SHARD_COUNT):
+    """Run `script` once per process, each with its own SHARD_IDS, sharing one state server"""
+    if not shard_count:
+        shard_count = max(processes, await recommended_shard_count(token))
+    plan = assign_shards(shard_count, processes)
+
+    state_server = StateServer(port=STATE_SERVER_PORT)
+    await state_server.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    async def supervise(index, shard_ids):
+        env = dict(os.environ, SHARD_IDS=','.join(map(str, shard_ids)), SHARD_COUNT=str(shard_count),
+                   SHARD_PROCESSES='1', STATE_BACKEND=state_server.address)
+        if os.getenv('PORT'):
+            # The first worker keeps the platform's PORT (health checks); the rest take the next ports
+            env['PORT'] = str(int(os.environ['PORT']) + index)
+        while not stopping.is_set():
+            process = await asyncio.create_subprocess_exec(sys.executable, script, env=env)
+            logger.info(f"🧩 Shards {shard_ids} running in pid {process.pid}")
+            exited = asyncio.ensure_future(process.wait())
+            stop = asyncio.ensure_future(stopping.wait())
+            await asyncio.wait({exited, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if stopping.is_set():
+                process.terminate()
+                await exited
+                return
+            stop.cancel()
+            logger.error(f"❌ Shards {shard_ids} exited with {process.returncode}; "
+                         f"restarting in {SHARD_RESTART_DELAY:.0f}s")
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=SHARD_RESTART_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    logger.info(f"🧩 Launching {shard_count} shards across {len(plan)} processes")
+    try:
+        await asyncio.gather(*(supervise(index, shard_ids) for index, shard_ids in enumerate(plan)))
+    finally:
+        await state_server.close()
+
+
+def launch(script, token, processes=SHARD_PROCESSES, shard_count=SHARD_COUNT):
+    asyncio.run(run_cluster(script, token, processes, shard_count))
+
+
+async def _serve_forever(host, port):
+    server = StateServer(host=host, port=port)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--state-server', action='store_true', help='run a standalone state server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7379)
+    args = parser.parse_args()
+    if not args.state_server:
+        parser.error('nothing to do (did you mean --state-server?)')
+    asyncio.run(_serve_forever(args.host, args.port))
@@ -0,0 +1,265 @@
+"""SQLite (WAL) persistence for conversation state with write-behind flushes and lazy page-in"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_DB_PATH = os.getenv('CONVERSATION_DB_PATH')  # Unset keeps conversations in memory only
+STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '2'))  # Seconds between write-behind flushes
+STORAGE_FLUSH_BATCH = int(os.getenv('STORAGE_FLUSH_BATCH', '5000'))  # Rows per transaction
+STORAGE_COMPACT_BATCH = 10000  # Expired rows deleted per statement during compaction
+SNAPSHOT_CHUNK = 2000  # Dirty records copied between yields to the event loop
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    user_name TEXT NOT NULL,
+    history TEXT NOT NULL,
+    topics TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    personality_score REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, channel_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+CREATE TABLE IF NOT EXISTS channel_contexts (
+    channel_id INTEGER PRIMARY KEY,
+    lines TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_contexts_updated_at ON channel_contexts (updated_at);
+"""
+
+
+class ConversationRow:
+    """One stored conversation as loaded from disk"""
+    __slots__ = ('history', 'topics', 'user_name', 'message_count', 'personality_score', 'age')
+
+    def __init__(self, history, topics, user_name, message_count, personality_score, age):
+        self.history = history
+        self.topics = topics
+        self.user_name = user_name
+        self.message_count = message_count
+        self.personality_score = personality_score
+        self.age = age  # Seconds since the conversation was last active
+
+
+class ConversationStore:
+    """Write-behind store: the message path only marks records dirty; flush() writes them in a thread
+
+    Reads use their own connection on the event loop thread. They are single-row primary key
+    lookups, and WAL mode means they never wait for a flush that is in progress.
+    """
+
+    def __init__(self, path=CONVERSATION_DB_PATH, flush_batch=STORAGE_FLUSH_BATCH):
+        self.path = path
+        self.flush_batch = flush_batch
+        self._writer = self._connect()
+        with self._writer:
+            self._writer.executescript(_SCHEMA)
+        self._reader = self._connect()
+        self._write_lock = threading.Lock()  # One flush or compaction at a time
+        self._flush_lock = asyncio.Lock()  # Keeps flushes in order so an older snapshot never lands last
+        self._dirty_conversations = {}  # key -> Conversation, written as of the next flush
+        self._dirty_channels = {}  # channel_id -> ChannelContext
+        self.loads = 0
+        self.load_misses = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.compacted = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum only takes effect if it is set before the file gets its first page
+        connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        connection.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode NORMAL only risks the last flush on power loss, never corruption
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    # --- Message path (event loop, no I/O) ---
+
+    def mark_conversation(self, conv):
+        self._dirty_conversations[conv.key] = conv
+
+    def mark_channel(self, channel_id, context):
+        self._dirty_channels[channel_id] = context
+
+    @property
+    def pending(self):
+        return len(self._dirty_conversations) + len(self._dirty_channels)
+
+    # --- Lazy page-in ---
+
+    def load_conversation(self, key, max_age):
+        """Stored conversation for key if it was active within max_age seconds, else None"""
+        row = self._reader.execute(
+            'SELECT history, topics, user_name, message_count, personality_score, updated_at '
+            'FROM conversations WHERE user_id = ? AND channel_id = ?', key).fetchone()
+        if row is None:
+            self.load_misses += 1
+            return None
+        age = time.time() - row[5]
+        if age > max_age:
+            self.load_misses += 1
+            return None
+        self.loads += 1
+        return ConversationRow(json.loads(row[0]), json.loads(row[1]), row[2], row[3], row[4], age)
+
+    def load_channel(self, channel_id, max_age):
+        """(lines, age) for a channel active within max_age seconds, else None"""
+        row = self._reader.execute(
+            'SELECT lines, updated_at FROM channel_contexts WHERE channel_id = ?', (channel_id,)).fetchone()
+        if row is None:
+            return None
+        age = time.time() - row[1]
+        return (json.loads(row[0]), age) if age <= max_age else None
+
+    # --- Write-behind ---
+
+    def _swap_dirty(self):
+        dirty = (self._dirty_conversations, self._dirty_channels)
+        self._dirty_conversations = {}
+        self._dirty_channels = {}
+        return dirty
+
+    def _restore_dirty(self, conversations, channels):
+        """Put back records from a flush that failed; anything marked since then is already there"""
+        for key, conv in conversations.items():
+            self._dirty_conversations.setdefault(key, conv)
+        for channel_id, context in channels.items():
+            self._dirty_channels.setdefault(channel_id, context)
+
+    @staticmethod
+    def _rows(dirty_conversations, dirty_channels):
+        """Yield plain rows for dirty records; must run on the loop thread, where nothing mutates them mid-copy"""
+        now_wall = time.time()
+        now = time.monotonic()
+        for key, conv in dirty_conversations.items():
+            yield 'conversation', (key[0], key[1], conv.user_name, list(conv.history), list(conv.topics),
+                                   conv.message_count, conv.personality_score,
+                                   now_wall - (now - conv.last_activity))
+        for channel_id, context in dirty_channels.items():
+            yield 'channel', (channel_id, list(context.lines), now_wall - (now - context.last_activity))
+
+    @staticmethod
+    def _insert_batch(cursor, sql, rows):
+        cursor.execute('BEGIN')
+        try:
+            cursor.executemany(sql, rows)
+            cursor.execute('COMMIT')
+        except sqlite3.Error:
+            # Left open, the transaction would make every later BEGIN fail. SQLite rolls some
+            # errors (a full disk, say) back by itself, and then there is nothing to roll back.
+            if cursor.connection.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+
+    def _write(self, conversations, channels):
+        started = time.perf_counter()
+        with self._write_lock:
+            cursor = self._writer.cursor()
+            for start in range(0, len(conversations), self.flush_batch):
+                self._insert_batch(
+                    cursor, 'INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(user_id, channel_id, user_name, json.dumps(history), json.dumps(topics),
+                      message_count, personality_score, updated_at)
+                     for (user_id, channel_id, user_name, history, topics, message_count,
+                          personality_score, updated_at) in conversations[start:start + self.flush_batch]])
+            if channels:
+                self._insert_batch(
+                    cursor, 'INSERT OR REPLACE INTO channel_contexts VALUES (?, ?, ?)',
+                    [(channel_id, json.dumps(lines), updated_at) for channel_id, lines, updated_at in channels])
+        self.rows_written += len(conversations) + len(channels)
+        self.flushes += 1
+        self.flush_seconds += time.perf_counter() - started
+
+    async def flush(self):
+        """Write everything marked since the last flush without blocking the event loop"""
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            # Copy in chunks so a large backlog doesn't stall the loop; a record touched
+            # after the swap is marked again and goes out with the next flush
+            dirty = self._swap_dirty()
+            conversations, channels = [], []
+            try:
+                for index, (kind, row) in enumerate(self._rows(*dirty), 1):
+                    (conversations if kind == 'conversation' else channels).append(row)
+                    if index % SNAPSHOT_CHUNK == 0:
+                        await asyncio.sleep(0)
+                await asyncio.to_thread(self._write, conversations, channels)
+            except BaseException:
+                # The next flush retries them
+                self._restore_dirty(*dirty)
+                raise
+            return len(conversations) + len(channels)
+
+    def flush_sync(self):
+        """Blocking flush for shutdown and benchmarks"""
+        dirty = self._swap_dirty()
+        conversations, channels = [], []
+        try:
+            for kind, row in self._rows(*dirty):
+                (conversations if kind == 'conversation' else channels).append(row)
+            self._write(conversations, channels)
+        except BaseException:
+            self._restore_dirty(*dirty)
+            raise
+        return len(conversations) + len(channels)
+
+    # --- Maintenance ---
+
+    def _compact(self, max_age):
+        cutoff = time.time() - max_age
+        deleted = 0
+        with self._write_lock:
+            for table, key in (('conversations', 'user_id, channel_id'), ('channel_contexts', 'channel_id')):
+                while True:
+                    # Small batches keep each write transaction (and the WAL) short
+                    count = self._writer.execute(
+                        f'DELETE FROM {table} WHERE ({key}) IN '
+                        f'(SELECT {key} FROM {table} WHERE updated_at < ? LIMIT ?)',
+                        (cutoff, STORAGE_COMPACT_BATCH)).rowcount
+                    deleted += count
+                    if count < STORAGE_COMPACT_BATCH:
+                        break
+            # execute() would stop after the first freed page; executescript runs the pragma to completion
+            self._writer.executescript('PRAGMA incremental_vacuum')
+            self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.compacted += deleted
+        return deleted
+
+    async def compact(self, max_age):
+        """Delete rows idle longer than max_age, return freed pages and truncate the WAL"""
+        return await asyncio.to_thread(self._compact, max_age)
+
+    def count(self):
+        return self._reader.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'loads': self.loads,
+            'load_misses': self.load_misses,
+            'rows_written': self.rows_written,
+            'flushes': self.flushes,
+            'flush_seconds': self.flush_seconds,
+            'compacted': self.compacted,
+        }
+
+    def close(self):
+        """Flush whatever is still dirty and close both connections"""
+        if self.pending:
+            self.flush_sync()
+        with self._write_lock:
+            self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._writer.close()
+        self._reader.close()
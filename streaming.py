@@ -0,0 +1,87 @@
+"""Incremental delivery of streamed model output as one Discord message"""
+import asyncio
+import os
+import re
+import time
+
+# Discord allows roughly 5 edits per 5 seconds per channel; stay comfortably under that
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.2'))
+
+_SENTENCE_END_RE = re.compile(r'[.!?…](?=\s|$)|\n')
+
+
+async def _edit_message(message, text):
+    return await message.edit(content=text)
+
+
+class StreamingReply:
+    """Sends the first sentence as soon as it exists, then edits the message as more text arrives"""
+
+    def __init__(self, send, clean, prefix='', edit_interval=STREAM_EDIT_INTERVAL, edit=None):
+        self.send = send  # async callable(text) -> discord.Message
+        self.edit = edit or _edit_message  # async callable(message, text)
+        self.clean = clean  # callable(raw continuation) -> display text
+        self.prefix = prefix
+        self.edit_interval = edit_interval
+        self.message = None
+        self.raw = ''
+        self.shown = ''
+        self.edits = 0
+        self.started_at = time.monotonic()
+        self.first_sent_at = None
+        self._last_edit = 0.0
+
+    def _render(self, text):
+        return f"{self.prefix} {text}" if self.prefix else text
+
+    async def feed(self, chunk):
+        """Dispatcher stream callback: called with each new piece of generated text"""
+        self.raw += chunk
+        text = self.clean(self.raw)
+
+        if self.message is None:
+            # Wait for a complete first sentence so the message never starts mid-thought
+            ends = [match.end() for match in _SENTENCE_END_RE.finditer(text)]
+            if ends and len(text[:ends[-1]].strip()) > 3:
+                await self._send(text[:ends[-1]].strip())
+            return
+
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            # Don't show a half-typed word
+            cut = max(text.rfind(' '), text.rfind('\n'))
+            visible = text[:cut].rstrip() if cut > 0 else text
+            if len(visible) > len(self.shown_text):
+                await self._edit(visible)
+
+    @property
+    def shown_text(self):
+        return self.shown[len(self.prefix) + 1:] if self.prefix and self.shown else self.shown
+
+    async def finish(self, final_text):
+        """Deliver the complete reply: one send if nothing went out yet, else a last (rate-limited) edit"""
+        if self.message is None:
+            await self._send(final_text)
+            return self.message
+
+        if self._render(final_text) != self.shown:
+            wait = self.edit_interval - (time.monotonic() - self._last_edit)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._edit(final_text)
+        return self.message
+
+    async def _send(self, text):
+        self.shown = self._render(text)
+        self.message = await self.send(self.shown)
+        self.first_sent_at = time.monotonic()
+        self._last_edit = self.first_sent_at
+
+    async def _edit(self, text):
+        self.shown = self._render(text)
+        self._last_edit = time.monotonic()
+        await self.edit(self.message, self.shown)
+        self.edits += 1
+
+    @property
+    def time_to_first_send(self):
+        return self.first_sent_at - self.started_at if self.first_sent_at else None